@@ -0,0 +1,89 @@
+import argparse
+import time
+
+import numpy as np
+
+from models.ann import IVFPQIndex, ivfpq_topk
+from models.retrieval import batch_topk
+from models.store import EmbeddingStore
+from models.vectorize import ClueVectorizer
+
+
+def read_clues(path):
+    """(answer, clue tokens) pairs from a '*-entries-test.txt' file, which has one clue per line
+    with the answer as its first token"""
+    clues = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            tokens = line.split()
+            if len(tokens) > 1:
+                clues.append((tokens[0], tokens[1:]))
+    return clues
+
+
+def answer_recall(search, vectors, clue_vecs, answers, vocab, k):
+    """Fraction of clues whose answer is in the top 'k' results of 'search', and the mean latency per clue"""
+    found = 0
+    start_time = time.perf_counter()
+    for clue_vec, answer in zip(clue_vecs, answers):
+        ids, _ = search(vectors, clue_vec[None, :], k)
+        found += any(vocab[i].lower() == answer for i in ids[0])
+    latency = (time.perf_counter() - start_time) / len(answers)
+    return found / len(answers), latency
+
+
+if __name__ == '__main__':
+    script_desc = 'Measure recall of the correct answer against latency for the IVF-PQ index of the compiled store'
+    parser = argparse.ArgumentParser(description=script_desc)
+    parser.add_argument('filename', type=str, nargs='?', default='gquick-1000',
+                        help='Dataset to use, excluding \'-entries-test.txt\' suffix. Defaults to gquick-1000')
+    parser.add_argument('--store', dest='store', type=str, default='./data/GoogleNews-store',
+                        help='Compiled model store with an IVF-PQ index (see build_store.py --ann)')
+    parser.add_argument('--nprobe', dest='nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64, 128],
+                        help='Numbers of lists to scan per clue')
+    parser.add_argument('--topn', dest='topn', type=int, default=1000,
+                        help='Count the answer as recalled if it is in the top \'topn\'. Defaults to 1000')
+    parser.add_argument('--plot', dest='plot', type=str, default=None,
+                        help='Save a plot of recall against latency to this file (requires matplotlib)')
+    args = parser.parse_args()
+
+    clues = read_clues(f'./data/{args.filename}-entries-test.txt')
+    model = EmbeddingStore(args.store, spelling=False)
+    index = IVFPQIndex.load(args.store)
+    vocab = model.index_to_key
+
+    # Clues with no word in the vocabulary have no vector to search with
+    vectorizer = ClueVectorizer(model)
+    clue_vecs, errors = vectorizer.vectorize_batch([tokens for _, tokens in clues], pooling='mean')
+    usable = [len(e) < len(tokens) for e, (_, tokens) in zip(errors, clues)]
+    clue_vecs = clue_vecs[usable]
+    answers = [answer.lower() for (answer, _), ok in zip(clues, usable) if ok]
+    print(f'{args.filename}: {len(answers)} clues, recall@{args.topn}')
+
+    exact_recall, exact_latency = answer_recall(batch_topk, model.vectors, clue_vecs, answers, vocab, args.topn)
+    print(f'  exact      : recall {exact_recall:.2%}, {exact_latency * 1000:.1f} ms/clue')
+
+    results = []
+    for nprobe in args.nprobe:
+        def search(vectors, queries, k):
+            return ivfpq_topk(vectors, queries, k, index=index, nprobe=nprobe)
+        recall, latency = answer_recall(search, model.vectors, clue_vecs, answers, vocab, args.topn)
+        results.append((nprobe, recall, latency))
+        print(f'  nprobe {nprobe:>4}: recall {recall:.2%}, {latency * 1000:.1f} ms/clue')
+
+    if args.plot is not None:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+        _, recalls, latencies = zip(*results)
+        plt.plot(np.asarray(latencies) * 1000, recalls, marker='o', label='IVF-PQ')
+        for nprobe, recall, latency in results:
+            plt.annotate(str(nprobe), (latency * 1000, recall))
+        plt.scatter([exact_latency * 1000], [exact_recall], color='black', label='exact')
+        plt.xscale('log')
+        plt.xlabel('Latency per clue (ms)')
+        plt.ylabel(f'Recall of correct answer @ {args.topn}')
+        plt.title(args.filename)
+        plt.legend()
+        plt.savefig(args.plot)
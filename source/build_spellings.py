@@ -0,0 +1,40 @@
+import argparse
+import os
+import time
+
+from models.amer_brit import wordpairs
+from models.spelling import DEFAULT_WORDPAIRS, generate_wordpairs, write_wordpairs
+from models.store import read_store_vocab, spelling_aliases
+from models.w2v_reader import read_vocab
+
+
+if __name__ == '__main__':
+    script_desc = 'Generate British/American spelling pairs for the W2V vocabulary, used by run_nbow.py and build_store.py'
+    parser = argparse.ArgumentParser(description=script_desc)
+    parser.add_argument('--model', dest='model', type=str, default='./data/GoogleNews-vectors-negative300.bin.gz',
+                        help='Path to the word2vec binary. Defaults to the GoogleNews model in \'./data\'')
+    parser.add_argument('--store', dest='store', type=str, default='./data/GoogleNews-store',
+                        help='Compiled model store to read the vocabulary from, if there is one (see build_store.py)')
+    parser.add_argument('--output', dest='output', type=str, default=DEFAULT_WORDPAIRS,
+                        help=f'Lookup file to write the pairs to. Defaults to \'{DEFAULT_WORDPAIRS}\'')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    # Only the vocabulary is needed, not the vectors
+    if os.path.isfile(os.path.join(args.store, 'meta.json')):
+        words = read_store_vocab(args.store, spelling=False)
+    else:
+        words = read_vocab(args.model)
+
+    # The hand-written list covers irregular pairs (e.g. aeroplane, airplane) that no rule finds
+    pairs, counts = generate_wordpairs(words, wordpairs)
+    write_wordpairs(pairs, args.output)
+
+    print(f'Wrote {len(pairs)} spelling pairs to "{args.output}" in {(time.time()-start_time)/60:.1f} mins.')
+    for name, count in counts.items():
+        print(f'  {name:>5}: {count} pairs')
+    print(f'  {len(pairs) - len(set(brit for brit, _ in wordpairs))} pairs not in the hand-written list')
+    # British forms already in the vocabulary keep their own vectors
+    brits, _ = spelling_aliases(words, dict(zip(words, range(len(words)))), pairs)
+    print(f'  {len(brits)} British spellings not in the vocabulary, added to the store as aliases')
+    print('Run build_store.py to rebuild the compiled store with them.')
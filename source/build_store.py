@@ -0,0 +1,56 @@
+import argparse
+import os
+import time
+
+from models.ann import IVFPQIndex
+from models.pca import write_projection
+from models.quantize import write_quantized
+from models.spelling import read_wordpairs
+from models.store import EmbeddingStore, build_store, is_stale
+
+
+if __name__ == '__main__':
+    script_desc = 'Compile the pre-trained W2V model into a memory-mappable store used by run_nbow.py'
+    parser = argparse.ArgumentParser(description=script_desc)
+    parser.add_argument('--model', dest='model', type=str, default='./data/GoogleNews-vectors-negative300.bin.gz',
+                        help='Path to the word2vec binary. Defaults to the GoogleNews model in \'./data\'')
+    parser.add_argument('--store', dest='store', type=str, default='./data/GoogleNews-store',
+                        help='Directory to write the store to. Defaults to \'./data/GoogleNews-store\'')
+    parser.add_argument('--force', dest='force', action='store_true',
+                        help='Rebuild the store even if it is up to date')
+    parser.add_argument('--quantize', dest='quantize', nargs='+', default=[], choices=['float16', 'int8'],
+                        help='Also write quantised copies of the matrix, for run_nbow.py --precision')
+    parser.add_argument('--pca', dest='pca', nargs='+', type=int, default=[],
+                        help='Also write PCA-reduced copies of the matrix with these numbers of dimensions, for run_nbow.py --pca')
+    parser.add_argument('--ann', dest='ann', action='store_true',
+                        help='Also build an approximate nearest-neighbour (IVF-PQ) index, for run_nbow.py --nprobe')
+    parser.add_argument('--ann-lists', dest='ann_lists', type=int, default=None,
+                        help='Number of lists of the IVF-PQ index. Defaults to 4 * sqrt(number of vectors)')
+    args = parser.parse_args()
+    wordpairs = read_wordpairs()
+
+    if not os.path.isfile(args.model):
+        raise FileNotFoundError(f'Could not find "{args.model}". Run run_nbow.py once to download it.')
+
+    if not args.force and not is_stale(args.store, args.model, wordpairs):
+        print(f'Store at "{args.store}" is up to date')
+    else:
+        start_time = time.time()
+        meta = build_store(args.model, args.store, wordpairs)
+        print(f'Wrote {meta["size"]} vectors ({meta["size"] - meta["base_size"]} British spellings) '
+              f'to "{args.store}" in {(time.time()-start_time)/60:.1f} mins.')
+
+    for precision in args.quantize:
+        size = write_quantized(args.store, precision)
+        print(f'Wrote {precision} matrix ({size / 2**30:.2f} GB) to "{args.store}"')
+
+    for dims in args.pca:
+        kept = write_projection(args.store, dims)
+        print(f'Wrote {dims}-dimension PCA matrix ({kept:.1%} of variance kept) to "{args.store}"')
+
+    if args.ann:
+        start_time = time.time()
+        index = IVFPQIndex.build(EmbeddingStore(args.store).vectors, n_lists=args.ann_lists)
+        index.save(args.store)
+        print(f'Wrote IVF-PQ index ({len(index.centroids)} lists, {index.codes.shape[1]} bytes per vector) '
+              f'to "{args.store}" in {(time.time()-start_time)/60:.1f} mins.')
@@ -1,12 +1,12 @@
 import json
 
-from models.amer_brit import wordpairs
+from models.spelling import read_wordpairs
 
 
 if __name__=='__main__':
     d1 = {}
     d2 = {}
-    for brit, amer in wordpairs:
+    for brit, amer in read_wordpairs():
         d1[brit] = amer
         d2[amer] = brit
     
@@ -0,0 +1,210 @@
+import re
+
+import numpy as np
+
+from .store import vocab_keys
+from .vocab_index import _group
+
+
+WORD_PATTERN = re.compile(r'[a-z]+')
+
+# Most phrases 'AnagramSolver.top_phrases' keeps as answer candidates
+MAX_PHRASES = 1000
+
+
+def letter_counts(letters):
+    """Count of each letter a-z in a lowercase string, as an array of length 26"""
+    codes = np.frombuffer(letters.encode('ascii'), dtype=np.uint8) - ord('a')
+    return np.bincount(codes, minlength=26)
+
+
+class AnagramSolver:
+    def __init__(self, words):
+        """Solver for anagrams whose answer is a phrase of several vocabulary words.
+
+        Keeps a V x 26 array of letter counts for every distinct lowercase vocabulary word made of the
+        letters a-z only. Words are bucketed by length, so each token of the answer is only looked for
+        among words of the right length, and multiset subtraction over a bucket is one vectorised
+        comparison.
+
+        Args:
+            words: list of vocabulary words, ordered by row.
+        """
+        first_rows = {}
+        for row, word in enumerate(words):
+            word = word.lower()
+            if word not in first_rows and WORD_PATTERN.fullmatch(word):
+                first_rows[word] = row
+
+        self.vocab_size = len(words)
+        self.words = list(first_rows)
+        self.rows = np.fromiter(first_rows.values(), dtype=np.int64, count=len(first_rows))
+        self.lengths = np.fromiter(map(len, self.words), dtype=np.int64, count=len(self.words))
+
+        # Letter counts of all words at once, from one buffer of their concatenated letters
+        codes = np.frombuffer(''.join(self.words).encode('ascii'), dtype=np.uint8) - ord('a')
+        owners = np.repeat(np.arange(len(self.words)), self.lengths)
+        counts = np.bincount(owners * 26 + codes, minlength=len(self.words) * 26)
+        self.counts = counts.reshape(len(self.words), 26).astype(np.uint8)
+
+        self._by_length = _group(self.lengths)
+        self._exact = {}
+
+    @classmethod
+    def from_arrays(cls, vocab_size, words, rows, lengths, counts):
+        """Solver from the arrays of one built before (e.g. in shared memory), for a vocabulary of
+        'vocab_size' words"""
+        solver = cls.__new__(cls)
+        solver.vocab_size = vocab_size
+        solver.words = list(words)
+        solver.rows = rows
+        solver.lengths = lengths
+        solver.counts = counts
+        solver._by_length = _group(lengths)
+        solver._exact = {}
+        return solver
+
+    @classmethod
+    def from_model(cls, w2v_model):
+        """Solver for the vocabulary of a model, built on first use and kept on the model"""
+        vocab = vocab_keys(w2v_model)
+        cached = getattr(w2v_model, '_anagram_solver', None)
+        if cached is None or cached.vocab_size != len(vocab):
+            cached = cls(vocab)
+            w2v_model._anagram_solver = cached
+        return cached
+
+    def _bucket(self, length):
+        return self._by_length.get(length, np.empty(0, dtype=np.int64))
+
+    def _exact_matches(self, length, remaining):
+        """Words of length 'length' using exactly the letters in 'remaining'"""
+        if length not in self._exact:
+            lookup = {}
+            for i in self._bucket(length):
+                lookup.setdefault(self.counts[i].tobytes(), []).append(i)
+            self._exact[length] = lookup
+        return self._exact[length].get(remaining.astype(np.uint8).tobytes(), [])
+
+    def iter_phrases(self, letters, token_lengths, block=10000):
+        """Lazily find every phrase of vocabulary words that uses exactly the letters in 'letters', with
+        one word of each length in 'token_lengths', in that order
+
+        Args:
+          letters       : anagram fodder, e.g. data[key]['anagram']
+          token_lengths : lengths of the words in the answer, e.g. data[key]['token_lengths']
+          block         : number of phrases to gather before yielding them
+
+        Yields:
+          2D arrays of vocabulary row ids, one phrase per row
+
+        """
+        letters = re.sub(r'[^a-z]', '', letters.lower())
+        if len(token_lengths) == 0 or sum(token_lengths) != len(letters):
+            return
+
+        target = letter_counts(letters).astype(np.int16)
+
+        # Words that fit within the whole fodder, for every token of the answer
+        fits = []
+        for length in token_lengths:
+            bucket = self._bucket(length)
+            fits.append(bucket[(self.counts[bucket] <= target).all(axis=1)])
+
+        pending, size = [], 0
+        for phrases in self._extend(fits, token_lengths, 0, target, []):
+            pending.append(phrases)
+            size += len(phrases)
+            if size >= block:
+                yield self.rows[np.concatenate(pending)]
+                pending, size = [], 0
+        if pending:
+            yield self.rows[np.concatenate(pending)]
+
+    def solve(self, letters, token_lengths, limit=None):
+        """Find phrases of vocabulary words that use exactly the letters in 'letters', with one word of
+        each length in 'token_lengths', in that order
+
+        Args:
+          letters       : anagram fodder, e.g. data[key]['anagram']
+          token_lengths : lengths of the words in the answer, e.g. data[key]['token_lengths']
+          limit         : stop after finding this many phrases, or None to find them all
+
+        Returns:
+          List of tuples of vocabulary row ids, one tuple per phrase
+
+        """
+        found = []
+        for phrases in self.iter_phrases(letters, token_lengths):
+            found.extend(map(tuple, phrases.tolist()))
+            if limit is not None and len(found) >= limit:
+                return found[:limit]
+        return found
+
+    def top_phrases(self, letters, token_lengths, score, limit=MAX_PHRASES):
+        """The 'limit' best-scoring phrases of 'solve'. Every phrase is found and scored, a block at a
+        time, so the phrases kept do not depend on the order they are found in
+
+        Args:
+          letters       : anagram fodder, e.g. data[key]['anagram']
+          token_lengths : lengths of the words in the answer, e.g. data[key]['token_lengths']
+          score         : function of a 2D array of row ids, one phrase per row, returning their scores
+          limit         : number of phrases to keep
+
+        Returns:
+          Tuple of (2D array of row ids, one phrase per row, their scores, number of phrases found),
+          best first. Ties keep the order the phrases were found in
+
+        """
+        best = np.empty((0, len(token_lengths)), dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        n_found = 0
+        for phrases in self.iter_phrases(letters, token_lengths):
+            n_found += len(phrases)
+            best = np.concatenate([best, phrases])
+            best_scores = np.concatenate([best_scores, np.asarray(score(phrases), dtype=np.float32)])
+            if len(best) > limit:
+                kept = np.sort(np.argsort(-best_scores, kind='stable')[:limit])
+                best, best_scores = best[kept], best_scores[kept]
+
+        order = np.argsort(-best_scores, kind='stable')
+        return best[order], best_scores[order], n_found
+
+    def _extend(self, fits, token_lengths, position, remaining, prefix):
+        # Word indexes of the phrases that complete 'prefix', one phrase per row. The last word must use
+        # up exactly the remaining letters
+        if position == len(token_lengths) - 1:
+            last = self._exact_matches(token_lengths[position], remaining)
+            if last:
+                phrases = np.empty((len(last), position + 1), dtype=np.int64)
+                phrases[:, :position] = prefix
+                phrases[:, position] = last
+                yield phrases
+            return
+
+        candidates = fits[position]
+        candidates = candidates[(self.counts[candidates] <= remaining).all(axis=1)]
+        for i in candidates:
+            yield from self._extend(fits, token_lengths, position + 1, remaining - self.counts[i], prefix + [i])
+
+
+def phrase_scores(vectors, phrases, query):
+    """Cosine similarity between 'query' and the sum of the vectors of each phrase's words
+
+    Args:
+      vectors : L2-normalised embedding matrix
+      phrases : list of tuples of row ids, as returned by 'AnagramSolver.solve', or a 2D array of them
+      query   : query vector, e.g. the clue vector
+
+    """
+    if len(phrases) == 0:
+        return np.empty(0, dtype=np.float32)
+
+    phrase_ids = np.asarray(phrases, dtype=np.int64)
+    phrase_vecs = np.asarray(vectors[phrase_ids.ravel()], dtype=np.float32)
+    phrase_vecs = phrase_vecs.reshape(phrase_ids.shape + (-1,)).sum(axis=1)
+    phrase_vecs /= np.maximum(np.linalg.norm(phrase_vecs, axis=1, keepdims=True), 1e-12)
+
+    query = np.asarray(query, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    return phrase_vecs @ query
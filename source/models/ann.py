@@ -0,0 +1,241 @@
+import json
+import os
+
+import numpy as np
+
+from .quantize import DEFAULT_RERANK, exact_scores
+from .retrieval import DEFAULT_MEMORY_BUDGET, _top_k, batch_topk
+
+
+# Number of lists probed per query when none is given
+DEFAULT_NPROBE = 32
+
+
+def _nearest(data, centroids, chunk=None):
+    """Index of the nearest centroid (by Euclidean distance) of every row of 'data', scoring 'chunk' rows
+    at a time. By default the block of scores is kept to about 2 MB, so that it stays in cache"""
+    if chunk is None:
+        chunk = max(1, 2**19 // len(centroids))
+    half_norms = 0.5 * (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk):
+        block = np.asarray(data[start:start+chunk], dtype=np.float32)
+        labels[start:start+chunk] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return labels
+
+
+def kmeans(data, n_clusters, n_iter=20, seed=0, spherical=False):
+    """Lloyd's k-means
+
+    Args:
+      data       : 2D float32 array
+      n_clusters : number of centroids
+      n_iter     : number of iterations
+      seed       : seed for the initial centroids and for reseeding empty clusters
+      spherical  : normalise the centroids after every update, for cosine similarity
+
+    Returns:
+      float32 array of shape (n_clusters, data.shape[1])
+
+    """
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _nearest(data, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        # Sum the rows of every cluster one dimension at a time, rather than with the unbuffered np.add.at
+        sums = np.stack([np.bincount(labels, weights=data[:, j], minlength=n_clusters)
+                         for j in range(data.shape[1])], axis=1).astype(np.float32)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+        if spherical:
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    return centroids
+
+
+class IVFPQIndex:
+    def __init__(self, centroids, codebooks, codes, list_offsets, list_rows):
+        """Inverted file index with product-quantised residuals over an L2-normalised embedding matrix.
+
+        Rows are assigned to the nearest of a set of k-means centroids (their list). The residual of
+        each row from its centroid is split into equal sub-vectors, and each sub-vector is stored as the
+        index of its nearest codeword, one byte per sub-vector. A query only scans the lists with the
+        closest centroids, and approximates the similarity of their rows from lookup tables of the
+        query's similarity with every codeword.
+
+        Args:
+            centroids: float32 array of shape (number of lists, dimension).
+            codebooks: float32 array of shape (number of sub-vectors, 256, sub-vector dimension).
+            codes: uint8 array with the codes of every row, ordered by list.
+            list_offsets: rows of list i are list_rows[list_offsets[i]:list_offsets[i+1]].
+            list_rows: row ids ordered by list.
+        """
+        self.centroids = centroids
+        self.codebooks = codebooks
+        self.codes = codes
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_subspaces=None, n_train=200000, n_iter=20, seed=0):
+        """Train an index on a sample of rows and encode every row of 'vectors'.
+
+        Args:
+            vectors: L2-normalised float32 embedding matrix (may be memory-mapped).
+            n_lists: number of lists. Defaults to 4 * sqrt(number of rows).
+            n_subspaces: number of sub-vectors per row, a divisor of the dimension. Defaults to the
+                largest divisor with sub-vectors of at least 6 dimensions.
+            n_train: number of sampled rows to train the centroids and codebooks on.
+            n_iter: number of k-means iterations.
+            seed: random seed.
+        """
+        n_rows, dim = vectors.shape
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(n_rows))
+        if n_subspaces is None:
+            n_subspaces = next(m for m in range(max(1, dim // 6), 0, -1) if dim % m == 0)
+        if dim % n_subspaces != 0:
+            raise ValueError(f'Number of sub-vectors ({n_subspaces}) must divide the dimension ({dim})')
+
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n_rows, min(n_train, n_rows), replace=False))
+        train = np.asarray(vectors[sample], dtype=np.float32)
+
+        n_lists = min(n_lists, len(train))
+        centroids = kmeans(train, n_lists, n_iter=n_iter, seed=seed, spherical=True)
+
+        # Codebooks for the residuals of each sub-vector
+        residuals = (train - centroids[_nearest(train, centroids)]).reshape(len(train), n_subspaces, -1)
+        n_codes = min(256, len(train))
+        codebooks = np.stack([kmeans(residuals[:, j], n_codes, n_iter=n_iter, seed=seed + j)
+                              for j in range(n_subspaces)])
+
+        # Encode every row, one chunk at a time
+        labels = np.empty(n_rows, dtype=np.int64)
+        codes = np.empty((n_rows, n_subspaces), dtype=np.uint8)
+        chunk = 100000
+        for start in range(0, n_rows, chunk):
+            block = np.asarray(vectors[start:start+chunk], dtype=np.float32)
+            block_labels = _nearest(block, centroids)
+            block_residuals = (block - centroids[block_labels]).reshape(len(block), n_subspaces, -1)
+            labels[start:start+chunk] = block_labels
+            for j in range(n_subspaces):
+                codes[start:start+chunk, j] = _nearest(block_residuals[:, j], codebooks[j])
+
+        list_rows = np.argsort(labels, kind='stable')
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))]).astype(np.int64)
+        return cls(centroids, codebooks, codes[list_rows], list_offsets, list_rows)
+
+    def save(self, store_dir):
+        """Write the index next to a compiled store"""
+        for name in ('centroids', 'codebooks', 'codes', 'list_offsets', 'list_rows'):
+            np.save(os.path.join(store_dir, f'ivfpq-{name}.npy'), getattr(self, name))
+        with open(os.path.join(store_dir, 'ivfpq.json'), 'w') as file:
+            json.dump({'n_rows': len(self.list_rows), 'n_lists': len(self.centroids),
+                       'n_subspaces': self.codebooks.shape[0]}, file)
+
+    @classmethod
+    def load(cls, store_dir, mmap=True):
+        """Read an index saved by 'save'. Raises FileNotFoundError if the store has none."""
+        if not os.path.isfile(os.path.join(store_dir, 'ivfpq.json')):
+            raise FileNotFoundError(f'Store at "{store_dir}" has no IVF-PQ index. '
+                                    f'Run source/build_store.py --ann to add it.')
+        mmap_mode = 'r' if mmap else None
+        return cls(*(np.load(os.path.join(store_dir, f'ivfpq-{name}.npy'), mmap_mode=mmap_mode)
+                     for name in ('centroids', 'codebooks', 'codes', 'list_offsets', 'list_rows')))
+
+    def probe_size(self, nprobe):
+        """Typical number of rows scanned by a query probing 'nprobe' lists"""
+        return int(np.ceil(len(self.list_rows) * min(nprobe, len(self.centroids)) / len(self.centroids)))
+
+    def scan(self, query, nprobe, mask=None):
+        """Approximate similarity of 'query' with the rows of its 'nprobe' closest lists
+
+        Args:
+          query : L2-normalised query vector
+          nprobe: number of lists to scan
+          mask  : optional boolean array over all rows; only rows where it is True are returned
+
+        Returns:
+          Tuple of (row ids, approximate scores)
+
+        """
+        coarse = self.centroids @ query
+        nprobe = min(nprobe, len(coarse))
+        lists = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        n_subspaces = self.codebooks.shape[0]
+        tables = np.einsum('jcd,jd->jc', self.codebooks, query.reshape(n_subspaces, -1))
+        positions = np.concatenate([np.arange(self.list_offsets[i], self.list_offsets[i+1]) for i in lists])
+        list_scores = np.repeat(coarse[lists], np.diff(self.list_offsets)[lists])
+
+        ids = np.asarray(self.list_rows[positions])
+        if mask is not None:
+            keep = mask[ids]
+            ids, positions, list_scores = ids[keep], positions[keep], list_scores[keep]
+
+        codes = np.asarray(self.codes[positions])
+        scores = list_scores + tables[np.arange(n_subspaces), codes].sum(axis=1)
+        return ids, scores.astype(np.float32)
+
+
+def ivfpq_topk(vectors, queries, k, memory_budget=DEFAULT_MEMORY_BUDGET, rows=None,
+               index=None, nprobe=DEFAULT_NPROBE, rerank=DEFAULT_RERANK):
+    """Approximate 'batch_topk' with an 'IVFPQIndex': scan the closest lists of every query, then
+    rescore the best 'rerank' candidates exactly in float32
+
+    Only rows in the probed lists can be returned, so a query may get fewer than 'k' rows. A search
+    restricted to fewer 'rows' than a query would scan is done exactly instead.
+
+    Args:
+      vectors       : L2-normalised float32 embedding matrix (may be memory-mapped)
+      queries       : 2D array of query vectors, one per row
+      k             : number of candidates to return per query
+      memory_budget : bytes available to exact searches of restricted rows
+      rows          : optional array of row ids; only these rows are searched
+      index         : 'IVFPQIndex' over 'vectors'
+      nprobe        : number of lists scanned per query
+      rerank        : number of candidates rescored exactly per query
+
+    Returns:
+      Tuple of (ids, scores), lists with one array per query sorted by descending score. The first
+      min(k, rerank) are ordered by exact score, with ties broken by row id
+
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    if rows is not None and len(rows) <= index.probe_size(nprobe):
+        ids, scores = batch_topk(vectors, queries, k, memory_budget, rows=rows)
+        return list(ids), list(scores)
+
+    mask = None
+    if rows is not None:
+        mask = np.zeros(len(index.list_rows), dtype=bool)
+        mask[rows] = True
+
+    all_ids, all_scores = [], []
+    for query in queries:
+        query = query / max(np.linalg.norm(query), 1e-12)
+        ids, scores = index.scan(query, nprobe, mask)
+
+        # Approximate top candidates, best first
+        n_best = max(k, rerank)
+        if len(ids) > n_best:
+            scores, ids = _top_k(scores[None], ids[None], n_best)
+            scores, ids = scores[0], ids[0]
+        order = np.lexsort((ids, -scores))
+        ids, scores = ids[order], scores[order]
+
+        # Exact order for the head of the list
+        head = min(rerank, len(ids))
+        head_scores = exact_scores(vectors, ids[:head], query)
+        order = np.lexsort((ids[:head], -head_scores))
+        ids[:head], scores[:head] = ids[:head][order], head_scores[order]
+
+        all_ids.append(ids[:k])
+        all_scores.append(scores[:k])
+
+    return all_ids, all_scores
@@ -0,0 +1,105 @@
+import numpy as np
+
+from .vocab_index import CanonicalVocab, VocabIndex, token_pattern
+
+
+def _per_form(canon_ids, values, n_forms):
+    """Spread per-row 'values' over canonical ids. Rows sharing a canonical id share its value"""
+    table = np.empty(n_forms, dtype=values.dtype)
+    table[canon_ids] = values
+    return table
+
+
+class FilterPipeline:
+    def __init__(self, canonical, vocab_index):
+        """Enhancement filters of 'nbow.master_base' as boolean masks over candidate ids.
+
+        Candidates are canonical ids (see 'CanonicalVocab'). The length and token-length pattern of
+        every canonical form are looked up in arrays spread from the rows of a 'VocabIndex', so
+        filtering a ranked list of candidates is a few vectorised comparisons instead of string
+        operations per word. Negative ids stand for words outside the vocabulary, such as anagram
+        phrases, which are kept in a short list of 'extra' words and measured directly.
+
+        Args:
+            canonical: 'CanonicalVocab' of the model.
+            vocab_index: 'VocabIndex' of the model.
+        """
+        n_forms = len(canonical)
+        self.forms = canonical.forms
+        self.form_to_id = canonical.form_to_id
+        self.lengths = _per_form(canonical.ids, vocab_index.lengths, n_forms)
+        self.pattern_codes = _per_form(canonical.ids, vocab_index.pattern_codes, n_forms)
+        self.pattern_to_code = vocab_index.pattern_to_code
+
+    @classmethod
+    def from_model(cls, w2v_model, vocab_index=None):
+        """Filters for a model, built on first use and kept on the model"""
+        canonical = CanonicalVocab.from_model(w2v_model)
+        cached = getattr(w2v_model, '_filter_pipeline', None)
+        if cached is None or len(cached.forms) != len(canonical):
+            if vocab_index is None:
+                vocab_index = VocabIndex.from_model(w2v_model)
+            cached = cls(canonical, vocab_index)
+            w2v_model._filter_pipeline = cached
+        return cached
+
+    def _lookup(self, table, ids, extra, measure):
+        values = table[np.maximum(ids, 0)]
+        negative = ids < 0
+        if extra and negative.any():
+            values[negative] = [measure(extra[-i - 1]) for i in ids[negative]]
+        return values
+
+    def clue_word(self, clue, extra=None):
+        """Stage dropping candidates that are words of the clue, as 'util.word_remover'"""
+        removed = [self.form_to_id[word] for word in clue if word in self.form_to_id]
+        if extra:
+            removed += [-j - 1 for j, word in enumerate(extra) if word in clue]
+        return lambda ids: ~np.isin(ids, removed)
+
+    def length(self, size, extra=None):
+        """Stage keeping candidates of length 'size', as 'util.len_filterer' and 'util.pretty_len_filterer'"""
+        return lambda ids: self._lookup(self.lengths, ids, extra, len) == size
+
+    def pattern(self, token_lengths, extra=None):
+        """Stage keeping candidates whose underscore-separated tokens have lengths 'token_lengths', as
+        'util.len_filterer_multi'"""
+        code = self.pattern_to_code.get(tuple(token_lengths), -1)
+        measure = lambda word: self.pattern_to_code.get(token_pattern(word), -2)
+        return lambda ids: self._lookup(self.pattern_codes, ids, extra, measure) == code
+
+    def stages(self, entry, clue, enhancements, extra=None):
+        """Filter stages that the 'enhancements' of 'master_base' switch on for a clue, in order
+
+        As in 'master_base', words of the clue are only removed when the length filter is on. Anagram
+        clues are not filtered here, since 'master_base' only searches the rows that are anagrams of
+        the clue (see 'VocabIndex.candidate_rows') and its anagram phrases are built from the letters.
+
+        Args:
+          entry        : dict for one clue in the dataset
+          clue         : list of tokens representing clue
+          enhancements : dictionary of constraints, as passed to 'master_base'
+          extra        : list of words that negative candidate ids stand for
+
+        Returns:
+          List of (name, function) pairs. Each function maps an array of candidate ids to a boolean
+          mask of the candidates to keep
+
+        """
+        stages = []
+        if enhancements['length'] != True:
+            return stages
+
+        if enhancements['clue_word'] == True:
+            stages.append(('clue_word', self.clue_word(clue, extra)))
+        stages.append(('length', self.length(len(entry['pretty_solution']), extra)))
+        if enhancements['multiword'] == True:
+            stages.append(('multiword', self.pattern(entry['token_lengths'], extra)))
+        return stages
+
+    def mask(self, ids, stages):
+        """Boolean mask of the candidate ids that pass every stage"""
+        mask = np.ones(len(ids), dtype=bool)
+        for _, stage in stages:
+            mask &= stage(ids)
+        return mask
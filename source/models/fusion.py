@@ -0,0 +1,198 @@
+import numpy as np
+
+from .retrieval import _top_k
+
+
+FUSION_METHODS = ('sum', 'min', 'rrf')
+
+
+def synonym_scores(vectors, syn_vecs, scales=None, projection=None):
+    """Cosine similarity of every synonym vector with every vocabulary row, one block of rows at a time
+
+    Args:
+      vectors    : L2-normalised embedding matrix, or a quantised or PCA-reduced copy of it (see
+                   quantize.py and pca.py)
+      syn_vecs   : 2D array with one (pooled) vector per synonym
+      scales     : row scales of an int8 quantised matrix, or None
+      projection : PCA components of a reduced matrix, or None
+
+    Returns:
+      float32 array of shape (number of synonyms, number of rows)
+
+    """
+    syn_vecs = np.atleast_2d(np.asarray(syn_vecs, dtype=np.float32))
+    norms = np.linalg.norm(syn_vecs, axis=1, keepdims=True)
+    syn_vecs = syn_vecs / np.where(norms > 0, norms, 1)
+    if projection is not None:
+        syn_vecs = syn_vecs @ projection
+
+    scores = np.empty((len(syn_vecs), len(vectors)), dtype=np.float32)
+    chunk = 100000
+    for start in range(0, len(vectors), chunk):
+        scores[:, start:start+chunk] = syn_vecs @ np.asarray(vectors[start:start+chunk], dtype=np.float32).T
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def depth_thresholds(scores, depth):
+    """Score of the 'depth'-th best row of each list, i.e. the score a row needs to be in its top 'depth'"""
+    n_rows = scores.shape[1]
+    depth = max(1, min(depth, n_rows))
+    return np.partition(scores, n_rows - depth, axis=1)[:, n_rows - depth]
+
+
+def ranking_members(scores, thresholds):
+    """Rows that reach the threshold of each list, in row order, with their scores. These are the
+    rankings read by 'fuse'"""
+    members = []
+    for row_scores, threshold in zip(scores, thresholds):
+        rows = np.flatnonzero(row_scores >= threshold)
+        members.append((rows, row_scores[rows]))
+    return members
+
+
+def _prefix(rows, values, prefix):
+    # Best 'prefix' rows of a ranking, and the score of the last of them
+    if prefix >= len(rows):
+        return rows, None
+    part = np.argpartition(-values, prefix - 1)[:prefix]
+    return rows[part], values[part].min()
+
+
+def _aggregate(values, method):
+    if method == 'sum':
+        return values.sum(axis=0)
+    return values.min(axis=0)
+
+
+def _top(ids, fused, k):
+    if len(ids) > k:
+        fused, ids = _top_k(fused[None], ids[None], k)
+        fused, ids = fused[0], ids[0]
+    order = np.lexsort((ids, -fused))
+    return ids[order], fused[order]
+
+
+def fuse(scores, k, depth, method='sum', rrf_k=60, thresholds=None, members=None):
+    """Fuse the rankings of several synonyms of a clue into one ranking of vocabulary rows
+
+    A row is only kept if it is within the top 'depth' rows of every synonym's ranking, as in the
+    original string intersection of 'nbow.multi_synonym'. Kept rows are ranked by the sum or minimum
+    of their scores, or by reciprocal rank fusion. Rows can be canonical ids scored by their best case
+    variant (see 'vocab_index.CanonicalVocab.segment_max'), with the 'thresholds' of the rankings of
+    the variants.
+
+    For 'sum' and 'min' the rankings are read in the style of the threshold algorithm: rows are
+    taken from the top of every ranking, a prefix at a time, and scored exactly. Reading stops once
+    'k' kept rows score more than the aggregate of the scores at the end of the prefixes, since no
+    unread row can beat or tie with that. For a small 'k' this stops long before 'depth'. Passing
+    the 'members' of the rankings means a prefix is only taken from the rows that reach the
+    thresholds, so fusing the same rankings again to a larger 'k' costs no pass over the whole
+    vocabulary.
+
+    Args:
+      scores     : array of shape (number of synonyms, number of rows), e.g. from 'synonym_scores'
+      k          : number of rows to return
+      depth      : a row must be within the top 'depth' of every ranking to be kept
+      method     : 'sum', 'min' or 'rrf'
+      rrf_k      : constant in the reciprocal rank fusion score 1 / (rrf_k + rank)
+      thresholds : score a row needs in each ranking to be kept, or None for the score of the
+                   'depth'-th best row
+      members    : 'ranking_members' of 'scores' and 'thresholds', or None to find them here
+
+    Returns:
+      Tuple of (row ids, fused scores), sorted by descending fused score. Empty if no row is within
+      the top 'depth' of every ranking
+
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f'Unknown fusion method "{method}" (must be one of {", ".join(FUSION_METHODS)})')
+
+    n_lists, n_rows = scores.shape
+    depth = min(depth, n_rows)
+    k = min(k, n_rows)
+    if depth == 0 or k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    if thresholds is None:
+        thresholds = depth_thresholds(scores, depth)
+    if members is None:
+        members = ranking_members(scores, thresholds)
+
+    if method == 'rrf':
+        # Ranks of the rows in every ranking, with ties broken by row id
+        ids = members[0][0]
+        for rows, _ in members[1:]:
+            ids = ids[np.isin(ids, rows, assume_unique=True)]
+        ranks = np.empty((n_lists, len(ids)), dtype=np.int64)
+        for j, (rows, values) in enumerate(members):
+            order = np.argsort(-values, kind='stable')
+            rank_of = np.empty(len(rows), dtype=np.int64)
+            rank_of[order] = np.arange(1, len(rows) + 1)
+            ranks[j] = rank_of[np.searchsorted(rows, ids)]
+        fused = (1.0 / (rrf_k + ranks)).sum(axis=0).astype(np.float32)
+        return _top(ids, fused, k)
+
+    # Threshold algorithm over growing prefixes of the rankings
+    longest = max(len(rows) for rows, _ in members)
+    prefix = min(longest, max(2 * k, 1000))
+    while True:
+        if prefix < longest:
+            frontier = thresholds.copy()
+            seen = np.zeros(n_rows, dtype=bool)
+            for j, (rows, values) in enumerate(members):
+                top, last = _prefix(rows, values, prefix)
+                seen[top] = True
+                if last is not None:
+                    frontier[j] = last
+            seen = np.flatnonzero(seen)
+        else:
+            # Every row kept is in the first ranking
+            frontier = thresholds
+            seen = members[0][0]
+
+        values = scores[:, seen]
+        kept = (values >= thresholds[:, None]).all(axis=0)
+        ids, fused = seen[kept], _aggregate(values[:, kept], method)
+
+        # Unread rows can at best tie with the frontier, and ties go to the lowest row id
+        if prefix >= longest or (fused > _aggregate(frontier, method)).sum() >= k:
+            return _top(ids, fused, k)
+        prefix = min(longest, prefix * 4)
+
+
+def fuse_lists(ids, scores, k, method='sum', rrf_k=60):
+    """Fuse rankings given as lists of candidates, e.g. from an approximate search, in the same way as
+    'fuse'. A row is only kept if it is in every list.
+
+    Args:
+      ids    : list with an array of row ids for each synonym, best first
+      scores : list with the matching arrays of scores
+      k      : number of rows to return
+      method : 'sum', 'min' or 'rrf'
+      rrf_k  : constant in the reciprocal rank fusion score 1 / (rrf_k + rank)
+
+    Returns:
+      Tuple of (row ids, fused scores), sorted by descending fused score
+
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f'Unknown fusion method "{method}" (must be one of {", ".join(FUSION_METHODS)})')
+
+    kept = ids[0]
+    for list_ids in ids[1:]:
+        kept = np.intersect1d(kept, list_ids)
+    kept = np.unique(kept)
+    if len(kept) == 0 or k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    # Score (or rank) of every kept row in every list
+    values = np.empty((len(ids), len(kept)), dtype=np.float32)
+    for j, (list_ids, list_scores) in enumerate(zip(ids, scores)):
+        order = np.argsort(list_ids, kind='stable')
+        positions = order[np.searchsorted(list_ids, kept, sorter=order)]
+        values[j] = 1.0 / (rrf_k + positions + 1) if method == 'rrf' else list_scores[positions]
+
+    fused = values.sum(axis=0) if method == 'rrf' else _aggregate(values, method)
+    return _top(kept, fused.astype(np.float32), k)
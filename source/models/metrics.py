@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def answer_word(solution, multiword):
+    """The candidate string that counts as the correct answer for a tokenised solution, or None if
+    no candidate can match (a multiword solution when the multiword enhancement is off)
+
+    Args:
+      solution  : list of tokenised words representing solution
+      multiword : whether candidates are split on '_' before comparing with the solution
+
+    """
+    if multiword:
+        return '_'.join(solution)
+    if len(solution) == 1:
+        return solution[0]
+    return None
+
+
+def rank_metrics(ranks):
+    """Model metrics in the format returned by 'nbow.master_base', from the rank of the correct answer
+    for every clue (0 where it was not found)
+
+    Args:
+      ranks : array of 1-based ranks, one per clue
+
+    """
+    ranks = np.asarray(ranks, dtype=np.int64)
+    found = ranks > 0
+
+    count_10 = int((found & (ranks <= 10)).sum())
+    count_100 = int((found & (ranks <= 100)).sum())
+    count_1000 = int((found & (ranks <= 1000)).sum())
+    rank1 = int((ranks == 1).sum())
+    rank_list100 = ranks[found & (ranks <= 100)].tolist()
+    rank_list1000 = ranks[found & (ranks <= 1000)].tolist()
+
+    return [count_10, count_100, rank_list100, rank_list1000, rank1, count_1000]
+
+
+def short_lists(keys, n_candidates, size):
+    """Keys of the clues that had fewer than 'size' answer candidates
+
+    Args:
+      keys         : list of clue keys
+      n_candidates : number of answer candidates for each clue
+      size         : minimum number of candidates
+
+    """
+    return [key for key, n in zip(keys, n_candidates) if n < size]
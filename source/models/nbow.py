@@ -1,29 +1,33 @@
+import contextlib
+
 import numpy as np
-import pandas as pd
 from tabulate import tabulate
 
-from .util import *
+from .fusion import depth_thresholds, fuse, fuse_lists, ranking_members, synonym_scores
+from .metrics import answer_word, rank_metrics, short_lists
+from .quantize import DEFAULT_RERANK, coarse_matrix, rescore_fused, search_function
+from .rankonly import rank_only_base
+from .retrieval import DEFAULT_MEMORY_BUDGET, DEFAULT_START_DEPTH
+from .store import EmbeddingStore, normed_vectors, vocab_scores
+from .vectorize import ClueVectorizer
+from .vocab_index import CanonicalVocab
 
 
 def key_adder(w2v_model, wordpairs):
     """Account for as many cases of british vs. american spelling as possible
-    in W2V vocabulary
+    in W2V vocabulary. British spellings are added in bulk as aliases of the rows of
+    their american counterparts, so no vectors are copied
 
     Args:
       w2v_model : standard Word2Vec 'KeyedVectors' data structure
       wordps    : dictionary of strings containing the british spelling of words spelt using american english
 
-    """
+    Returns:
+      'EmbeddingStore' sharing the (normalised) vectors of 'w2v_model', with the british spellings added
 
-    for i in range(len(wordpairs)):
-        try:
-            vec = w2v_model[wordpairs[i][1]]
-            w2v_model.add(wordpairs[i][0], vec)
-        except KeyError:
-            # print(wordpairs[i][0])
-            continue
+    """
 
-    return w2v_model
+    return EmbeddingStore.from_keyed_vectors(w2v_model, wordpairs)
 
 
 def clue_vectorizer(w2v_model, clue_words, pooling):
@@ -78,7 +82,74 @@ def sol_tracker(w2v_model, solution):
     return sol_errors
 
 
-def multi_synonym(w2v_model, multi_syns, n, pooling):
+class SynonymRankings:
+    def __init__(self, w2v_model, multi_syns, n, pooling, vectorizer=None, nprobe=None):
+        """Rankings of the vocabulary for each synonym of a clue, which can be fused to any depth.
+
+        The synonyms are vectorised and scored once. As in the original string intersection of
+        'multi_synonym', a word (canonical id) is in a synonym's ranking if any of its case variants
+        is in the synonym's top 'n' rows, with the score of its best variant. With the 'sum' and 'min'
+        methods, 'fuse' then only reads the rankings as deep as the number of words asked for needs,
+        so a clue solved at growing depths fuses a longer prefix only when more words are asked for.
+
+        Args:
+            w2v_model: 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'.
+            multi_syns: nested list containing lists of each synonym present in a clue.
+            n: number of rows to retrieve from the model for each synonym.
+            pooling: sum or mean.
+            vectorizer: 'ClueVectorizer' to reuse for the synonyms.
+            nprobe: retrieve each synonym's 'n' rows from the model's IVF-PQ index, scanning 'nprobe' lists.
+        """
+        if vectorizer is None:
+            vectorizer = ClueVectorizer(w2v_model)
+        self.w2v_model = w2v_model
+        self.n = n
+        self.canonical = CanonicalVocab.from_model(w2v_model)
+        self.syn_vecs, _ = vectorizer.vectorize_batch(multi_syns, pooling=pooling)
+
+        if nprobe is not None:
+            # Each synonym's approximate top 'n' from the IVF-PQ index, keeping the best variant of every word
+            syn_ids, syn_scores = search_function(w2v_model, nprobe=nprobe)(normed_vectors(w2v_model), self.syn_vecs, n)
+            firsts = [self.canonical.first(ids) for ids in syn_ids]
+            self.lists = ([canon for canon, _ in firsts],
+                          [scores[kept] for scores, (_, kept) in zip(syn_scores, firsts)])
+        else:
+            # Every synonym against the whole vocabulary in one matrix product. A word must reach the
+            # score of each synonym's 'n'-th best row
+            self.lists = None
+            matrix, scales, projection = coarse_matrix(w2v_model)
+            scores = vocab_scores(w2v_model, synonym_scores(matrix, self.syn_vecs, scales, projection))
+            self.thresholds = depth_thresholds(scores, n)
+            self.scores = self.canonical.segment_max(scores)
+            self.members = ranking_members(self.scores, self.thresholds)
+
+    def fuse(self, k, method='sum'):
+        """Top 'k' words common to all rankings, as a tuple of (canonical ids, fused scores). The top 'k'
+        is a prefix of the top 'k' of any larger 'k'. See 'fusion.fuse' for the methods"""
+        if self.lists is not None:
+            return fuse_lists(*self.lists, k, method=method)
+
+        # Rankings fused from quantised or reduced scores are rescored exactly at the top
+        coarse = getattr(self.w2v_model, 'coarse', None) is not None and method != 'rrf'
+        ids, fused = fuse(self.scores, max(k, DEFAULT_RERANK) if coarse else k, self.n, method=method,
+                          thresholds=self.thresholds, members=self.members)
+        if coarse:
+            ids, fused = rescore_fused(normed_vectors(self.w2v_model), self.syn_vecs, ids, fused, method,
+                                       aliases=self.w2v_model.aliases, canonical=self.canonical)
+        return ids[:k], fused[:k]
+
+
+def multi_synonym_ids(w2v_model, multi_syns, n, pooling, k=None, method='sum', vectorizer=None, nprobe=None):
+    """Given list of synonyms that represents crossword clue, return aggregate ranking of canonical
+    (lowercase) ids and their fused scores. Takes the same arguments as 'multi_synonym', and fuses the
+    'SynonymRankings' of the clue
+
+    """
+    rankings = SynonymRankings(w2v_model, multi_syns, n, pooling, vectorizer=vectorizer, nprobe=nprobe)
+    return rankings.fuse(n if k is None else k, method=method)
+
+
+def multi_synonym(w2v_model, multi_syns, n, pooling, k=None, method='sum', vectorizer=None, nprobe=None):
     """Given list of synonyms that represents crossword clue, return aggregate ranking
 
     Args:
@@ -86,51 +157,18 @@ def multi_synonym(w2v_model, multi_syns, n, pooling):
       multi_syns : nested list containing lists of each synonym present in a clue
       n          : number of words to retreive from W2V model for each synonym
       pooling    : sum or mean
+      k          : number of words to return, defaults to n
+      method     : how to combine the rankings of each synonym - 'sum', 'min' or 'rrf' (see fusion.fuse)
+      vectorizer : 'ClueVectorizer' to reuse for the synonyms
+      nprobe     : retrieve each synonym's 'n' words from the model's IVF-PQ index, scanning 'nprobe' lists
 
     """
+    ids, _ = multi_synonym_ids(w2v_model, multi_syns, n, pooling, k=k, method=method, vectorizer=vectorizer,
+                               nprobe=nprobe)
 
-    # Construct seperate vector representaion for each synoynm
-    clue_vecs = []
-    for synonym in multi_syns:
-        cv, _ = clue_vectorizer(w2v_model, synonym, pooling=pooling)
-        clue_vecs.append(cv)
-
-    # Find words and corresponding scores of top n most likely answer candidates for  each synonym
-    words = []
-    scores = []
-    for i in range(len(multi_syns)):
-        top_n = w2v_model.similar_by_vector(
-            clue_vecs[i], topn=n, restrict_vocab=None)
-        top_list = [top_n[j][0].lower() for j in range(len(top_n))]
-        score_list = [top_n[k][1] for k in range(len(top_n))]
-        words.append(top_list)
-        scores.append(score_list)
-
-    # Retreive words common to all rankings
-    int1 = words[0]
-    for word_list in words[1:]:
-        int1 = np.intersect1d(int1, word_list)
-
-    # Contingency for no common words between the two retreived rankings
-    if len(int1) == 0:
-        return []
-
-    # Retrieve scores corresponding to each intersection word in each of the original rankings
-    scores_list = np.zeros(len(int1))
-    for i in range(len(words)):
-        indices = np.intersect1d(words[i], int1, return_indices=True)
-        int_scores = np.take(scores[i], indices[1])
-        scores_list += int_scores
-
-    # Dictionary for intersection words and summed scores
-    rank_dict = {}
-    for A, B in zip(int1, scores_list):
-        rank_dict[A] = B
-
-    # Sort based on score in descending order and return word ranking
-    sorted_x = dict(
-        sorted(rank_dict.items(), key=lambda kv: kv[1], reverse=True))
-    top_list = list(sorted_x.keys())
+    # Empty if no word is common to all rankings
+    forms = CanonicalVocab.from_model(w2v_model).forms
+    top_list = [forms[c] for c in ids]
 
     return top_list
 
@@ -140,7 +178,9 @@ def master_base(w2v_model, data, pairs, pooling, version, topn, verbose,
                               'clue_word': True,
                               'anagrams': True,
                               'multi_synonym': True,
-                              'multiword': True}):
+                              'multiword': True},
+                batch=False, memory_budget=DEFAULT_MEMORY_BUDGET, fusion='sum', rank_only=False, nprobe=None,
+                vectorizer=None, start_depth=DEFAULT_START_DEPTH, min_candidates=1000, profiler=None):
     """Finds vector representations of clues and retreives 'topn' answer candidates from within W2V vocabulary 
     based on cosine similarity score. These answer candidates can then be filtered further using various 
     combinations of the boolean flags in the 'enhancements' argument, in order to return more accurate answer 
@@ -153,10 +193,26 @@ def master_base(w2v_model, data, pairs, pooling, version, topn, verbose,
       pooling      : Mean or sum pooling 
       version      : 1 - Baseline, 
                      2 - Access to Enhancements,
-      topn         : Retreive 'topn' answer candidates
+      topn         : Retreive at most 'topn' answer candidates
       verbose      : 1 - see clue,answer,rank of correct answer 
                      2 - see the top 10 w2v answers also
       enhancements : Dictionary of constraints to consider. Set to True to activate.
+      batch        : Retrieve answer candidates for many clues at once with tiled matrix products
+      memory_budget: Bytes available to batched retrieval, used to choose tile sizes
+      fusion       : How the multi_synonym enhancement combines rankings - 'sum', 'min' or 'rrf'
+      rank_only    : Only compute the rank of the correct answer, without sorting answer candidates
+                     (see rankonly.rank_only_base). Gives the same metrics and errors as the exact
+                     search, also for a quantised or PCA-reduced store or when 'nprobe' is set
+      nprobe       : Retrieve answer candidates from the store's approximate IVF-PQ index (see ann.py),
+                     scanning this many lists per clue. None for exact search
+      vectorizer   : 'ClueVectorizer' of the model to reuse, e.g. one prepared by 'startup.start'
+      start_depth  : Retrieve 'start_depth' answer candidates first, and retrieve more (up to 'topn', see
+                     retrieval.deepening_depths) only while fewer than 'min_candidates' survive the filters.
+                     None to always retrieve 'topn'
+      min_candidates: Number of filtered answer candidates that is enough. Ranks up to 'min_candidates'
+                     are the same as when retrieving 'topn' candidates
+      profiler     : 'profiling.Profiler' collecting the latency, candidate counts and RSS of every
+                     stage, or None. Not used with 'rank_only'
 
     Output : 
       1) Metrics = [
@@ -176,6 +232,7 @@ def master_base(w2v_model, data, pairs, pooling, version, topn, verbose,
                   Keys of Clue for no answer candidates could be retreived
                   Key of Clue for which intersection of retreived answer candidates could not be found 
                   in the case of multi-syms constraint set to True
+                  Number of answer candidates retrieved for each clue (empty for rank_only)
 
       ]
 
@@ -183,210 +240,95 @@ def master_base(w2v_model, data, pairs, pooling, version, topn, verbose,
 
     """
 
+    if rank_only:
+        return rank_only_base(w2v_model, data, pairs, pooling, version, topn, verbose, enhancements, fusion,
+                              vectorizer=vectorizer)
+
+    from .solver import Solver
+
     # Retreive keys for current crossword
     keys = pairs
-    count_10 = 0
-    count_100 = 0
-    count_1000 = 0
-    rank_list100 = []
-    rank_list1000 = []
+    ranks = []
+    n_candidates = []
+    ranked_keys = []
     clue_errors = []
     sol_errors = []
-    clue_track100 = []
-    clue_track1000 = []
-    rank1 = 0
-    clue_track1 = []
     multi_clue_track = []
+    depths = []
     pairs = 0
 
-    # For all clues
-    for key in keys:
-        # Retreive clue and solution from dataframe
-        clue, solution = data[key]['all_synonyms'], data[key]['tokenized_solution']
-        if clue == None:
-            continue
-
-        '-----------------------------  Vector Representation of Clue --------------------------------- '
-
-        # Clue vector representation
-        clue_vec, c_errors = clue_vectorizer(w2v_model, clue, pooling=pooling)
-        clue_errors.append(c_errors)
-
-        # Solution words not in vocab
-        s_errors = sol_tracker(w2v_model, solution)
-        sol_errors.append(s_errors)
-
-        '-----------------------------  Retreive Answer Candidates from W2V and Apply Filters --------------------------------- '
-        # Retreive topn answer candidates
-        top_100 = w2v_model.similar_by_vector(
-            clue_vec, topn=topn, restrict_vocab=None)
-        top_list = [top_100[i][0].lower() for i in range(len(top_100))]
-
-        # Version 1
-        if version == 1:
-            pass
-
-        # Version 2 - allow access to enhancements
-        if version == 2:
+    # Indexes of the model are built once, and every clue goes through the solver's pipeline of stages
+    solver = Solver(w2v_model, enhancements=enhancements, version=version, pooling=pooling, topn=topn,
+                    memory_budget=memory_budget, fusion=fusion, nprobe=nprobe, vectorizer=vectorizer,
+                    start_depth=start_depth, min_candidates=min_candidates)
+    keys = [key for key in keys if data[key]['all_synonyms'] is not None]
+    # Metrics and printing are only timed when profiling
+    if profiler is not None:
+        profiler.attach(solver)
+        stage = profiler.stage
+    else:
+        stage = lambda name: contextlib.nullcontext()
+    entries = [data[key] for key in keys]
+
+    # Batched retrieval: vectorise all clues up front and retrieve candidates one chunk of clues at a time
+    solutions = solver.iter_batch(entries) if batch else map(solver.solve, entries)
 
-            # Return aggregate of rankings for each synonym
-            if len(data[key]['synonyms']) > 1 and enhancements['multi_synonym'] == True:
-                multi_list = multi_synonym(
-                    w2v_model, data[key]['synonyms'], n=100000, pooling=pooling)
-
-                if len(multi_list) == 0:
-                    #print("Sorry could not find any intersection between candidates returned for each synonym for clue :",key)
-                    multi_clue_track.append(key)
-                else:
-                    top_list = multi_list
-
-            # Filter out words in clue
-            if enhancements['clue_word'] == True:
-                top_l = word_remover(top_list, clue)
+    # For all clues
+    for key, result in zip(keys, solutions):
+        if profiler is not None:
+            profiler.record(result)
+        solution = data[key]['tokenized_solution']
+        clue_errors.append(result.clue_errors)
+
+        with stage('metrics'):
+            # Solution words not in vocab
+            sol_errors.append(solver.vectorizer.missing(solution))
+
+            depths.append(result.depth)
+            if result.no_intersection:
+                #print("Sorry could not find any intersection between candidates returned for each synonym for clue :",key)
+                multi_clue_track.append(key)
+
+            '----------------------------- Compute and Update Model Metrics --------------------------------- '
+            # Rank of the correct answer among the filtered candidates (0 if not found)
+            answer = answer_word(solution, enhancements['multiword'] == True)
+            rank = solver.answer_rank(result, answer)
+            ranks.append(rank)
+            n_candidates.append(len(result))
+            ranked_keys.append(key)
+            if rank > 0:
+                ans_rank = rank
+            elif result.exhausted or result.depth >= topn:
+                ans_rank = str("could not find correct answer")
             else:
-                top_l = top_list
-
-            # Filter out words of incorrect length
-            if enhancements['length'] == True:
-                if enhancements['multiword'] != True:
-                    top_list = len_filterer(
-                        top_l, len(data[key]['pretty_solution']))
-                elif enhancements['multiword'] == True:
-
-                    # Filter by total length including spaces
-                    top_l = pretty_len_filterer(
-                        top_l, len(data[key]['pretty_solution']))
-
-                    # Filter by individual word length
-                    top_list = len_filterer_multi(
-                        top_l, data[key]['token_lengths'])
-
-            # Filter by anagram
-            if enhancements['anagrams'] == True and data[key]['anagram'] != None:
-                top_list = anagram_filterer(
-                    top_list, data[key]['anagram'].lower())
-
-        # Remove duplicates
-        top_list = list(dict.fromkeys(top_list))
-
-        if len(top_list) == 0:
-            clue_track1.append(key)
-
-        '-----------------------------  Record Filtered, Ranked Answer Candidates ---------------------------------'
-
-        # Store word and score in dictionary
-        top_words = {}
-        top_100word = {}
-        top_1000word = {}
-        top_full = {}
-
-        # Consider top 10 answer candidates
-        for i in range(10):
-            try:
-                top_words.update({i+1: top_list[i]})
-
-            except IndexError:
-                # clue_track10.append(key)
-                break
-
-        # Consider top 100 answer candidates
-        for i in range(100):
-            try:
-                top_100word.update({i+1: top_list[i]})
-            except IndexError:
-                clue_track100.append(key)
-                break
-
-        # Consider top 1000 answer candidates
-        for i in range(1000):
-            try:
-                top_1000word.update({i+1: top_list[i]})
-            except IndexError:
-                clue_track1000.append(key)
-                break
-
-        for i in range(len(top_list)):
-            top_full.update({i+1: top_list[i]})
-
-        # Convert to dataframes
-        top_df = pd.DataFrame.from_dict(
-            top_words, orient='index', columns=['Word'])
-        top_100df = pd.DataFrame.from_dict(
-            top_100word, orient='index', columns=['Word'])
-        top_1000df = pd.DataFrame.from_dict(
-            top_1000word, orient='index', columns=['Word'])
-        top_fulldf = pd.DataFrame.from_dict(
-            top_full, orient='index', columns=['Word'])
-
-        '----------------------------- Compute and Update Model Metrics --------------------------------- '
-        # Split words by _ when multiword constraint is set to True
-        if enhancements['multiword'] == True:
-            # Check if solution contained in top 10/100/1000 or at all
-            int_10 = [word for word in top_df['Word']
-                      if re.split(r"[_]", word) == solution]
-            int_100 = [word for word in top_100df['Word']
-                       if re.split(r"[_]", word) == solution]
-            int_1000 = [word for word in top_1000df['Word']
-                        if re.split(r"[_]", word) == solution]
-            int_full = [word for word in top_fulldf['Word']
-                        if re.split(r"[_]", word) == solution]
-
-        else:
-            # Check if solution contained in top 10/100/1000 or at all
-            int_10 = [word for word in top_df['Word'] if [word] == solution]
-            int_100 = [word for word in top_100df['Word']
-                       if [word] == solution]
-            int_1000 = [word for word in top_1000df['Word']
-                        if [word] == solution]
-            int_full = [word for word in top_fulldf['Word']
-                        if [word] == solution]
-
-        # Update model modetrics
-        if len(int_10) > 0:
-            count_10 += 1
-            sol_rank10 = top_df.index[top_df['Word'] == int_10[0]].tolist()[0]
-            if sol_rank10 == 1:
-                rank1 += 1
-
-        if len(int_100) > 0:
-            count_100 += 1
-            sol_rank = top_100df.index[top_100df['Word'] == int_100[0]].tolist()[
-                0]
-            rank_list100.append(sol_rank)
-
-        if len(int_1000) > 0:
-            count_1000 += 1
-            sol_rank1k = top_1000df.index[top_1000df['Word'] == int_1000[0]].tolist()[
-                0]
-            rank_list1000.append(sol_rank1k)
-            ans_rank = sol_rank1k
-        elif len(int_full) > 0:
-            ans_rank = top_fulldf.index[top_fulldf['Word'] == int_full[0]].tolist()[
-                0]
-        else:
-            ans_rank = str("could not find correct answer")
+                # Retrieval stopped early, so the answer may still rank below the candidates it kept
+                ans_rank = f"> {len(result)}"
 
-        pairs += 1
+            pairs += 1
 
         # Print model output
-        if verbose == 2:
-            print(key)
-            print("Clue :", data[key]['synonyms'])
-            print("Answer: {}".format(solution))
-            print("Rank of Correct Answer :", ans_rank)
-            print("Top 10 W2V predictions :")
-            print(tabulate(top_df, headers='keys', tablefmt='psql'))
-            print("--------------------------------------------------------------------")
-        elif verbose == 1:
-            print(key)
-            print("Clue :", data[key]['synonyms'])
-            print("Answer: {}".format(solution))
-            print("Rank of Correct Answer :", ans_rank)
-            print("--------------------------------------------------------------------")
-
-    metrics = [count_10, count_100, rank_list100,
-               rank_list1000, rank1, count_1000]
+        with stage('print'):
+            if verbose == 2:
+                print(key)
+                print("Clue :", data[key]['synonyms'])
+                print("Answer: {}".format(solution))
+                print("Rank of Correct Answer :", ans_rank)
+                print("Top 10 W2V predictions :")
+                print(tabulate([(i+1, word) for i, word in enumerate(result.candidates.words(10))],
+                               headers=['', 'Word'], tablefmt='psql'))
+                print("--------------------------------------------------------------------")
+            elif verbose == 1:
+                print(key)
+                print("Clue :", data[key]['synonyms'])
+                print("Answer: {}".format(solution))
+                print("Rank of Correct Answer :", ans_rank)
+                print("--------------------------------------------------------------------")
+
+    metrics = rank_metrics(ranks)
+    clue_track100 = short_lists(ranked_keys, n_candidates, 100)
+    clue_track1000 = short_lists(ranked_keys, n_candidates, 1000)
+    clue_track1 = short_lists(ranked_keys, n_candidates, 1)
     errors = [clue_errors, sol_errors, clue_track100,
-              clue_track1000, clue_track1, multi_clue_track]
+              clue_track1000, clue_track1, multi_clue_track, depths]
 
     return metrics, errors, pairs
@@ -0,0 +1,221 @@
+import contextlib
+import io
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .anagram import AnagramSolver
+from .startup import prepare_vectorizer
+from .store import EmbeddingStore, key_index, normed_vectors, vocab_keys
+from .vectorize import ClueVectorizer
+from .vocab_index import CanonicalVocab, VocabIndex
+
+
+# Most clues a worker solves before its printed output is handed back to the parent
+TASK_SIZE = 100
+
+# Model and dataset of the current worker process, set by '_init_worker'
+_worker = {}
+
+
+def _to_shared(array):
+    """Copy an array into a new block of shared memory"""
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    chunk = 100000
+    for start in range(0, len(array), chunk):
+        shared[start:start+chunk] = array[start:start+chunk]
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _from_shared(spec):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def build_indexes(w2v_model, anagrams=False):
+    """Build the vocabulary indexes that 'master_base' uses and keep them on the model, so that worker
+    processes receive them rather than each building its own
+
+    Returns:
+      Tuple of (dict of index arrays, dict of lists of words or patterns that go with them)
+
+    """
+    canonical = CanonicalVocab.from_model(w2v_model)
+    vocab_index = VocabIndex.from_model(w2v_model)
+    arrays = {'canonical_ids': canonical.ids, 'lengths': vocab_index.lengths,
+              'pattern_codes': vocab_index.pattern_codes, 'signatures': vocab_index.signatures}
+    lists = {'forms': canonical.forms, 'patterns': vocab_index.patterns}
+    if anagrams:
+        anagram_solver = AnagramSolver.from_model(w2v_model)
+        arrays.update(anagram_rows=anagram_solver.rows, anagram_lengths=anagram_solver.lengths,
+                      anagram_counts=anagram_solver.counts)
+        lists['anagram_words'] = anagram_solver.words
+    return arrays, lists
+
+
+def share_model(w2v_model, inherit=False, anagrams=False):
+    """Describe how worker processes can open 'w2v_model' without receiving a pickled copy of it
+
+    Workers started with 'fork' ('inherit') get the model and its indexes from the parent as they
+    are, so nothing is copied. Otherwise, compiled stores are reopened from their directory and
+    memory-mapped, so all processes share the page cache, and any other model has its normalised
+    matrix and row norms copied once into shared memory. The index arrays built by 'build_indexes'
+    are copied into shared memory too.
+
+    Args:
+      w2v_model : 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'
+      inherit   : the workers are forked from this process
+      anagrams  : also share the index of multi-word anagrams
+
+    Returns:
+      Tuple of (handle to pass to the workers, list of shared memory blocks to release afterwards)
+
+    """
+    arrays, lists = build_indexes(w2v_model, anagrams=anagrams)
+    if inherit:
+        return {'model': w2v_model}, []
+
+    if isinstance(w2v_model, EmbeddingStore) and w2v_model.store_dir is not None:
+        handle = {'store_dir': w2v_model.store_dir, 'spelling': w2v_model.spelling,
+                  'precision': w2v_model.precision, 'pca': w2v_model.pca}
+    else:
+        vectors = np.asarray(normed_vectors(w2v_model), dtype=np.float32)
+        aliases = None
+        if isinstance(w2v_model, EmbeddingStore):
+            norms = np.asarray(w2v_model.norms, dtype=np.float32)
+            aliases = w2v_model.aliases
+        else:
+            norms = np.linalg.norm(w2v_model.vectors, axis=1).astype(np.float32)
+        arrays = dict(arrays, vectors=vectors, norms=norms)
+        handle = {'index_to_key': list(vocab_keys(w2v_model)), 'aliases': aliases}
+
+    blocks = []
+    handle['arrays'] = {}
+    for name, array in arrays.items():
+        block, handle['arrays'][name] = _to_shared(np.asarray(array))
+        blocks.append(block)
+    handle['lists'] = lists
+    return handle, blocks
+
+
+def _open_model(handle):
+    """Open the model described by a handle of 'share_model', with its indexes"""
+    if 'model' in handle:
+        return handle['model'], []
+
+    blocks, arrays = [], {}
+    for name, spec in handle['arrays'].items():
+        block, arrays[name] = _from_shared(spec)
+        blocks.append(block)
+
+    if 'store_dir' in handle:
+        model = EmbeddingStore(handle['store_dir'], spelling=handle['spelling'], precision=handle['precision'],
+                               pca=handle['pca'])
+    else:
+        model = EmbeddingStore.from_arrays(arrays['vectors'], arrays['norms'], handle['index_to_key'],
+                                           handle['aliases'])
+
+    lists = handle['lists']
+    model._canonical_vocab = CanonicalVocab.from_arrays(arrays['canonical_ids'], lists['forms'])
+    model._vocab_index = VocabIndex(arrays['lengths'], arrays['pattern_codes'], lists['patterns'],
+                                    arrays['signatures'])
+    if 'anagram_words' in lists:
+        model._anagram_solver = AnagramSolver.from_arrays(len(arrays['canonical_ids']), lists['anagram_words'],
+                                                          arrays['anagram_rows'], arrays['anagram_lengths'],
+                                                          arrays['anagram_counts'])
+    return model, blocks
+
+
+def _init_worker(handle, data, vectorizer, kwargs):
+    model, blocks = _open_model(handle)
+    kwargs = dict(kwargs, vectorizer=vectorizer.bind(model))
+    _worker.update(model=model, data=data, kwargs=kwargs, blocks=blocks)
+
+
+def _run_chunk(keys):
+    from .nbow import master_base
+
+    # Capture printed output so the parent can print it in clue order
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        result = master_base(_worker['model'], _worker['data'], keys, **_worker['kwargs'])
+    return result, output.getvalue()
+
+
+def clue_vectorizer(w2v_model, data):
+    """Unbound 'ClueVectorizer' with every clue of 'data' prepared, which only knows the tokens of
+    'data' rather than the whole vocabulary"""
+    index = key_index(w2v_model)
+    tokens = set()
+    for entry in data.values():
+        for token_list in [entry['all_synonyms'], entry['tokenized_solution']] + list(entry['synonyms'] or []):
+            tokens.update(token_list or [])
+    key_to_index = {token: index[token] for token in tokens if token in index}
+    return prepare_vectorizer(ClueVectorizer(None, key_to_index=key_to_index), data)
+
+
+def merge_results(results):
+    """Combine the (metrics, errors, pairs) of 'master_base' runs over consecutive chunks of keys into
+    the result of a single run over all of them"""
+    metrics = [0, 0, [], [], 0, 0]
+    errors = [[], [], [], [], [], [], []]
+    pairs = 0
+    for chunk_metrics, chunk_errors, chunk_pairs in results:
+        for i in range(len(metrics)):
+            metrics[i] += chunk_metrics[i]
+        for i in range(len(errors)):
+            errors[i] += chunk_errors[i]
+        pairs += chunk_pairs
+
+    return metrics, errors, pairs
+
+
+def parallel_base(w2v_model, data, pairs, workers, **kwargs):
+    """Run 'master_base' over the clues in 'pairs' with a pool of worker processes
+
+    The vocabulary indexes are built once, by this process, and handed to the workers with the model
+    (see 'share_model'). The keys are split into contiguous chunks of at most 'TASK_SIZE' clues, and
+    the printed output of every chunk is printed as soon as the chunks before it are done. Metrics,
+    errors and printed output are the same as for a single 'master_base' run.
+
+    Args:
+      w2v_model : 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'
+      data      : dict containing full dataset
+      pairs     : list of keys to access in clue data structure
+      workers   : number of worker processes
+      kwargs    : remaining arguments of 'master_base'
+
+    """
+    keys = list(pairs)
+    workers = max(1, min(workers, len(keys)))
+    task_size = max(1, min(TASK_SIZE, -(-len(keys) // workers)))
+    chunks = [keys[start:start+task_size] for start in range(0, len(keys), task_size)]
+
+    # Workers only receive the dataset entries being evaluated, and the token ids of their clues
+    data = {key: data[key] for key in keys}
+    kwargs = {name: value for name, value in kwargs.items() if name != 'vectorizer'}
+    vectorizer = clue_vectorizer(w2v_model, data)
+    enhancements = kwargs.get('enhancements') or {}
+    anagrams = (kwargs.get('version') == 2 and enhancements.get('anagrams') == True
+                and enhancements.get('multiword') == True)
+
+    # Forked workers can use the model and indexes of this process as they are. Models other than a
+    # store are turned into one in shared memory, since gensim normalises its matrix on every search
+    results = []
+    inherit = multiprocessing.get_start_method() == 'fork' and isinstance(w2v_model, EmbeddingStore)
+    handle, blocks = share_model(w2v_model, inherit=inherit, anagrams=anagrams)
+    try:
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(handle, data, vectorizer, kwargs)) as pool:
+            for result, output in pool.imap(_run_chunk, chunks):
+                print(output, end='', flush=True)
+                results.append(result)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return merge_results(results)
@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+
+
+def fit_projection(vectors, dims):
+    """Fit a PCA projection of the rows of an L2-normalised matrix
+
+    The components are the top eigenvectors of the uncentred second moment matrix, so that the dot
+    product of two projected rows approximates their cosine similarity.
+
+    Args:
+      vectors : L2-normalised float32 embedding matrix (may be memory-mapped)
+      dims    : number of components to keep
+
+    Returns:
+      float32 array of shape (vectors.shape[1], dims), with orthonormal columns ordered by variance
+
+    """
+    moments = np.zeros((vectors.shape[1], vectors.shape[1]), dtype=np.float64)
+    chunk = 100000
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start+chunk], dtype=np.float32)
+        moments += block.T @ block
+
+    _, components = np.linalg.eigh(moments)
+    return np.ascontiguousarray(components[:, ::-1][:, :dims], dtype=np.float32)
+
+
+def projection_paths(store_dir, dims):
+    """Paths of the projected matrix and the PCA components within a store"""
+    return (os.path.join(store_dir, f'vectors-pca{dims}.npy'),
+            os.path.join(store_dir, f'components-pca{dims}.npy'))
+
+
+def write_projection(store_dir, dims):
+    """Add a PCA-reduced copy of the matrix of a compiled store, for use with
+    'EmbeddingStore(..., pca=dims)'. The full matrix is kept for exact rescoring.
+
+    Args:
+      store_dir : directory containing a compiled store
+      dims      : number of dimensions to keep, e.g. 64 or 128
+
+    Returns:
+      Fraction of the variance of the rows kept by the projection
+
+    """
+    vectors = np.load(os.path.join(store_dir, 'vectors.npy'), mmap_mode='r')
+    vectors_path, components_path = projection_paths(store_dir, dims)
+    components = fit_projection(vectors, dims)
+
+    # Write next to the final files and rename, so readers never see a partial matrix
+    out = np.lib.format.open_memmap(vectors_path + '.tmp', mode='w+', dtype=np.float32,
+                                    shape=(len(vectors), dims))
+    kept = 0.0
+    chunk = 100000
+    for start in range(0, len(vectors), chunk):
+        projected = np.asarray(vectors[start:start+chunk], dtype=np.float32) @ components
+        out[start:start+chunk] = projected
+        kept += float((projected.astype(np.float64) ** 2).sum())
+    out.flush()
+    del out
+
+    np.save(components_path + '.tmp.npy', components)
+    os.replace(components_path + '.tmp.npy', components_path)
+    os.replace(vectors_path + '.tmp', vectors_path)
+
+    # Rows have unit norm, so the total variance is the number of rows
+    return kept / max(len(vectors), 1)
@@ -0,0 +1,116 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def peak_rss():
+    """Peak resident set size of this process so far, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss():
+    """Resident set size of this process now, in bytes, or None where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return None
+
+
+class Profiler:
+    def __init__(self):
+        """Per-stage latency, candidate funnel and memory of a run of 'nbow.master_base'.
+
+        Latencies and candidate counts are read from the 'Solution' of every clue, which the 'Solver'
+        records anyway. Memory is only measured once the profiler is attached to a solver, by reading
+        the current RSS before and after each of its stages, so a run without a profiler pays nothing
+        for it. Stages outside the solver, such as computing metrics and printing, are timed with
+        'stage'. The peak RSS of the whole process is reported once for the run, since it only grows.
+        """
+        self.latencies = {}
+        self.counts = {}
+        self.rss = {}
+        self.rss_growth = {}
+
+    def attach(self, solver):
+        """Measure the RSS around every stage of 'solver''s pipeline"""
+        solver.pipeline = [(name, self._wrap(name, stage)) for name, stage in solver.pipeline]
+
+    def _wrap(self, name, stage):
+        def measured(solution):
+            before = current_rss()
+            result = stage(solution)
+            self._rss(name, before, current_rss())
+            return result
+        return measured
+
+    def _rss(self, name, before, after):
+        # Highest RSS after a call of the stage, and most the RSS grew in one call
+        if before is None or after is None:
+            return
+        self.rss[name] = max(self.rss.get(name, 0), after)
+        self.rss_growth[name] = max(self.rss_growth.get(name, 0), after - before)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a block of code as one call of stage 'name'"""
+        before = current_rss()
+        start_time = time.perf_counter()
+        yield
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start_time)
+        self._rss(name, before, current_rss())
+
+    def record(self, solution):
+        """Add the stage timings and candidate counts of one solved clue"""
+        for name, seconds in solution.timings.items():
+            self.latencies.setdefault(name, []).append(seconds)
+        for name, counts in solution.counts.items():
+            self.counts.setdefault(name, []).append(counts)
+
+    def report(self):
+        """Summary of every stage: number of clues, total time, latency percentiles in milliseconds,
+        mean number of candidates going in and out, the highest RSS after the stage and the most it
+        grew in one call, in MB"""
+        stages = {}
+        for name, latencies in self.latencies.items():
+            ms = np.asarray(latencies) * 1000
+            summary = {'clues': len(ms), 'total_s': float(ms.sum() / 1000),
+                       'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95)),
+                       'p99_ms': float(np.percentile(ms, 99)), 'max_ms': float(ms.max())}
+            if name in self.counts:
+                counts = np.asarray(self.counts[name], dtype=np.float64)
+                summary['candidates_in'] = float(counts[:, 0].mean())
+                summary['candidates_out'] = float(counts[:, 1].mean())
+                summary['clues_emptied'] = int(((counts[:, 0] > 0) & (counts[:, 1] == 0)).sum())
+            if name in self.rss:
+                summary['rss_mb'] = self.rss[name] / 2**20
+                summary['max_rss_growth_mb'] = self.rss_growth[name] / 2**20
+            stages[name] = summary
+        return stages
+
+    def print_report(self):
+        from tabulate import tabulate
+
+        rows = [(name, s['clues'], f"{s['total_s']:.2f}", f"{s['p50_ms']:.2f}", f"{s['p95_ms']:.2f}",
+                 f"{s['p99_ms']:.2f}", f"{s.get('candidates_in', float('nan')):.0f}",
+                 f"{s.get('candidates_out', float('nan')):.0f}", f"{s.get('rss_mb', float('nan')):.0f}",
+                 f"{s.get('max_rss_growth_mb', float('nan')):.1f}")
+                for name, s in self.report().items()]
+        print(tabulate(rows, headers=['Stage', 'Clues', 'Total (s)', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)',
+                                      'Cands in', 'Cands out', 'RSS (MB)', 'Max growth (MB)'], tablefmt='psql'))
+        print(f'Process peak RSS: {peak_rss() / 2**20:.0f} MB')
+
+    def write(self, path, **extra):
+        """Write the report to a JSON file, with any 'extra' fields (e.g. startup times or metrics)"""
+        with open(path, 'w') as file:
+            json.dump(dict(extra, peak_rss_mb=peak_rss() / 2**20, stages=self.report()), file, indent=2)
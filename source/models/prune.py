@@ -0,0 +1,79 @@
+import re
+
+import numpy as np
+
+from .store import EmbeddingStore, write_store
+
+
+ANSWER_PATTERN = re.compile('[a-z]+(_[a-z]+)*')
+
+# Longest answer, in letters, kept by default. Answers that run across several lights of a 13x13 grid
+# can be longer than the grid
+DEFAULT_MAX_LENGTH = 21
+
+
+def normalise_answer(word, max_length=DEFAULT_MAX_LENGTH):
+    """The form of a vocabulary entry as a crossword answer: lowercase letters, with words joined by
+    '_', or None if the entry cannot be an answer
+
+    Args:
+      word       : vocabulary entry, e.g. 'New_York' or 'U.S.'
+      max_length : maximum number of letters
+
+    """
+    form = word.lower().replace('-', '_')
+    if ANSWER_PATTERN.fullmatch(form) is None or len(form) - form.count('_') > max_length:
+        return None
+    return form
+
+
+def prune_store(store_dir, out_dir, wordpairs=None, max_length=DEFAULT_MAX_LENGTH):
+    """Write a compact store with only the entries of the store in 'store_dir' that can be crossword
+    answers. Entries are normalised with 'normalise_answer', and case variants of an entry are merged
+    into a single row with the vector of the most frequent (first) variant. British spellings from
+    'wordpairs' are added as aliases, as in 'store.build_store'.
+
+    The new store keeps the fingerprint of the original, so 'store.load_model' opens it in place of the
+    word2vec binary the original was compiled from.
+
+    Args:
+      store_dir  : directory containing a compiled store
+      out_dir    : directory to write the compact store to
+      wordpairs  : list of (british, american) spelling pairs, or None
+      max_length : maximum number of letters in an answer
+
+    Returns:
+      Contents of the new store's meta.json
+
+    """
+    store = EmbeddingStore(store_dir, spelling=False)
+
+    keys = []
+    rows = []
+    forms = {}
+    for row, word in enumerate(store.index_to_key):
+        form = normalise_answer(word, max_length)
+        if form is None or form in forms:
+            continue
+        forms[form] = len(keys)
+        keys.append(form)
+        rows.append(row)
+    n_base = len(keys)
+
+    # British spellings share the rows of their American counterparts
+    aliases = []
+    if wordpairs is not None:
+        for brit, amer in wordpairs:
+            brit, amer = normalise_answer(brit, max_length), normalise_answer(amer, max_length)
+            if brit is None or brit in forms or amer not in forms:
+                continue
+            forms[brit] = forms[amer]
+            keys.append(brit)
+            aliases.append(forms[amer])
+
+    meta = dict(store.meta, size=len(keys), base_size=n_base,
+                pruned={'source_size': store.meta['base_size'], 'max_length': max_length})
+    write_store(out_dir, keys, lambda ids: np.asarray(store.vectors[ids], dtype=np.float32) * store.norms[ids][:, None],
+                np.asarray(rows, dtype=np.int64), meta, np.asarray(aliases, dtype=np.int64))
+
+    return meta
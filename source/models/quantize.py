@@ -0,0 +1,209 @@
+import functools
+import os
+
+import numpy as np
+
+from .retrieval import DEFAULT_MEMORY_BUDGET, alias_topk, batch_topk, resolve_aliases
+
+
+PRECISIONS = ('float32', 'float16', 'int8')
+
+# Number of coarse candidates per query that are rescored exactly in float32
+DEFAULT_RERANK = 4096
+
+
+def quantize_rows(block, precision):
+    """Quantise rows of an L2-normalised float32 matrix
+
+    float16 rows are a plain cast. int8 rows are scaled per row so that the largest absolute component
+    maps to 127; a row is approximately codes * scale.
+
+    Args:
+      block     : 2D float32 array
+      precision : 'float16' or 'int8'
+
+    Returns:
+      Tuple of (quantised rows, float32 scale of every row or None for float16)
+
+    """
+    if precision == 'float16':
+        return block.astype(np.float16), None
+    if precision != 'int8':
+        raise ValueError(f'Unknown precision "{precision}" (must be one of {", ".join(PRECISIONS)})')
+
+    scales = (np.abs(block).max(axis=1) / 127).astype(np.float32)
+    codes = np.rint(block / np.where(scales > 0, scales, 1)[:, None])
+    return np.clip(codes, -127, 127).astype(np.int8), scales
+
+
+def quantized_paths(store_dir, precision):
+    """Paths of the quantised matrix and its row scales (None for float16) within a store"""
+    scales_path = os.path.join(store_dir, f'scales-{precision}.npy') if precision == 'int8' else None
+    return os.path.join(store_dir, f'vectors-{precision}.npy'), scales_path
+
+
+def write_quantized(store_dir, precision):
+    """Add a quantised copy of the matrix of a compiled store, for use with
+    'EmbeddingStore(..., precision=precision)'. The float32 matrix is kept for exact rescoring.
+
+    Args:
+      store_dir : directory containing a compiled store
+      precision : 'float16' or 'int8'
+
+    Returns:
+      Size in bytes of the quantised matrix
+
+    """
+    vectors = np.load(os.path.join(store_dir, 'vectors.npy'), mmap_mode='r')
+    vectors_path, scales_path = quantized_paths(store_dir, precision)
+    dtype = np.float16 if precision == 'float16' else np.int8
+
+    # Write next to the final files and rename, so readers never see a partial matrix
+    out = np.lib.format.open_memmap(vectors_path + '.tmp', mode='w+', dtype=dtype, shape=vectors.shape)
+    scales = np.empty(len(vectors), dtype=np.float32)
+    chunk = 100000
+    for start in range(0, len(vectors), chunk):
+        codes, block_scales = quantize_rows(np.asarray(vectors[start:start+chunk], dtype=np.float32), precision)
+        out[start:start+chunk] = codes
+        if block_scales is not None:
+            scales[start:start+chunk] = block_scales
+    out.flush()
+    del out
+
+    if scales_path is not None:
+        np.save(scales_path + '.tmp.npy', scales)
+        os.replace(scales_path + '.tmp.npy', scales_path)
+    os.replace(vectors_path + '.tmp', vectors_path)
+
+    return os.path.getsize(vectors_path)
+
+
+def coarse_matrix(w2v_model):
+    """Matrix to scan when scoring the whole vocabulary of a model: the quantised or PCA-reduced matrix
+    of an 'EmbeddingStore' opened with one, otherwise the L2-normalised matrix
+
+    Args:
+      w2v_model : 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'
+
+    Returns:
+      Tuple of (matrix, row scales of an int8 matrix or None, PCA projection of the queries or None)
+
+    """
+    if getattr(w2v_model, 'coarse', None) is not None:
+        return w2v_model.coarse, w2v_model.scales, w2v_model.projection
+
+    from .store import normed_vectors
+    return normed_vectors(w2v_model), None, None
+
+
+def search_function(w2v_model, rerank=DEFAULT_RERANK, nprobe=None):
+    """Function with the signature of 'retrieval.batch_topk' to search the matrix of a model with: the
+    IVF-PQ index of an 'EmbeddingStore' if 'nprobe' is given, the two-stage search for a quantised or
+    PCA-reduced 'EmbeddingStore', otherwise 'batch_topk' itself. Spelling aliases of a store are
+    returned alongside the rows they share (see 'retrieval.alias_topk')
+
+    Args:
+      w2v_model : 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'
+      rerank    : number of coarse candidates rescored per query
+      nprobe    : number of lists of the IVF-PQ index to scan per query (see ann.py), or None
+
+    """
+    if nprobe is not None:
+        from .ann import ivfpq_topk
+        if not hasattr(w2v_model, 'ivfpq'):
+            raise ValueError('Approximate search needs a compiled store with an IVF-PQ index (see build_store.py)')
+        search = functools.partial(ivfpq_topk, index=w2v_model.ivfpq, nprobe=nprobe, rerank=rerank)
+    elif getattr(w2v_model, 'coarse', None) is None:
+        search = batch_topk
+    else:
+        search = functools.partial(two_stage_topk, coarse=w2v_model.coarse, scales=w2v_model.scales,
+                                   projection=w2v_model.projection, rerank=rerank)
+
+    aliases = getattr(w2v_model, 'aliases', None)
+    if aliases is None or len(aliases) == 0:
+        return search
+    return functools.partial(alias_topk, aliases=aliases, search=search)
+
+
+def exact_scores(vectors, ids, query):
+    """Cosine similarity of 'query' with rows 'ids' of the L2-normalised float32 matrix. The rows are
+    read in ascending order, so a memory-mapped matrix is read front to back."""
+    query = np.asarray(query, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    order = np.argsort(ids, kind='stable')
+    scores = np.empty(len(ids), dtype=np.float32)
+    scores[order] = np.asarray(vectors[ids[order]], dtype=np.float32) @ query
+    return scores
+
+
+def rescore_fused(vectors, syn_vecs, ids, scores, method, rerank=DEFAULT_RERANK, aliases=None, canonical=None):
+    """Reorder the best 'rerank' rows of a ranking fused from quantised or reduced synonym scores (see
+    'fusion.fuse') by their exact fused score, and return the ranking with its scores. The rest of
+    the ranking is left as it is, with its coarse scores.
+
+    Args:
+      vectors  : L2-normalised float32 embedding matrix (may be memory-mapped)
+      syn_vecs : 2D array with one (pooled) vector per synonym
+      ids      : fused ranking of row ids
+      scores   : fused scores of 'ids'
+      method   : 'sum' or 'min'
+      rerank   : number of rows to rescore
+      aliases  : row of every alias id in 'ids' (see 'retrieval.resolve_aliases'), or None
+      canonical: 'CanonicalVocab' if 'ids' are canonical ids, which are scored by their best case variant
+
+    """
+    head = ids[:rerank]
+    if canonical is None:
+        head_rows = resolve_aliases(head, len(vectors), aliases)
+        exact = np.stack([exact_scores(vectors, head_rows, syn_vec) for syn_vec in syn_vecs])
+    elif len(head) == 0:
+        exact = np.empty((len(syn_vecs), 0), dtype=np.float32)
+    else:
+        variants, starts = canonical.rows_of(head)
+        variant_rows = resolve_aliases(variants, len(vectors), aliases)
+        exact = np.stack([np.maximum.reduceat(exact_scores(vectors, variant_rows, syn_vec), starts)
+                          for syn_vec in syn_vecs])
+    fused = exact.sum(axis=0) if method == 'sum' else exact.min(axis=0)
+    order = np.lexsort((head, -fused))
+    return (np.concatenate([head[order], ids[rerank:]]),
+            np.concatenate([fused[order], scores[rerank:]]).astype(np.float32))
+
+
+def two_stage_topk(vectors, queries, k, memory_budget=DEFAULT_MEMORY_BUDGET, rows=None,
+                   coarse=None, scales=None, projection=None, rerank=DEFAULT_RERANK):
+    """Approximate 'batch_topk': scan a quantised or PCA-reduced copy of 'vectors', then rescore the
+    best 'rerank' candidates of every query exactly in float32
+
+    The first min(k, rerank) results are ordered by exact score, with ties broken by row id. Any
+    further results keep their coarse scores and order.
+
+    Args:
+      vectors       : L2-normalised float32 embedding matrix (may be memory-mapped)
+      queries       : 2D array of query vectors, one per row
+      k             : number of candidates to return per query
+      memory_budget : bytes available for the working set of the coarse scan
+      rows          : optional array of row ids; only these rows are searched
+      coarse        : quantised or reduced matrix with the same rows as 'vectors' (see 'write_quantized'
+                      and 'pca.write_projection')
+      scales        : row scales of an int8 'coarse' matrix, or None
+      projection    : PCA components that map queries into the space of a reduced 'coarse' matrix, or None
+      rerank        : number of coarse candidates rescored per query
+
+    Returns:
+      Tuple of (ids, scores) as returned by 'batch_topk'
+
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    coarse_queries = queries if projection is None else queries @ projection
+    ids, scores = batch_topk(coarse, coarse_queries, max(k, rerank), memory_budget, rows=rows, scales=scales)
+    head = min(rerank, ids.shape[1])
+    ids, scores = ids.copy(), scores.copy()
+
+    for i, query in enumerate(queries):
+        head_ids = ids[i, :head]
+        head_scores = exact_scores(vectors, head_ids, query)
+        order = np.lexsort((head_ids, -head_scores))
+        ids[i, :head], scores[i, :head] = head_ids[order], head_scores[order]
+
+    k = min(k, ids.shape[1])
+    return ids[:, :k], scores[:, :k]
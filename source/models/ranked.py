@@ -0,0 +1,51 @@
+import numpy as np
+
+
+class RankedList:
+    def __init__(self, ids, scores, vocab, extra=None):
+        """Ranked answer candidates, held as int32 ids and float32 scores.
+
+        Words are only looked up in 'vocab' when they are asked for, e.g. for the top 10 candidates
+        printed by 'nbow.master_base', so a deep ranking costs a few bytes per candidate rather than
+        a string and a tuple. Iterating or indexing gives (word, score) pairs, as gensim's
+        'similar_by_vector' does.
+
+        Args:
+            ids: array of candidate ids, best first. Negative ids stand for words of 'extra'.
+            scores: array of the candidates' scores, or None if they have none (e.g. fused rankings).
+            vocab: list of words indexed by candidate id.
+            extra: list of words outside 'vocab', candidate -j-1 being extra[j].
+        """
+        self.ids = np.asarray(ids, dtype=np.int32)
+        self.scores = None if scores is None else np.asarray(scores, dtype=np.float32)
+        self.vocab = vocab
+        self.extra = extra
+
+    def __len__(self):
+        return len(self.ids)
+
+    def word(self, i):
+        """Word of candidate id 'i'"""
+        return self.vocab[i] if i >= 0 else self.extra[-i - 1]
+
+    def words(self, n=None):
+        """Words of the first 'n' candidates (all of them if None)"""
+        return [self.word(i) for i in self.ids[:n].tolist()]
+
+    def __getitem__(self, key):
+        if isinstance(key, (slice, np.ndarray)):
+            scores = None if self.scores is None else self.scores[key]
+            return RankedList(self.ids[key], scores, self.vocab, self.extra)
+        score = None if self.scores is None else float(self.scores[key])
+        return self.word(int(self.ids[key])), score
+
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield self[i]
+
+    def rank(self, candidate_id):
+        """1-based rank of 'candidate_id', or 0 if it is not a candidate (or None)"""
+        if candidate_id is None:
+            return 0
+        hits = np.flatnonzero(self.ids == candidate_id)
+        return int(hits[0]) + 1 if len(hits) > 0 else 0
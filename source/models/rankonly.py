@@ -0,0 +1,218 @@
+import numpy as np
+
+from .anagram import AnagramSolver, phrase_scores
+from .fusion import depth_thresholds, fuse, synonym_scores
+from .metrics import answer_word, rank_metrics, short_lists
+from .retrieval import _top_k
+from .store import matrix_rows, normed_vectors, vocab_keys, vocab_scores
+from .vectorize import ClueVectorizer
+from .vocab_index import CanonicalVocab, VocabIndex, anagram_signature
+
+
+def _distinct(canon, rows, n_canon):
+    """Number of distinct canonical forms among 'rows', without sorting"""
+    seen = np.zeros(n_canon, dtype=bool)
+    seen[canon[rows]] = True
+    return int(np.count_nonzero(seen))
+
+
+def _top_rows(mask, scores, topn):
+    """Rows of 'mask' that make it into the top 'topn' by score, with ties broken by row id"""
+    rows = np.flatnonzero(mask)
+    if len(rows) > topn:
+        rows = _top_k(scores[rows][None], rows[None], topn)[1][0]
+    return rows
+
+
+def list_rank(scores, searched, kept, canon, n_canon, gold, topn, phrases=None):
+    """Rank of the correct answer and the number of distinct candidates in the list 'master_base' would
+    build, without building or sorting it
+
+    The list is the top 'topn' rows of 'searched' by score, optionally merged with phrases, then reduced
+    to the rows of 'kept' and deduplicated by canonical (lowercase) form. The answer's rank is one plus
+    the number of distinct forms in that list ranked above its best row.
+
+    Args:
+      scores   : score of every row
+      searched : boolean mask of the rows that are ranked before truncation to 'topn'
+      kept     : boolean mask of the rows that survive the filters applied after truncation
+      canon    : canonical id of every row
+      n_canon  : number of canonical ids
+      gold     : canonical id of the correct answer, or None if it is not in the vocabulary
+      topn     : number of rows retrieved
+      phrases  : optional tuple of (phrase strings, phrase scores, forms) for multiword anagrams, where
+                 'forms' maps a lowercase word to its canonical id
+
+    Returns:
+      Tuple of (rank, number of candidates). The rank is 0 if the answer is not in the list
+
+    """
+    # Rows retrieved for the list, and those left after filtering
+    top = _top_rows(searched, scores, topn)
+    listed = top[kept[top]]
+    n_candidates = _distinct(canon, listed, n_canon)
+
+    phrase_words, phrase_values = [], np.empty(0, dtype=np.float32)
+    if phrases is not None:
+        phrase_words, phrase_values, forms = phrases
+        # Phrases that are already in the list as a single vocabulary entry are not counted twice
+        listed_forms = np.zeros(n_canon, dtype=bool)
+        listed_forms[canon[listed]] = True
+        new = [forms.get(word) is None or not listed_forms[forms[word]] for word in phrase_words]
+        n_candidates += len(set(word for word, is_new in zip(phrase_words, new) if is_new))
+
+    # Score of the answer's best listed row or phrase
+    if gold is None:
+        return 0, n_candidates
+    gold_scores = scores[listed[canon[listed] == gold]].tolist()
+    if phrases is not None:
+        gold_scores += [value for word, value in zip(phrase_words, phrase_values) if forms.get(word) == gold]
+    if len(gold_scores) == 0:
+        return 0, n_candidates
+    gold_score = max(gold_scores)
+
+    # Rows ranked above the answer, with ties broken by row id as in retrieval
+    gold_rows = listed[(canon[listed] == gold) & (scores[listed] == gold_score)]
+    first_row = gold_rows.min() if len(gold_rows) > 0 else len(canon)
+    listed_scores = scores[listed]
+    above = listed[(listed_scores > gold_score) | ((listed_scores == gold_score) & (listed < first_row))]
+    rank = 1 + _distinct(canon, above, n_canon)
+    if phrases is not None:
+        above_forms = set(canon[above].tolist())
+        rank += len(set(word for word, value in zip(phrase_words, phrase_values)
+                        if value > gold_score and forms.get(word) not in above_forms))
+
+    return rank, n_candidates
+
+
+def rank_only_base(w2v_model, data, pairs, pooling, version, topn, verbose, enhancements, fusion='sum',
+                   vectorizer=None):
+    """Evaluate 'master_base' without building its ranked candidate lists. For each clue, the similarity
+    of every vocabulary row is computed once, the enabled enhancements are applied as boolean masks over
+    the rows, and the rank of the correct answer is the number of distinct allowed words scoring higher.
+
+    Takes the same arguments and returns the same metrics and errors as 'master_base', which it is called
+    from when 'rank_only' is set. The 'rrf' fusion method ranks rows by position, so it still sorts.
+
+    """
+    vocab = vocab_keys(w2v_model)
+    vectors = normed_vectors(w2v_model)
+    if vectorizer is None:
+        vectorizer = ClueVectorizer(w2v_model)
+    vocab_index = VocabIndex.from_model(w2v_model)
+    canonical = CanonicalVocab.from_model(w2v_model)
+    canon, forms, n_canon = canonical.ids, canonical.form_to_id, len(canonical)
+    canon_ids = np.arange(n_canon)
+    all_rows = np.ones(len(vocab), dtype=bool)
+
+    enhanced = version == 2
+    length = enhanced and enhancements['length'] == True
+    multiword = enhanced and enhancements['multiword'] == True
+    anagrams = enhanced and enhancements['anagrams'] == True
+    # As in master_base, removed clue words only reach the final list when length filtering is on
+    clue_word = length and enhancements['clue_word'] == True
+    multi_syn = enhanced and enhancements['multi_synonym'] == True
+    if anagrams and multiword:
+        anagram_solver = AnagramSolver.from_model(w2v_model)
+
+    keys = pairs
+    ranks = []
+    n_candidates = []
+    ranked_keys = []
+    clue_errors = []
+    sol_errors = []
+    multi_clue_track = []
+    pairs = 0
+
+    for key in keys:
+        entry = data[key]
+        clue, solution = entry['all_synonyms'], entry['tokenized_solution']
+        if clue == None:
+            continue
+
+        clue_vec, c_errors = vectorizer.vectorize(clue, pooling=pooling)
+        clue_errors.append(c_errors)
+        sol_errors.append(vectorizer.missing(solution))
+
+        answer = answer_word(solution, multiword)
+        gold = forms.get(answer) if answer is not None else None
+
+        # Masks for the length and anagram filters
+        length_mask = all_rows
+        if length and multiword:
+            length_mask = vocab_index.pattern_codes == vocab_index.pattern_to_code.get(tuple(entry['token_lengths']), -1)
+        elif length:
+            length_mask = vocab_index.lengths == len(entry['pretty_solution'])
+        anagram_clue = anagrams and entry['anagram'] != None
+        searched = length_mask
+        if anagram_clue:
+            searched = searched & (vocab_index.signatures == anagram_signature(entry['anagram'].lower()))
+
+        kept = all_rows
+        if clue_word:
+            removed = [forms[word] for word in clue if word in forms]
+            kept = ~np.isin(canon, removed)
+            if gold is not None and gold in removed:
+                gold = None
+
+        qvec = clue_vec / max(np.linalg.norm(clue_vec), 1e-12)
+        scores = vocab_scores(w2v_model, np.asarray(vectors @ qvec, dtype=np.float32))
+
+        phrases = None
+        if anagram_clue and multiword and len(entry['token_lengths']) > 1:
+            score = lambda found: phrase_scores(vectors, matrix_rows(w2v_model, found), clue_vec)
+            found, values, _ = anagram_solver.top_phrases(entry['anagram'], entry['token_lengths'], score)
+            phrase_words = ['_'.join(canonical.forms[c] for c in canon[phrase]) for phrase in found]
+            if clue_word:
+                keep = np.array([word not in clue for word in phrase_words], dtype=bool)
+                values = values[keep]
+                phrase_words = [word for word, k in zip(phrase_words, keep) if k]
+            phrases = (phrase_words, values, forms)
+
+        # Multi-synonym clues are ranked by the fused scores of the words (canonical ids, scored by their
+        # best case variant) with a variant in every synonym's top 100000 rows
+        fused = None
+        if multi_syn and len(entry['synonyms']) > 1 and not anagram_clue:
+            syn_vecs, _ = vectorizer.vectorize_batch(entry['synonyms'], pooling=pooling)
+            syn_scores = vocab_scores(w2v_model, synonym_scores(vectors, syn_vecs))
+            thresholds = depth_thresholds(syn_scores, 100000)
+            canon_scores = canonical.segment_max(syn_scores)
+            if fusion == 'rrf':
+                ids, values = fuse(canon_scores, topn, 100000, method=fusion, thresholds=thresholds)
+                members = np.zeros(n_canon, dtype=bool)
+                members[ids] = True
+                fused = np.zeros(n_canon, dtype=np.float32)
+                fused[ids] = values
+            else:
+                members = (canon_scores >= thresholds[:, None]).all(axis=0)
+                fused = canon_scores.sum(axis=0) if fusion == 'sum' else canon_scores.min(axis=0)
+            if not members.any():
+                multi_clue_track.append(key)
+                fused = None
+
+        if fused is not None:
+            # The filters only depend on the lowercase form, so every variant of a word passes or fails them
+            kept_canon = np.zeros(n_canon, dtype=bool)
+            kept_canon[canon[kept & length_mask]] = True
+            rank, n_cands = list_rank(fused, members, kept_canon, canon_ids, n_canon, gold, topn)
+        else:
+            rank, n_cands = list_rank(scores, searched, kept, canon, n_canon, gold, topn, phrases)
+
+        ranks.append(rank)
+        n_candidates.append(n_cands)
+        ranked_keys.append(key)
+        pairs += 1
+
+        if verbose > 0:
+            print(key)
+            print("Clue :", entry['synonyms'])
+            print("Answer: {}".format(solution))
+            print("Rank of Correct Answer :", rank if rank > 0 else "could not find correct answer")
+            print("--------------------------------------------------------------------")
+
+    metrics = rank_metrics(ranks)
+    errors = [clue_errors, sol_errors, short_lists(ranked_keys, n_candidates, 100),
+              short_lists(ranked_keys, n_candidates, 1000), short_lists(ranked_keys, n_candidates, 1),
+              multi_clue_track, []]
+
+    return metrics, errors, pairs
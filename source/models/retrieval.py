@@ -0,0 +1,252 @@
+import numpy as np
+
+
+DEFAULT_MEMORY_BUDGET = 2**30
+
+# Candidates retrieved per clue before deepening (see 'deepening_depths')
+DEFAULT_START_DEPTH = 2000
+
+
+def chunk_sizes(n_queries, n_rows, dim, k, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Choose how many queries and vocabulary rows to score at once so that the working set of
+    'batch_topk' stays within 'memory_budget' bytes
+
+    Half of the budget goes to the running top-k (ids and scores, plus room to merge a tile into it),
+    the other half to the score tile and the copy of the vocabulary rows it is computed from.
+
+    Args:
+      n_queries     : number of query vectors
+      n_rows        : number of vocabulary rows
+      dim           : dimension of the vectors
+      k             : number of candidates kept per query
+      memory_budget : bytes available for the working set
+
+    Returns:
+      Tuple of (queries per chunk, vocabulary rows per tile)
+
+    """
+    # int64 ids and float32 scores, for the running top-k and the merge buffer
+    per_query = 3 * k * (8 + 4)
+    query_chunk = int(max(1, min(n_queries, (memory_budget // 2) // per_query)))
+
+    # float32 scores for each query, plus a float32 copy of the row
+    per_row = 4 * query_chunk + 4 * dim
+    tile = int(max(min(k, n_rows), min(n_rows, (memory_budget // 2) // per_row)))
+
+    return query_chunk, tile
+
+
+def _normalise(queries):
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries / np.where(norms > 0, norms, 1)
+
+
+def _top_k(scores, ids, k):
+    """Top 'k' scores of every row of 'scores' with their 'ids', unordered. Of the entries tied with the
+    k-th score, those with the lowest ids are kept, so the result is the first 'k' of a sort by
+    descending score and then by id"""
+    if scores.shape[1] <= k:
+        return scores, ids
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, part, axis=1)
+
+    # argpartition keeps an arbitrary few of the entries tied at the k-th score
+    kth = np.take_along_axis(top_scores, np.argmin(top_scores, axis=1)[:, None], axis=1)
+    split = np.flatnonzero((scores == kth).sum(axis=1) > (top_scores == kth).sum(axis=1))
+    for i in split:
+        above = np.flatnonzero(scores[i] > kth[i])
+        tied = np.flatnonzero(scores[i] == kth[i])
+        tied = tied[np.argsort(ids[i, tied], kind='stable')[:k - len(above)]]
+        part[i] = np.concatenate([above, tied])
+        top_scores[i] = scores[i, part[i]]
+
+    return top_scores, np.take_along_axis(ids, part, axis=1)
+
+
+def batch_topk(vectors, queries, k, memory_budget=DEFAULT_MEMORY_BUDGET, rows=None, scales=None):
+    """Find the 'k' vocabulary rows with the highest cosine similarity to each query, scoring all queries
+    against a tile of the vocabulary with one matrix product and keeping a running top-k per query.
+
+    Args:
+      vectors       : L2-normalised embedding matrix (may be memory-mapped)
+      queries       : 2D array of query vectors, one per row. Need not be normalised
+      k             : number of candidates to return per query
+      memory_budget : bytes available for the working set, used to choose tile sizes
+      rows          : optional array of row ids; only these rows of 'vectors' are searched
+      scales        : optional scale of every row of 'vectors', for quantised matrices whose rows
+                      are stored as integers (see quantize.py)
+
+    Returns:
+      Tuple of (ids, scores), both of shape (len(queries), min(k, number of rows)), sorted by
+      descending score and then by row id. 'ids' are row ids of 'vectors'.
+
+    """
+    queries = _normalise(queries)
+    n_rows = len(vectors) if rows is None else len(rows)
+    k = min(k, n_rows)
+    if k == 0:
+        return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+    query_chunk, tile = chunk_sizes(len(queries), n_rows, queries.shape[1], k, memory_budget)
+
+    all_ids = np.empty((len(queries), k), dtype=np.int64)
+    all_scores = np.empty((len(queries), k), dtype=np.float32)
+    for q_start in range(0, len(queries), query_chunk):
+        q_block = queries[q_start:q_start+query_chunk]
+        best_scores = np.empty((len(q_block), 0), dtype=np.float32)
+        best_ids = np.empty((len(q_block), 0), dtype=np.int64)
+
+        for start in range(0, n_rows, tile):
+            if rows is None:
+                tile_ids = np.arange(start, min(start + tile, n_rows))
+                block = np.asarray(vectors[start:start+tile], dtype=np.float32)
+            else:
+                tile_ids = np.asarray(rows[start:start+tile], dtype=np.int64)
+                block = np.asarray(vectors[tile_ids], dtype=np.float32)
+
+            scores = q_block @ block.T
+            if scales is not None:
+                scores *= scales[tile_ids]
+            ids = np.broadcast_to(tile_ids, scores.shape)
+            scores, ids = _top_k(scores, ids, k)
+
+            best_scores, best_ids = _top_k(np.concatenate([best_scores, scores], axis=1),
+                                           np.concatenate([best_ids, ids], axis=1), k)
+
+        # Sort by descending score, breaking ties by row id
+        order = np.lexsort((best_ids, -best_scores), axis=1)
+        all_scores[q_start:q_start+query_chunk] = np.take_along_axis(best_scores, order, axis=1)
+        all_ids[q_start:q_start+query_chunk] = np.take_along_axis(best_ids, order, axis=1)
+
+    return all_ids, all_scores
+
+
+def iter_topk(vectors, queries, k, memory_budget=DEFAULT_MEMORY_BUDGET, row_sets=None, search=batch_topk):
+    """Lazily yield (ids, scores) for each query in turn, running 'batch_topk' on one chunk of
+    queries at a time so that only one chunk of results is held in memory
+
+    Args:
+      vectors       : L2-normalised embedding matrix (may be memory-mapped)
+      queries       : sequence of query vectors
+      k             : number of candidates to return per query
+      memory_budget : bytes available for the working set
+      row_sets      : optional list with an array of row ids (or None) for each query, restricting
+                      its search to those rows. Queries within a chunk that share the same array
+                      object are searched together
+      search        : function with the signature of 'batch_topk' used for each chunk, e.g. a
+                      two-stage quantised search from quantize.py
+
+    """
+    query_chunk, _ = chunk_sizes(len(queries), len(vectors), len(queries[0]) if len(queries) else 0,
+                                 max(1, min(k, len(vectors))), memory_budget)
+    for start in range(0, len(queries), query_chunk):
+        chunk = np.asarray(queries[start:start+query_chunk])
+        if row_sets is None:
+            ids, scores = search(vectors, chunk, k, memory_budget)
+            for i in range(len(ids)):
+                yield ids[i], scores[i]
+            continue
+
+        # Group the queries in this chunk by the rows they search
+        groups = {}
+        for i, rows in enumerate(row_sets[start:start+query_chunk]):
+            groups.setdefault(id(rows), (rows, []))[1].append(i)
+
+        results = [None] * len(chunk)
+        for rows, positions in groups.values():
+            ids, scores = search(vectors, chunk[positions], k, memory_budget, rows=rows)
+            for j, i in enumerate(positions):
+                results[i] = (ids[j], scores[j])
+        yield from results
+
+
+def deepening_depths(start, limit, growth=4):
+    """Numbers of candidates to retrieve in turn for one query until enough survive filtering: 'start',
+    then 'growth' times more each time, up to 'limit'. Only 'limit' if 'start' is None
+
+    Every search function in this package returns the top 'k' as a prefix of the top 'k * growth', and
+    the filters of 'nbow.master_base' keep or drop each candidate on its own, so the candidates that
+    survive a shallow search are the first of those that survive a deep one.
+
+    """
+    depth = limit if start is None else min(start, limit)
+    while True:
+        yield depth
+        if depth >= limit:
+            return
+        depth = min(depth * growth, limit)
+
+
+def resolve_aliases(ids, n_rows, aliases=None):
+    """Rows of the embedding matrix holding the vectors of vocabulary 'ids'. Ids from 'n_rows' on are
+    aliases, e.g. British spellings: id n_rows + i shares row aliases[i]
+
+    Args:
+      ids     : array of vocabulary ids
+      n_rows  : number of rows of the embedding matrix
+      aliases : row of every alias, or None
+
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if aliases is None or len(aliases) == 0:
+        return ids
+    return np.where(ids < n_rows, ids, aliases[np.maximum(ids - n_rows, 0)])
+
+
+def alias_scores(scores, aliases=None):
+    """Extend scores over the rows of the embedding matrix (last axis) to scores over all vocabulary
+    ids, aliases included. Aliases score the same as the row they share"""
+    if aliases is None or len(aliases) == 0:
+        return scores
+    return np.concatenate([scores, scores[..., aliases]], axis=-1)
+
+
+def alias_topk(vectors, queries, k, memory_budget=DEFAULT_MEMORY_BUDGET, rows=None, aliases=None, search=batch_topk):
+    """'batch_topk' over a vocabulary with aliases (see 'resolve_aliases'). Only the rows of 'vectors'
+    are scored; every alias is then ranked right after the row it shares, as if it were a copy of it
+
+    Args:
+      vectors       : L2-normalised embedding matrix (may be memory-mapped)
+      queries       : 2D array of query vectors, one per row
+      k             : number of candidates to return per query
+      memory_budget : bytes available for the working set
+      rows          : optional array of vocabulary ids, aliases included; only these are returned
+      aliases       : row of every alias
+      search        : function with the signature of 'batch_topk' that searches the rows of 'vectors'
+
+    Returns:
+      Tuple of (ids, scores) as returned by 'search', with vocabulary ids
+
+    """
+    n_rows = len(vectors)
+    alias_ids = np.arange(n_rows, n_rows + len(aliases))
+    searched, base = None, None
+    if rows is not None:
+        rows = np.asarray(rows, dtype=np.int64)
+        base, alias_ids = rows[rows < n_rows], rows[rows >= n_rows]
+        searched = np.union1d(base, aliases[alias_ids - n_rows])
+    ids, scores = search(vectors, queries, k, memory_budget, rows=searched)
+
+    # Aliases grouped by the row they share, in id order
+    targets = aliases[alias_ids - n_rows]
+    order = np.argsort(targets, kind='stable')
+    targets, alias_ids = targets[order], alias_ids[order]
+
+    all_ids, all_scores = [], []
+    for q_ids, q_scores in zip(ids, scores):
+        own = np.ones(len(q_ids), dtype=np.int64) if base is None else np.isin(q_ids, base).astype(np.int64)
+        lo = np.searchsorted(targets, q_ids, side='left')
+        n_alias = np.searchsorted(targets, q_ids, side='right') - lo
+        counts = own + n_alias
+        starts = np.cumsum(counts) - counts
+
+        out_ids = np.empty(counts.sum(), dtype=np.int64)
+        out_ids[starts[own == 1]] = q_ids[own == 1]
+        offsets = np.arange(n_alias.sum()) - np.repeat(np.cumsum(n_alias) - n_alias, n_alias)
+        out_ids[np.repeat(starts + own, n_alias) + offsets] = alias_ids[np.repeat(lo, n_alias) + offsets]
+        all_ids.append(out_ids[:k])
+        all_scores.append(np.repeat(q_scores, counts)[:k])
+
+    if isinstance(ids, np.ndarray):
+        return np.asarray(all_ids), np.asarray(all_scores)
+    return all_ids, all_scores
@@ -0,0 +1,402 @@
+import time
+
+import numpy as np
+
+from .anagram import AnagramSolver, phrase_scores
+from .filters import FilterPipeline
+from .nbow import SynonymRankings, key_adder
+from .quantize import search_function
+from .ranked import RankedList
+from .retrieval import DEFAULT_MEMORY_BUDGET, DEFAULT_START_DEPTH, chunk_sizes, deepening_depths, iter_topk
+from .store import load_model, matrix_rows, normed_vectors, vocab_keys
+from .vectorize import ClueVectorizer
+from .vocab_index import CanonicalVocab, VocabIndex
+
+
+# Enhancements of the NBOW variants 0 to 8 run by run_nbow.py, as (length, clue_word, anagrams,
+# multi_synonym, spelling, multiword)
+VARIANTS = [dict(zip(('length', 'clue_word', 'anagrams', 'multi_synonym', 'spelling', 'multiword'), flags))
+            for flags in [(False, False, False, False, False, False),
+                          (True, False, False, False, False, False),
+                          (True, True, False, False, False, False),
+                          (True, True, True, False, False, False),
+                          (True, True, True, True, False, False),
+                          (True, True, True, True, True, False),
+                          (True, True, True, False, True, False),
+                          (True, True, True, True, True, True),
+                          (True, True, True, False, True, True)]]
+
+# Enhancements of run_nbow.py when no variant is chosen: the filters of variant 8, without British spellings
+DEFAULT_ENHANCEMENTS = dict(VARIANTS[8], spelling=False)
+
+
+class Solution:
+    def __init__(self, entry):
+        """Answer candidates for one clue, and how the 'Solver' pipeline found them.
+
+        Stages read and update the fields of the solution as it goes through the pipeline.
+
+        Args:
+            entry: dict for one clue in the dataset.
+        """
+        self.entry = entry
+        # Some clues of the dataset have no synonyms, and so no answer candidates
+        self.clue = entry['all_synonyms'] or []
+        self.clue_vec = None
+        self.clue_errors = []
+        self.rows = None
+        self.depth = None
+        self.candidates = None
+        self.exhausted = False
+        self.partial = False
+        self.no_intersection = False
+        self.prefetched = None
+        # Rankings of the synonyms of a multi-synonym clue, scored once and fused again at every depth
+        self.rankings = None
+        # Best phrases of several words solving a multiword anagram, as (ids, scores, extra words), and
+        # the number of phrases found before keeping the best of them
+        self.phrases = None
+        self.phrases_found = 0
+        # Wall time of every stage, summed over retrieval depths, and the number of candidates going
+        # into and out of it at the last depth
+        self.timings = {}
+        self.counts = {}
+
+    def __len__(self):
+        return 0 if self.candidates is None else len(self.candidates)
+
+
+class Solver:
+    def __init__(self, w2v_model, enhancements=None, version=2, pooling='mean', topn=100000,
+                 memory_budget=DEFAULT_MEMORY_BUDGET, fusion='sum', nprobe=None, vectorizer=None,
+                 start_depth=DEFAULT_START_DEPTH, min_candidates=1000):
+        """Reusable NBOW clue solver with a pipeline of named stages.
+
+        The model's indexes are built once, so that clues can be solved one at a time with 'solve', or
+        many at once with 'solve_batch'. Every clue goes through the stages in 'pipeline' in turn:
+        'vectorise', 'retrieve', 'dedupe', 'anagram', 'multi_synonym', 'clue_word' and 'length'.
+        Stages before 'retrieve' run once per clue, the others again at every retrieval depth (see
+        'retrieval.deepening_depths') until enough candidates survive. More stages can be added with
+        'register'. Every stage that applies to a clue records its wall time and candidate counts in
+        the 'Solution'.
+
+        Args:
+            w2v_model: 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'.
+            enhancements: dictionary of constraints, as for 'nbow.master_base'. Defaults to all of them.
+            version: 1 - baseline, 2 - access to enhancements.
+            pooling: mean or sum pooling of the clue vectors.
+            topn: retrieve at most 'topn' answer candidates.
+            memory_budget: bytes available to retrieval, used to choose tile sizes.
+            fusion: how the multi_synonym enhancement combines rankings - 'sum', 'min' or 'rrf'.
+            nprobe: retrieve candidates from the store's IVF-PQ index, scanning this many lists per clue.
+            vectorizer: 'ClueVectorizer' of the model to reuse, e.g. one prepared by 'startup.start'.
+            start_depth: number of candidates retrieved first, or None to always retrieve 'topn'.
+            min_candidates: number of filtered candidates that is enough to stop retrieving more.
+        """
+        if enhancements is None:
+            enhancements = VARIANTS[7]
+        self.w2v_model = w2v_model
+        self.enhancements = enhancements
+        self.version = version
+        self.pooling = pooling
+        self.topn = topn
+        self.memory_budget = memory_budget
+        self.fusion = fusion
+        self.nprobe = nprobe
+        self.start_depth = start_depth
+        self.min_candidates = min_candidates
+
+        # Token -> row id lookups shared by all clues
+        self.vectorizer = ClueVectorizer(w2v_model) if vectorizer is None else vectorizer
+
+        # Only search vocabulary rows that can pass the length and anagram filters
+        enhanced = version == 2
+        self.restrict = enhanced and (enhancements['length'] == True or enhancements['anagrams'] == True)
+        self.restrictions = {'length': enhancements['length'] == True,
+                             'multiword': enhancements['multiword'] == True,
+                             'anagrams': enhancements['anagrams'] == True}
+        self.vocab_index = VocabIndex.from_model(w2v_model) if self.restrict else None
+
+        # Anagrams whose answer is a phrase of several vocabulary words
+        self.multiword_anagrams = self.restrict and self.restrictions['anagrams'] and self.restrictions['multiword']
+        self.anagram_solver = AnagramSolver.from_model(w2v_model) if self.multiword_anagrams else None
+
+        self.vectors = normed_vectors(w2v_model)
+        self.vocab = vocab_keys(w2v_model)
+        # Approximate search with the IVF-PQ index, or two-stage search for quantised or reduced stores
+        self.search = search_function(w2v_model, nprobe=nprobe)
+        # Lowercase form of every row, so candidates are unique canonical ids without per-clue string work
+        self.canonical = CanonicalVocab.from_model(w2v_model)
+        # Length, token pattern and anagram signature of every canonical form, for the filters
+        self.filters = None
+        if enhanced and enhancements['length'] == True:
+            self.filters = FilterPipeline.from_model(w2v_model, self.vocab_index)
+
+        self.pipeline = [('vectorise', self.vectorise),
+                         ('retrieve', self.retrieve),
+                         ('dedupe', self.dedupe),
+                         ('anagram', self.anagram),
+                         ('multi_synonym', self.multi_synonym),
+                         ('clue_word', self.clue_word),
+                         ('length', self.length)]
+
+    @classmethod
+    def load(cls, w2v_path, store_dir=None, wordpairs=None, precision='float32', pca=None, **kwargs):
+        """Load a model (from its compiled store if it is up to date, see 'store.load_model') and make
+        a solver for it. British spellings are added when the 'spelling' enhancement is on
+
+        Args:
+          w2v_path  : path to the word2vec binary
+          store_dir : directory of the compiled store, or None to always read the binary
+          wordpairs : list of (british, american) spelling pairs
+          precision : matrix searched in the store - 'float32', 'float16' or 'int8'
+          pca       : search the store's PCA-reduced matrix with this many dimensions instead
+          kwargs    : remaining arguments of 'Solver'
+
+        """
+        spelling = (kwargs.get('enhancements') or VARIANTS[7])['spelling'] == True
+        model, from_store = load_model(w2v_path, store_dir, wordpairs, spelling=spelling, precision=precision,
+                                       pca=pca)
+        if spelling and not from_store:
+            model = key_adder(model, wordpairs)
+        return cls(model, **kwargs)
+
+    def register(self, name, stage, before=None, after=None):
+        """Add a stage to the pipeline, at the end or next to the stage named 'before' or 'after'
+
+        Args:
+          name   : name of the stage, used in the timings and counts of every 'Solution'
+          stage  : function of a 'Solution', which it updates in place. Filtering stages replace
+                   'solution.candidates' (a 'RankedList'). A stage that does not apply to the clue
+                   returns False, and is then not recorded in the solution's timings and counts
+          before : name of the stage to insert it before
+          after  : name of the stage to insert it after
+
+        """
+        names = [existing for existing, _ in self.pipeline]
+        if before is not None:
+            position = names.index(before)
+        elif after is not None:
+            position = names.index(after) + 1
+        else:
+            position = len(names)
+        self.pipeline.insert(position, (name, stage))
+
+    def vectorise(self, solution):
+        """Clue vector, clue words not in the vocabulary, and the rows that can pass the filters"""
+        if solution.clue_vec is None:
+            solution.clue_vec, solution.clue_errors = self.vectorizer.vectorize(solution.clue, pooling=self.pooling)
+        if self.restrict:
+            solution.rows = self.vocab_index.candidate_rows(solution.entry, **self.restrictions)
+
+    def retrieve(self, solution):
+        """Top 'depth' vocabulary rows by cosine similarity to the clue. Skipped when the fused ranking of
+        the clue's synonyms replaces them (see 'multi_synonym')"""
+        if self._fusing(solution):
+            solution.candidates = RankedList(np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32), self.vocab)
+            return False
+        if solution.prefetched is not None:
+            # Retrieved for a whole batch of clues by 'iter_batch'
+            (ids, scores), solution.prefetched = solution.prefetched, None
+        else:
+            ids, scores = self.search(self.vectors, solution.clue_vec, solution.depth, self.memory_budget,
+                                      rows=solution.rows)
+            ids, scores = ids[0], scores[0]
+        solution.candidates = RankedList(ids, scores, self.vocab)
+        # Fewer candidates than asked for: the search already returned every row it could
+        solution.exhausted = len(ids) < solution.depth
+        solution.partial = False
+
+    def dedupe(self, solution):
+        """Keep the best-ranked case variant of every canonical form"""
+        if self._fusing(solution):
+            return False
+        rows = solution.candidates
+        canon, kept = self.canonical.first(rows.ids)
+        solution.candidates = RankedList(canon, rows.scores[kept], self.canonical.forms, [])
+
+    def anagram(self, solution):
+        """Add phrases of several vocabulary words that solve the anagram, ranked alongside single entries"""
+        entry = solution.entry
+        if not (self._anagram_clue(entry) and self.multiword_anagrams and len(entry['token_lengths']) > 1):
+            return False
+
+        canonical, candidates = self.canonical, solution.candidates
+        if solution.phrases is None:
+            # Found and scored once per clue
+            score = lambda phrases: phrase_scores(self.vectors, matrix_rows(self.w2v_model, phrases),
+                                                  solution.clue_vec)
+            phrases, scores, solution.phrases_found = self.anagram_solver.top_phrases(entry['anagram'],
+                                                                                      entry['token_lengths'], score)
+            phrase_list = ['_'.join(canonical.forms[c] for c in canonical.ids[phrase]) for phrase in phrases]
+            # Phrases that are not vocabulary entries get negative ids
+            extra = list(dict.fromkeys(word for word in phrase_list if word not in canonical.form_to_id))
+            phrase_ids = np.asarray([self._word_id(word, extra) for word in phrase_list], dtype=np.int64)
+            solution.phrases = (phrase_ids, scores, extra)
+
+        phrase_ids, scores, extra = solution.phrases
+        merged_ids = np.concatenate([candidates.ids, phrase_ids])
+        merged_scores = np.concatenate([candidates.scores, scores])
+        order = np.argsort(-merged_scores, kind='stable')
+        merged_ids, merged_scores = merged_ids[order], merged_scores[order]
+        # A phrase may also be a single vocabulary entry
+        _, first = np.unique(merged_ids, return_index=True)
+        first.sort()
+        solution.candidates = RankedList(merged_ids[first], merged_scores[first], canonical.forms, extra)
+        # Phrases scoring below the deepest retrieved entry are only placed correctly once every entry
+        # has been retrieved
+        solution.partial = len(phrase_ids) > 0
+
+    def multi_synonym(self, solution):
+        """Replace the candidates with the aggregate of the rankings for each synonym. The synonyms are
+        scored once per clue, and their rankings fused to the current depth"""
+        if not self._fusing(solution):
+            return False
+
+        if solution.rankings is None:
+            solution.rankings = SynonymRankings(self.w2v_model, solution.entry['synonyms'], n=100000,
+                                                pooling=self.pooling, vectorizer=self.vectorizer, nprobe=self.nprobe)
+        ids, scores = solution.rankings.fuse(solution.depth, method=self.fusion)
+        if len(ids) == 0:
+            # Without a word common to all rankings, the clue keeps the candidates retrieved for it
+            solution.no_intersection = True
+            return
+
+        solution.candidates = RankedList(ids, scores, self.canonical.forms, solution.candidates.extra)
+        solution.exhausted = len(ids) < solution.depth
+
+    def _fusing(self, solution):
+        # Whether the candidates of a clue are the fused ranking of its synonyms, as far as is known
+        entry = solution.entry
+        return (self.version == 2 and len(entry['synonyms'] or []) > 1 and self.enhancements['multi_synonym'] == True
+                and not self._anagram_clue(entry) and not solution.no_intersection)
+
+    def clue_word(self, solution):
+        """Filter out words in the clue"""
+        self._filter(solution, ('clue_word',))
+
+    def length(self, solution):
+        """Filter out words of incorrect length, and of incorrect word lengths for multiword answers"""
+        self._filter(solution, ('length', 'multiword'))
+
+    def _filter(self, solution, names):
+        if self.filters is None:
+            return
+        candidates = solution.candidates
+        stages = [stage for stage in self.filters.stages(solution.entry, solution.clue, self.enhancements,
+                                                         candidates.extra) if stage[0] in names]
+        if stages:
+            solution.candidates = candidates[self.filters.mask(candidates.ids, stages)]
+
+    def _anagram_clue(self, entry):
+        # Anagram clues were resolved to their exact candidates by the vocabulary index
+        return self.version == 2 and self.enhancements['anagrams'] == True and entry['anagram'] != None
+
+    def _run(self, name, stage, solution):
+        n_in = len(solution)
+        start_time = time.perf_counter()
+        if stage(solution) is False:
+            return
+        solution.timings[name] = solution.timings.get(name, 0.0) + time.perf_counter() - start_time
+        solution.counts[name] = (n_in, len(solution))
+
+    def _run_depth(self, solution, stages):
+        fusing = self._fusing(solution)
+        solution.candidates = None
+        for name, stage in stages:
+            self._run(name, stage, solution)
+        if fusing and solution.no_intersection:
+            # No word is common to the rankings of the synonyms, so the clue's own candidates are retrieved
+            self._run_depth(solution, stages)
+
+    def _solve(self, solution):
+        if len(solution.clue) == 0:
+            solution.clue_errors = []
+            solution.candidates = RankedList(np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32),
+                                             self.canonical.forms, [])
+            solution.exhausted = True
+            solution.prefetched = None
+            return solution
+
+        names = [name for name, _ in self.pipeline]
+        split = names.index('retrieve')
+        for name, stage in self.pipeline[:split]:
+            self._run(name, stage, solution)
+
+        # Retrieve answer candidates at growing depths until enough of them survive the filters
+        for depth in deepening_depths(self.start_depth, self.topn):
+            solution.depth = depth
+            self._run_depth(solution, self.pipeline[split:])
+            if (len(solution) >= self.min_candidates and not solution.partial) or solution.exhausted:
+                break
+        # The synonym scores are only needed while deepening
+        solution.rankings = None
+        return solution
+
+    def solve(self, entry):
+        """Answer candidates for one clue
+
+        Args:
+          entry : dict for one clue in the dataset, with at least 'all_synonyms', 'synonyms', 'anagram',
+                  'token_lengths' and 'pretty_solution'
+
+        Returns:
+          'Solution', whose 'candidates' are a 'RankedList' of the answer candidates. Clues without
+          synonyms ('all_synonyms' is None or empty) have no candidates
+
+        """
+        return self._solve(Solution(entry))
+
+    def iter_batch(self, entries):
+        """Lazily solve many clues, vectorising them all up front and retrieving the first candidates
+        for one chunk of clues at a time with tiled matrix products (see 'retrieval.iter_topk'). The
+        time of this shared work is split evenly over the clues it was done for, as part of their
+        'vectorise' and 'retrieve' stages"""
+        solutions = [Solution(entry) for entry in entries]
+        if len(solutions) == 0:
+            return
+        start_time = time.perf_counter()
+        clue_vecs, clue_errors = self.vectorizer.vectorize_batch([s.clue for s in solutions], pooling=self.pooling)
+        row_sets = None
+        if self.restrict:
+            row_sets = [self.vocab_index.candidate_rows(s.entry, **self.restrictions) for s in solutions]
+        vectorise_time = (time.perf_counter() - start_time) / len(solutions)
+        depth = next(deepening_depths(self.start_depth, self.topn))
+
+        query_chunk, _ = chunk_sizes(len(solutions), len(self.vectors), clue_vecs.shape[1],
+                                     max(1, min(depth, len(self.vectors))), self.memory_budget)
+        for start in range(0, len(solutions), query_chunk):
+            chunk = range(start, min(start + query_chunk, len(solutions)))
+            # Clues whose candidates are fused from their synonyms' rankings retrieve nothing for themselves
+            fetched = [i for i in chunk if not self._fusing(solutions[i])]
+            start_time = time.perf_counter()
+            retrieved = list(iter_topk(self.vectors, clue_vecs[fetched], depth, self.memory_budget,
+                                       None if row_sets is None else [row_sets[i] for i in fetched],
+                                       search=self.search)) if fetched else []
+            retrieve_time = (time.perf_counter() - start_time) / max(1, len(retrieved))
+            prefetched = dict(zip(fetched, retrieved))
+
+            for i in chunk:
+                solution = solutions[i]
+                solution.clue_vec, solution.clue_errors = clue_vecs[i], clue_errors[i]
+                solution.timings = {'vectorise': vectorise_time}
+                if i in prefetched:
+                    solution.prefetched = prefetched[i]
+                    solution.timings['retrieve'] = retrieve_time
+                yield self._solve(solution)
+
+    def solve_batch(self, entries):
+        """Answer candidates for many clues, as a list of 'Solution'. See 'iter_batch'"""
+        return list(self.iter_batch(entries))
+
+    def answer_rank(self, solution, answer):
+        """1-based rank of the word 'answer' among the candidates of a solution, or 0 if it is not there"""
+        return solution.candidates.rank(self._word_id(answer, solution.candidates.extra))
+
+    def _word_id(self, word, extra):
+        # Canonical id of a word, or the negative id of one of the 'extra' words of a ranking
+        if word in self.canonical.form_to_id:
+            return self.canonical.form_to_id[word]
+        if extra and word in extra:
+            return -extra.index(word) - 1
+        return None
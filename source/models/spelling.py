@@ -0,0 +1,87 @@
+import os
+
+import pandas as pd
+
+
+# Lookup file of (british, american) spelling pairs written by 'write_wordpairs'
+DEFAULT_WORDPAIRS = './data/wordpairs.txt'
+
+# Rules that turn an American spelling into its British variant, as (name, pattern, replacement,
+# source_only). Patterns match the end of a lowercase word and need at least three letters before the
+# changed part. A rule with 'source_only' set also accepts a pair whose British form is not in the
+# vocabulary; the others need both forms, since their patterns also match unrelated words. Only pairs
+# whose British form is missing from the vocabulary become aliases in a store (see
+# 'store.spelling_aliases'), so the pairs of the other rules only pair up two words that already have
+# their own vectors, for the lookups written by getspellings.py.
+RULES = [
+    # realize -> realise, organization -> organisation. Leaves size, seize, prize, maize and baize alone
+    ('ize', r'(?<=[a-z]{3})(?<![aes])(?<!pr)iz(e|es|ed|ing|ation|ations|er|ers)$', r'is\1', True),
+    # analyze -> analyse
+    ('yze', r'(?<=[a-z]{3})yz(e|es|ed|ing|er|ers)$', r'ys\1', True),
+    # color -> colour, favorite -> favourite
+    ('our', r'(?<=[a-z]{3})or(|s|ed|ing|ful|less|able|ably|ite|ites|er|ers)$', r'our\1', False),
+    # center -> centre, theater -> theatre
+    ('re', r'(?<=[a-z]{3})(?<=[bt])er(|s)$', r're\1', False),
+    # catalog -> catalogue
+    ('ogue', r'(?<=[a-z]{3})og(|s)$', r'ogue\1', False),
+    # traveled -> travelled, for stems of two or more syllables
+    ('lled', r'^([a-z]*[aeiou][^aeiou]+[aeiou])l(ed|ing|er|ers)$', r'\1ll\2', False),
+]
+
+
+def generate_wordpairs(words, seed_pairs=None):
+    """Find British variants of the words of a vocabulary with the spelling rules in 'RULES'. Every
+    rule is applied to the whole vocabulary at once.
+
+    A pair is kept if its American form is in the vocabulary and, unless the rule is 'source_only',
+    its British form is too. Pairs from 'seed_pairs' (e.g. the hand-written list in 'amer_brit') are
+    kept as they are and take precedence for their British form.
+
+    Args:
+      words      : list of vocabulary words
+      seed_pairs : list of (british, american) spelling pairs, or None
+
+    Returns:
+      List of (british, american) pairs sorted by British form, and a dict with the number of pairs
+      found by each rule
+
+    """
+    vocab = pd.Series(pd.unique(pd.Series(words, dtype=object)), dtype=object)
+    vocab = vocab[vocab.str.fullmatch('[a-z]+')]
+
+    found = []
+    counts = {}
+    for name, pattern, replacement, source_only in RULES:
+        brit = vocab.str.replace(pattern, replacement, regex=True)
+        keep = brit != vocab
+        if not source_only:
+            keep &= brit.isin(vocab)
+        found.append(pd.DataFrame({'brit': brit[keep], 'amer': vocab[keep]}))
+        counts[name] = int(keep.sum())
+
+    seed = pd.DataFrame(list(seed_pairs or []), columns=['brit', 'amer'], dtype=object)
+    pairs = pd.concat([seed] + found, ignore_index=True)
+    pairs = pairs[pairs['brit'] != pairs['amer']].drop_duplicates('brit').sort_values('brit', kind='stable')
+    return list(zip(pairs['brit'], pairs['amer'])), counts
+
+
+def write_wordpairs(pairs, path=DEFAULT_WORDPAIRS):
+    """Write spelling pairs to a lookup file, one tab-separated pair per line"""
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(f'{brit}\t{amer}' for brit, amer in pairs))
+
+
+def read_wordpairs(path=DEFAULT_WORDPAIRS):
+    """Read the spelling pairs written by 'write_wordpairs'. Falls back on the hand-written list in
+    'amer_brit' if the lookup file has not been generated
+
+    Returns:
+      List of (british, american) pairs
+
+    """
+    if not os.path.isfile(path):
+        from .amer_brit import wordpairs
+        return wordpairs
+
+    with open(path, 'r', encoding='utf-8') as file:
+        return [tuple(line.split('\t')) for line in file.read().split('\n') if line]
@@ -0,0 +1,119 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .nbow import key_adder
+from .store import is_stale, load_model, read_store_meta, read_store_vocab
+from .vectorize import ClueVectorizer
+from .vocab_index import CanonicalVocab
+
+
+class StageTimer:
+    def __init__(self):
+        """Wall time of the named stages of a run, which may overlap when they run in different threads."""
+        self.times = {}
+        self.start_time = time.time()
+
+    def run(self, name, function, *args, **kwargs):
+        """Call 'function' and record its wall time as stage 'name'"""
+        start_time = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.times[name] = time.time() - start_time
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def report(self):
+        """Print the time of every stage, and the wall time of all of them together"""
+        for name, dur in self.times.items():
+            print(f'  {name:<12} {dur:7.1f} s')
+        elapsed = self.elapsed()
+        print(f'Startup took {elapsed:.1f} s ({sum(self.times.values()):.1f} s of work in stages)')
+
+
+def load_dataset(filepath):
+    with open(filepath, 'r') as file:
+        return json.load(file)
+
+
+def prepare_clues(data, words):
+    """Map the clues of a dataset to row ids of a vocabulary, without the model
+
+    Args:
+      data  : dict containing full dataset
+      words : list of words, ordered by vocabulary id
+
+    Returns:
+      Tuple of (unbound 'ClueVectorizer' with every clue prepared, 'CanonicalVocab' of 'words')
+
+    """
+    vectorizer = prepare_vectorizer(ClueVectorizer(None, key_to_index=dict(zip(words, range(len(words))))), data)
+    return vectorizer, CanonicalVocab(words)
+
+
+def prepare_vectorizer(vectorizer, data):
+    """Prepare 'vectorizer' for the clues and solutions of a dataset"""
+    vectorizer.prepare(entry['all_synonyms'] for entry in data.values())
+    vectorizer.prepare(entry['tokenized_solution'] for entry in data.values())
+    return vectorizer
+
+
+def start(filepath, w2v_path, store_dir=None, wordpairs=None, spelling=False, precision='float32', pca=None):
+    """Load the model and the dataset concurrently, ready for 'nbow.master_base'
+
+    The dataset is parsed in a background thread while the model is opened or read. When the model
+    comes from an up to date compiled store, the thread also reads the store's vocabulary and maps
+    every clue and solution to row ids, and the model reuses that vocabulary instead of reading it
+    again. The time to the first result is then that of the slowest stage rather than their sum.
+
+    Args:
+      filepath  : path to the '*-entries.json' dataset
+      w2v_path  : path to the word2vec binary
+      store_dir : directory of the compiled store, or None to always read the binary
+      wordpairs : list of (british, american) spelling pairs
+      spelling  : add British spellings to the model
+      precision : matrix searched in the store - 'float32', 'float16' or 'int8'
+      pca       : search the store's PCA-reduced matrix with this many dimensions instead
+
+    Returns:
+      Tuple of (model, dataset, prepared 'ClueVectorizer', 'StageTimer' of the stages)
+
+    """
+    timer = StageTimer()
+    use_store = store_dir is not None and not is_stale(store_dir, w2v_path, wordpairs)
+
+    def dataset_stage():
+        data = timer.run('dataset', load_dataset, filepath)
+        if not use_store:
+            return data, None, None, None
+        meta = read_store_meta(store_dir)
+        words = timer.run('vocabulary', read_store_vocab, store_dir, spelling=spelling, meta=meta)
+        return data, words, timer.run('clue ids', prepare_clues, data, words), meta
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        dataset_future = executor.submit(dataset_stage)
+        model, from_store = timer.run('model', load_model, w2v_path, store_dir, wordpairs,
+                                      spelling=spelling, precision=precision, pca=pca)
+        if spelling and not from_store:
+            # Compiled stores already include the British spellings
+            model = timer.run('spelling', key_adder, model, wordpairs)
+        data, words, prepared, meta = dataset_future.result()
+
+    # The clue ids are only those of the model if it was opened from the same store, which may have
+    # gone stale or been rebuilt since the dataset stage read its vocabulary
+    if prepared is not None and not (from_store and model.meta == meta and len(words) == len(model)):
+        prepared = None
+
+    if prepared is None:
+        vectorizer = timer.run('clue ids', lambda: prepare_vectorizer(ClueVectorizer(model), data))
+    else:
+        vectorizer, canonical = prepared
+        # Share the vocabulary read by the dataset stage rather than reading it from the store again
+        model._index_to_key = words
+        model._key_to_index = vectorizer.key_to_index
+        model._canonical_vocab = canonical
+        vectorizer.bind(model)
+
+    return model, data, vectorizer, timer
@@ -0,0 +1,497 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .pca import projection_paths
+from .quantize import PRECISIONS, quantized_paths, search_function
+from .ranked import RankedList
+from .retrieval import DEFAULT_MEMORY_BUDGET, alias_scores, resolve_aliases
+from .w2v_reader import read_word2vec
+
+
+STORE_VERSION = 4
+
+
+def vocab_keys(w2v_model):
+    """Return the vocabulary of a model as a list of strings, ordered by row
+
+    Args:
+      w2v_model : 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'
+
+    """
+    if hasattr(w2v_model, 'index_to_key'):
+        return w2v_model.index_to_key
+    return w2v_model.index2word
+
+
+def key_index(w2v_model):
+    """Return the word -> row id mapping of a model
+
+    Args:
+      w2v_model : 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'
+
+    """
+    if hasattr(w2v_model, 'key_to_index'):
+        return w2v_model.key_to_index
+    return {word: vocab.index for word, vocab in w2v_model.vocab.items()}
+
+
+def normed_vectors(w2v_model):
+    """Return the L2-normalised embedding matrix of a model, as used for cosine similarity
+
+    Args:
+      w2v_model : 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'
+
+    """
+    if hasattr(w2v_model, 'get_normed_vectors'):
+        return w2v_model.get_normed_vectors()
+    w2v_model.init_sims()
+    return w2v_model.vectors_norm
+
+
+def matrix_rows(w2v_model, ids):
+    """Return the rows of the embedding matrix of a model that hold the vectors of vocabulary ids
+    'ids'. These differ only for the spelling aliases of an 'EmbeddingStore'
+
+    Args:
+      w2v_model : 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'
+      ids       : array of vocabulary ids
+
+    """
+    return resolve_aliases(ids, len(w2v_model.vectors), getattr(w2v_model, 'aliases', None))
+
+
+def vocab_scores(w2v_model, scores):
+    """Extend scores over the rows of the embedding matrix of a model (last axis) to scores over its
+    whole vocabulary, including the spelling aliases of an 'EmbeddingStore'
+
+    Args:
+      w2v_model : 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'
+      scores    : array of scores, one per row of the matrix along the last axis
+
+    """
+    return alias_scores(scores, getattr(w2v_model, 'aliases', None))
+
+
+def raw_vectors(w2v_model, ids):
+    """Return the original (unnormalised) vectors of vocabulary ids 'ids' of a model, as float32
+
+    Args:
+      w2v_model : 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore'
+      ids       : array of vocabulary ids
+
+    """
+    if isinstance(w2v_model, EmbeddingStore):
+        rows = matrix_rows(w2v_model, ids)
+        return np.asarray(w2v_model.vectors[rows], dtype=np.float32) * w2v_model.norms[rows][:, None]
+    return np.asarray(w2v_model.vectors[ids], dtype=np.float32)
+
+
+def spelling_aliases(keys, index, wordpairs):
+    """British spellings from 'wordpairs' that can be added to a vocabulary as aliases of the rows of
+    their American counterparts
+
+    Args:
+      keys      : list of words, ordered by row
+      index     : word -> row id mapping
+      wordpairs : list of (british, american) spelling pairs, or None
+
+    Returns:
+      Tuple of (list of British spellings, array with the row of each)
+
+    """
+    brits, aliases = [], []
+    if wordpairs is not None:
+        seen = set(keys)
+        for brit, amer in wordpairs:
+            if brit in seen or amer not in index:
+                continue
+            seen.add(brit)
+            brits.append(brit)
+            aliases.append(index[amer])
+    return brits, np.asarray(aliases, dtype=np.int64)
+
+
+def normalise_rows(vectors):
+    """L2-normalise the rows of a float32 matrix in place, one chunk at a time
+
+    Returns:
+      float32 array with the original norm of every row
+
+    """
+    norms = np.empty(len(vectors), dtype=np.float32)
+    chunk = 100000
+    for start in range(0, len(vectors), chunk):
+        block = vectors[start:start+chunk]
+        norms[start:start+chunk] = np.linalg.norm(block, axis=1)
+        block /= np.maximum(norms[start:start+chunk], 1e-12)[:, None]
+    return norms
+
+
+def source_fingerprint(w2v_path, wordpairs=None):
+    """Summarise the inputs of a store, so that a stale store can be detected
+
+    Args:
+      w2v_path  : path to the word2vec binary the store is compiled from
+      wordpairs : list of (british, american) spelling pairs, or None
+
+    """
+    stat = os.stat(w2v_path)
+    if wordpairs is None:
+        pairs_hash = None
+    else:
+        pairs_hash = hashlib.sha1(json.dumps(list(map(list, wordpairs))).encode('utf-8')).hexdigest()
+
+    return {'version': STORE_VERSION,
+            'source': os.path.basename(w2v_path),
+            'source_size': stat.st_size,
+            'source_mtime': int(stat.st_mtime),
+            'wordpairs': pairs_hash}
+
+
+def is_stale(store_dir, w2v_path, wordpairs=None):
+    """Check whether the store in 'store_dir' is missing or out of date
+
+    Args:
+      store_dir : directory containing a compiled store
+      w2v_path  : path to the word2vec binary the store should be compiled from
+      wordpairs : list of (british, american) spelling pairs, or None
+
+    """
+    meta_path = os.path.join(store_dir, 'meta.json')
+    if not os.path.isfile(meta_path):
+        return True
+
+    with open(meta_path, 'r') as file:
+        meta = json.load(file)
+
+    return meta.get('fingerprint') != source_fingerprint(w2v_path, wordpairs)
+
+
+def build_store(w2v_path, store_dir, wordpairs=None, limit=None):
+    """Compile a word2vec binary into a memory-mappable store. The store holds a float32, L2-normalised
+    embedding matrix, the original row norms, the vocabulary and its 'VocabIndex'. British spellings
+    from 'wordpairs' are appended to the vocabulary as aliases of the rows of their American
+    counterparts, in the same way as 'nbow.key_adder', so their vectors are not stored twice.
+
+    The store is written to a temporary directory first and then moved into place, so processes
+    opening 'store_dir' never see a half-written store.
+
+    Args:
+      w2v_path  : path to the word2vec binary (e.g. GoogleNews-vectors-negative300.bin.gz)
+      store_dir : directory to write the store to
+      wordpairs : list of (british, american) spelling pairs, or None
+      limit     : only read the first 'limit' vectors from the binary
+
+    """
+    keys, vectors = read_word2vec(w2v_path, limit=limit)
+    n_base = len(keys)
+    brits, aliases = spelling_aliases(keys, dict(zip(keys, range(n_base))), wordpairs)
+
+    meta = {'fingerprint': source_fingerprint(w2v_path, wordpairs),
+            'size': n_base + len(brits),
+            'base_size': n_base,
+            'vector_size': int(vectors.shape[1])}
+    write_store(store_dir, keys + brits, lambda ids: np.asarray(vectors[ids], dtype=np.float32),
+                np.arange(n_base, dtype=np.int64), meta, aliases)
+
+    return meta
+
+
+def write_store(store_dir, keys, read_rows, rows, meta, aliases=None):
+    """Write a store in the format read by 'EmbeddingStore'. The store is written to a temporary
+    directory first and then moved into place.
+
+    Args:
+      store_dir : directory to write the store to
+      keys      : list of words, one per row of the store followed by one per alias
+      read_rows : function returning the unnormalised float32 vectors of an array of source row ids
+      rows      : source row id of every row of the store
+      meta      : contents of meta.json
+      aliases   : row of the store shared by every alias (e.g. British spellings), or None
+
+    """
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.store-')
+
+    # Write normalised vectors in chunks to keep peak memory down
+    out = np.lib.format.open_memmap(os.path.join(tmp_dir, 'vectors.npy'), mode='w+',
+                                    dtype=np.float32, shape=(len(rows), meta['vector_size']))
+    norms = np.empty(len(rows), dtype=np.float32)
+    chunk = 100000
+    for start in range(0, len(rows), chunk):
+        block = read_rows(rows[start:start+chunk])
+        block_norms = np.linalg.norm(block, axis=1)
+        out[start:start+chunk] = block / np.maximum(block_norms, 1e-12)[:, None]
+        norms[start:start+chunk] = block_norms
+    out.flush()
+    del out
+    np.save(os.path.join(tmp_dir, 'norms.npy'), norms)
+    np.save(os.path.join(tmp_dir, 'aliases.npy'), np.asarray([] if aliases is None else aliases, dtype=np.int64))
+
+    with open(os.path.join(tmp_dir, 'vocab.txt'), 'w', encoding='utf-8') as file:
+        file.write('\n'.join(keys))
+
+    from .vocab_index import VocabIndex
+    VocabIndex.from_words(keys).save(tmp_dir)
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as file:
+        json.dump(meta, file)
+
+    # Swap the new store into place
+    if os.path.isdir(store_dir):
+        old_dir = tempfile.mkdtemp(dir=parent, prefix='.store-old-')
+        os.replace(store_dir, os.path.join(old_dir, 'store'))
+        os.replace(tmp_dir, store_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.replace(tmp_dir, store_dir)
+
+
+def read_store_meta(store_dir):
+    """Contents of the meta.json of a compiled store: its fingerprint and sizes"""
+    with open(os.path.join(store_dir, 'meta.json'), 'r') as file:
+        return json.load(file)
+
+
+def read_store_vocab(store_dir, spelling=True, meta=None):
+    """Read the vocabulary of a compiled store without opening its matrix
+
+    Args:
+      store_dir : directory containing a compiled store
+      spelling  : include the British spelling aliases
+      meta      : contents of the store's meta.json, if already read
+
+    Returns:
+      List of words, ordered by vocabulary id
+
+    """
+    if meta is None:
+        meta = read_store_meta(store_dir)
+    with open(os.path.join(store_dir, 'vocab.txt'), 'r', encoding='utf-8') as file:
+        return file.read().split('\n')[:meta['size'] if spelling else meta['base_size']]
+
+
+class EmbeddingStore:
+    def __init__(self, store_dir, spelling=True, mmap=True, precision='float32', pca=None):
+        """Read-only embedding store compiled by 'build_store'.
+
+        The matrix is opened with a read-only memory map, so every process on a host that opens the
+        same store shares one copy of it in the page cache. Implements the parts of gensim's
+        'KeyedVectors' interface used by the NBOW model.
+
+        British spellings are aliases: vocabulary ids from len(vectors) on, which share the row of
+        their American counterpart (see 'aliases'). Searches return them right after that row.
+
+        With a 'float16' or 'int8' precision, searches scan the quantised matrix written by
+        'quantize.write_quantized' and only read the best candidates from the float32 matrix to
+        rescore them, so the float32 matrix mostly stays out of memory. With 'pca', searches scan the
+        PCA-reduced matrix written by 'pca.write_projection' in the same way.
+
+        Args:
+            store_dir: directory containing a compiled store.
+            spelling: include the British spelling aliases added by 'build_store'.
+            mmap: memory-map the matrix instead of reading it into memory.
+            precision: 'float32', 'float16' or 'int8'. Matrix scanned by searches.
+            pca: number of dimensions of a PCA-reduced matrix to scan instead, e.g. 64 or 128.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f'Unknown precision "{precision}" (must be one of {", ".join(PRECISIONS)})')
+        if pca is not None and precision != 'float32':
+            raise ValueError('A store can be searched with a quantised or a PCA-reduced matrix, not both')
+
+        self.store_dir = store_dir
+        self.spelling = spelling
+        self.meta = read_store_meta(store_dir)
+
+        mmap_mode = 'r' if mmap else None
+        self.vectors = np.load(os.path.join(store_dir, 'vectors.npy'), mmap_mode=mmap_mode)
+        self.norms = np.load(os.path.join(store_dir, 'norms.npy'), mmap_mode=mmap_mode)
+        self.aliases = np.load(os.path.join(store_dir, 'aliases.npy')) if spelling else np.empty(0, dtype=np.int64)
+        self.vector_size = self.meta['vector_size']
+        self.precision = precision
+        self.pca = pca
+        self.coarse = None
+        self.scales = None
+        self.projection = None
+        if precision != 'float32':
+            vectors_path, scales_path = quantized_paths(store_dir, precision)
+            if not os.path.isfile(vectors_path):
+                raise FileNotFoundError(f'Store at "{store_dir}" has no {precision} matrix. '
+                                        f'Run source/build_store.py --quantize {precision} to add it.')
+            self.coarse = np.load(vectors_path, mmap_mode=mmap_mode)
+            if scales_path is not None:
+                self.scales = np.load(scales_path, mmap_mode=mmap_mode)
+        if pca is not None:
+            vectors_path, components_path = projection_paths(store_dir, pca)
+            if not os.path.isfile(vectors_path):
+                raise FileNotFoundError(f'Store at "{store_dir}" has no {pca}-dimension PCA matrix. '
+                                        f'Run source/build_store.py --pca {pca} to add it.')
+            self.coarse = np.load(vectors_path, mmap_mode=mmap_mode)
+            self.projection = np.load(components_path)
+        self._index_to_key = None
+        self._key_to_index = None
+        self._ivfpq = None
+
+    @classmethod
+    def from_arrays(cls, vectors, norms, index_to_key, aliases=None):
+        """Make a store from arrays already in memory (e.g. in shared memory), rather than a directory.
+
+        Args:
+            vectors: L2-normalised float32 embedding matrix.
+            norms: original norm of every row.
+            index_to_key: list of words, ordered by row, followed by the aliases.
+            aliases: row shared by every alias, or None.
+        """
+        aliases = np.empty(0, dtype=np.int64) if aliases is None else np.asarray(aliases, dtype=np.int64)
+        store = cls.__new__(cls)
+        store.store_dir = None
+        store.spelling = True
+        store.meta = {'size': len(vectors) + len(aliases), 'base_size': len(vectors),
+                      'vector_size': vectors.shape[1]}
+        store.vectors = vectors
+        store.norms = norms
+        store.aliases = aliases
+        store.vector_size = vectors.shape[1]
+        store.precision = 'float32'
+        store.pca = None
+        store.coarse = None
+        store.scales = None
+        store.projection = None
+        store._index_to_key = list(index_to_key)
+        store._key_to_index = None
+        store._ivfpq = None
+        return store
+
+    @classmethod
+    def from_keyed_vectors(cls, w2v_model, wordpairs=None):
+        """Make a store from a model loaded in memory, with British spellings from 'wordpairs' as
+        aliases of the rows of their American counterparts.
+
+        The matrix of a gensim model is normalised in place and shared with the store rather than
+        copied, so the model should not be used afterwards.
+
+        Args:
+            w2v_model: 'KeyedVectors' (gensim 3 or 4), or an 'EmbeddingStore' without aliases.
+            wordpairs: list of (british, american) spelling pairs, or None.
+        """
+        keys = list(vocab_keys(w2v_model))
+        brits, aliases = spelling_aliases(keys, key_index(w2v_model), wordpairs)
+        if isinstance(w2v_model, EmbeddingStore):
+            return cls.from_arrays(w2v_model.vectors, w2v_model.norms, keys + brits, aliases)
+
+        vectors = w2v_model.vectors
+        norms = normalise_rows(vectors)
+        return cls.from_arrays(vectors, norms, keys + brits, aliases)
+
+    @classmethod
+    def from_word2vec(cls, w2v_path, limit=None):
+        """Read a word2vec binary straight into a store in memory, without gensim.
+
+        Args:
+            w2v_path: path to the word2vec binary.
+            limit: only read the first 'limit' vectors.
+        """
+        keys, vectors = read_word2vec(w2v_path, limit=limit)
+        norms = normalise_rows(vectors)
+        return cls.from_arrays(vectors, norms, keys)
+
+    @property
+    def index_to_key(self):
+        """List of words, ordered by row. Read on first use."""
+        if self._index_to_key is None:
+            self._index_to_key = read_store_vocab(self.store_dir)[:len(self)]
+        return self._index_to_key
+
+    @property
+    def key_to_index(self):
+        """Dictionary of word -> vocabulary id. Built on first use."""
+        if self._key_to_index is None:
+            self._key_to_index = dict(zip(self.index_to_key, range(len(self))))
+        return self._key_to_index
+
+    @property
+    def ivfpq(self):
+        """'ann.IVFPQIndex' saved in the store by 'build_store.py --ann'. Read on first use."""
+        if self._ivfpq is None:
+            if self.store_dir is None:
+                raise FileNotFoundError('Stores made from arrays have no IVF-PQ index')
+            from .ann import IVFPQIndex
+            self._ivfpq = IVFPQIndex.load(self.store_dir)
+        return self._ivfpq
+
+    def __len__(self):
+        return len(self.vectors) + len(self.aliases)
+
+    def __contains__(self, word):
+        return word in self.key_to_index
+
+    def get_vector(self, word, norm=False):
+        """Vector for 'word'. Raises KeyError for words not in the vocabulary."""
+        index = int(matrix_rows(self, self.key_to_index[word]))
+        if norm:
+            return np.array(self.vectors[index])
+        return self.vectors[index] * self.norms[index]
+
+    def __getitem__(self, word):
+        return self.get_vector(word)
+
+    def get_normed_vectors(self):
+        return self.vectors
+
+    def similar_by_vector(self, vector, topn=10, restrict_vocab=None):
+        """Find the 'topn' words most similar to 'vector' by cosine similarity, as a 'ranked.RankedList'
+        of (word, score) pairs whose words are only read when asked for. A quantised or PCA-reduced
+        store returns the two-stage search results.
+
+        Args:
+          vector         : query vector
+          topn           : number of words to return
+          restrict_vocab : only consider the first 'restrict_vocab' words
+
+        """
+        rows = None if restrict_vocab is None else np.arange(min(restrict_vocab, len(self)))
+        ids, scores = search_function(self)(self.vectors, np.asarray(vector, dtype=np.float32)[None, :], topn,
+                                            DEFAULT_MEMORY_BUDGET, rows=rows)
+        return RankedList(ids[0], scores[0], self.index_to_key)
+
+
+def load_model(w2v_path, store_dir=None, wordpairs=None, spelling=False, precision='float32', pca=None):
+    """Open the compiled store for 'w2v_path' if it is up to date, otherwise fall back on
+    reading the word2vec binary into memory (see 'w2v_reader.read_word2vec')
+
+    Args:
+      w2v_path  : path to the word2vec binary
+      store_dir : directory of the compiled store, or None to always read the binary
+      wordpairs : list of (british, american) spelling pairs the store was compiled with
+      spelling  : include British spellings from the store
+      precision : matrix searched in the store - 'float32', 'float16' or 'int8' (see 'EmbeddingStore')
+      pca       : search the store's PCA-reduced matrix with this many dimensions instead
+
+    Returns:
+      Tuple of the model and a boolean which is True if the compiled store was used. Raises
+      FileNotFoundError if a quantised or PCA-reduced matrix is asked for but the store cannot be used
+
+    """
+    if store_dir is not None and not is_stale(store_dir, w2v_path, wordpairs):
+        return EmbeddingStore(store_dir, spelling=spelling, precision=precision, pca=pca), True
+
+    # The binary only holds the float32 matrix
+    missing = 'No compiled store given' if store_dir is None else f'Compiled store at "{store_dir}" is missing or stale'
+    if precision != 'float32':
+        raise FileNotFoundError(f'{missing}, so its {precision} matrix cannot be searched. '
+                                f'Run source/build_store.py --quantize {precision} to rebuild it.')
+    if pca is not None:
+        raise FileNotFoundError(f'{missing}, so its {pca}-dimension PCA matrix cannot be searched. '
+                                f'Run source/build_store.py --pca {pca} to rebuild it.')
+
+    if store_dir is not None:
+        print(f'Compiled store at "{store_dir}" is missing or stale, loading "{w2v_path}". '
+              f'Run source/build_store.py to rebuild it.')
+
+    return EmbeddingStore.from_word2vec(w2v_path), False
@@ -0,0 +1,138 @@
+import numpy as np
+
+from .store import key_index, raw_vectors
+
+
+class ClueVectorizer:
+    def __init__(self, w2v_model, key_to_index=None):
+        """Turns lists of clue tokens into pooled clue vectors.
+
+        Tokens are mapped to row ids through the model's word -> row id mapping, and tokens that are
+        not in the vocabulary (e.g. 'to') are remembered in a negative cache, so every token costs a
+        single set or dict lookup. Pooling is done in float32 over all the ids of a clue at once.
+
+        A vectorizer can also be made from 'key_to_index' alone, before the model is loaded, to map
+        clues to row ids in advance (see 'prepare'). It must then be given the model with 'bind'
+        before pooling.
+
+        Args:
+            w2v_model: 'KeyedVectors' (gensim 3 or 4) or 'EmbeddingStore', or None.
+            key_to_index: word -> row id mapping of the model. Read from the model if None.
+        """
+        self.w2v_model = w2v_model
+        self.key_to_index = key_index(w2v_model) if key_to_index is None else key_to_index
+        self.vector_size = None if w2v_model is None else w2v_model.vector_size
+        self.oov = set()
+        self.prepared = {}
+
+    def bind(self, w2v_model):
+        """Pool clues with the vectors of 'w2v_model', which must have the vocabulary of 'key_to_index'"""
+        self.w2v_model = w2v_model
+        self.vector_size = w2v_model.vector_size
+        return self
+
+    def prepare(self, token_lists):
+        """Map clues to row ids in advance, so that later calls for them skip the token lookups
+
+        Args:
+          token_lists : list of lists of tokens, one list per clue
+
+        """
+        for tokens in token_lists:
+            if tokens is not None:
+                self.prepared[tuple(tokens)] = self.token_ids(tokens)
+
+    def token_ids(self, tokens):
+        """Row ids of the tokens in the vocabulary, and the list of tokens that are not"""
+        if self.prepared:
+            known = self.prepared.get(tuple(tokens))
+            if known is not None:
+                return list(known[0]), list(known[1])
+        ids = []
+        errors = []
+        for token in tokens:
+            if token in self.oov:
+                errors.append(token)
+                continue
+            index = self.key_to_index.get(token)
+            if index is None:
+                self.oov.add(token)
+                errors.append(token)
+            else:
+                ids.append(index)
+        return ids, errors
+
+    def missing(self, tokens):
+        """Tokens that are not in the vocabulary, as tracked by 'nbow.sol_tracker'"""
+        return self.token_ids(tokens)[1]
+
+    def pack(self, token_lists):
+        """Map a list of clues to one flat array of row ids
+
+        Args:
+          token_lists : list of lists of tokens, one list per clue
+
+        Returns:
+          Tuple of (ids, offsets, n_tokens, errors). The ids of clue i are ids[offsets[i]:offsets[i+1]],
+          n_tokens[i] is the number of tokens in clue i including those not in the vocabulary, and
+          errors[i] lists those tokens
+
+        """
+        ids = []
+        offsets = [0]
+        n_tokens = []
+        errors = []
+        for tokens in token_lists:
+            clue_ids, clue_errors = self.token_ids(tokens)
+            ids.extend(clue_ids)
+            offsets.append(len(ids))
+            n_tokens.append(len(tokens))
+            errors.append(clue_errors)
+
+        return (np.asarray(ids, dtype=np.int64), np.asarray(offsets, dtype=np.int64),
+                np.asarray(n_tokens, dtype=np.int64), errors)
+
+    def pool(self, packed, pooling):
+        """Sum or mean pool packed clues into a float32 array with one clue vector per row
+
+        As in 'nbow.clue_vectorizer', mean pooling divides by the number of tokens in the clue,
+        including those not in the vocabulary.
+
+        Args:
+          packed  : tuple returned by 'pack'
+          pooling : sum or mean
+
+        """
+        ids, offsets, n_tokens, _ = packed
+        clue_vecs = np.zeros((len(n_tokens), self.vector_size), dtype=np.float32)
+        if len(ids) > 0:
+            starts = offsets[:-1]
+            nonempty = offsets[1:] > starts
+            clue_vecs[nonempty] = np.add.reduceat(raw_vectors(self.w2v_model, ids), starts[nonempty], axis=0)
+
+        if pooling == 'mean':
+            clue_vecs /= np.maximum(n_tokens, 1)[:, None]
+
+        return clue_vecs
+
+    def vectorize(self, tokens, pooling):
+        """Vector representation of a single clue, and the clue words not in the vocabulary
+
+        Args:
+          tokens  : list of tokens representing clue
+          pooling : sum or mean
+
+        """
+        packed = self.pack([tokens])
+        return self.pool(packed, pooling)[0], packed[3][0]
+
+    def vectorize_batch(self, token_lists, pooling):
+        """Vector representations of many clues, one per row, and the clue words not in the vocabulary
+
+        Args:
+          token_lists : list of lists of tokens, one list per clue
+          pooling     : sum or mean
+
+        """
+        packed = self.pack(token_lists)
+        return self.pool(packed, pooling), packed[3]
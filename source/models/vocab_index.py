@@ -0,0 +1,243 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .store import vocab_keys
+
+
+def token_pattern(word):
+    """Lengths of the underscore-separated tokens of a word, e.g. (3, 5) for 'big_shot'"""
+    return tuple(len(token) for token in word.split('_'))
+
+
+def anagram_signature(word):
+    """Hash of the sorted letters of a word, ignoring underscores. Anagrams share a signature"""
+    letters = ''.join(sorted(word.replace('_', '')))
+    return int.from_bytes(hashlib.blake2b(letters.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+class CanonicalVocab:
+    def __init__(self, words):
+        """Canonical (lowercase) vocabulary of a model.
+
+        Every row is mapped to the id of its lowercased form, so that case variants such as 'Paris'
+        and 'paris' share one canonical id. Ranked rows can then be reduced to unique canonical ids,
+        keeping the best-ranked variant, without building or lowercasing strings per query.
+
+        Args:
+            words: list of words, ordered by row.
+        """
+        forms = {}
+        self.ids = np.fromiter((forms.setdefault(word.lower(), len(forms)) for word in words),
+                               dtype=np.int64, count=len(words))
+        self.forms = list(forms)
+        self.form_to_id = forms
+        self._order = None
+        self._starts = None
+
+    @classmethod
+    def from_arrays(cls, ids, forms):
+        """Canonical vocabulary from the arrays of one built before (e.g. in shared memory)
+
+        Args:
+            ids: array with the canonical id of every row.
+            forms: list of canonical forms, indexed by canonical id.
+        """
+        vocab = cls.__new__(cls)
+        vocab.ids = ids
+        vocab.forms = list(forms)
+        vocab.form_to_id = dict(zip(vocab.forms, range(len(vocab.forms))))
+        vocab._order = None
+        vocab._starts = None
+        return vocab
+
+    @classmethod
+    def from_model(cls, w2v_model):
+        """Canonical vocabulary of a model, built on first use and kept on the model"""
+        vocab = vocab_keys(w2v_model)
+        cached = getattr(w2v_model, '_canonical_vocab', None)
+        if cached is None or len(cached.ids) != len(vocab):
+            cached = cls(vocab)
+            w2v_model._canonical_vocab = cached
+        return cached
+
+    def __len__(self):
+        return len(self.forms)
+
+    def first(self, rows):
+        """Canonical ids of ranked 'rows', keeping the first (best-ranked) row of every form
+
+        Returns:
+          Tuple of (canonical ids in rank order, positions in 'rows' of the rows kept)
+
+        """
+        ids = self.ids[rows]
+        _, positions = np.unique(ids, return_index=True)
+        positions.sort()
+        return ids[positions], positions
+
+    def _groups(self):
+        # Rows sorted by canonical id, and where the rows of every canonical id start
+        if self._order is None:
+            self._order = np.argsort(self.ids, kind='stable')
+            self._starts = np.searchsorted(self.ids[self._order], np.arange(len(self.forms)))
+        return self._order, self._starts
+
+    def segment_max(self, scores):
+        """Best score of every canonical id over its case variants
+
+        Args:
+          scores : array with one score per row along its last axis
+
+        Returns:
+          Array with one score per canonical id along its last axis
+
+        """
+        if len(self.forms) == len(self.ids):
+            # No case variants, so canonical ids are rows
+            return scores
+        order, starts = self._groups()
+        return np.maximum.reduceat(np.take(scores, order, axis=-1), starts, axis=-1)
+
+    def rows_of(self, canon_ids):
+        """Rows of every case variant of 'canon_ids'
+
+        Returns:
+          Tuple of (rows, grouped by canonical id in the order of 'canon_ids', and the position in
+          'rows' where the group of every canonical id starts)
+
+        """
+        order, starts = self._groups()
+        bounds = np.append(starts, len(order))
+        canon_ids = np.asarray(canon_ids, dtype=np.int64)
+        counts = bounds[canon_ids + 1] - bounds[canon_ids]
+        group_starts = np.cumsum(counts) - counts
+        offsets = np.arange(counts.sum()) - np.repeat(group_starts, counts)
+        return order[np.repeat(bounds[canon_ids], counts) + offsets], group_starts
+
+
+def _group(codes):
+    """Map each distinct value of 'codes' to the sorted array of rows holding it"""
+    order = np.argsort(codes, kind='stable')
+    values, starts = np.unique(codes[order], return_index=True)
+    bounds = list(starts[1:]) + [len(order)]
+    return {int(value): order[start:end] for value, start, end in zip(values, starts, bounds)}
+
+
+class VocabIndex:
+    def __init__(self, lengths, pattern_codes, patterns, signatures):
+        """Index of the vocabulary of a model by answer shape and letters.
+
+        Rows are keyed by their total length, by the pattern of their underscore-separated token
+        lengths and by their anagram signature, all measured on the lowercased word in the same way
+        as the filters in 'util'. This lets a search be restricted to the rows that can pass the
+        length and anagram filters before any similarities are computed.
+
+        Args:
+            lengths: array with the length of every row.
+            pattern_codes: array with the code of every row's token-length pattern.
+            patterns: list of token-length patterns (tuples), indexed by code.
+            signatures: array with the anagram signature of every row.
+        """
+        self.lengths = lengths
+        self.pattern_codes = pattern_codes
+        self.patterns = patterns
+        self.signatures = signatures
+        self.pattern_to_code = {pattern: code for code, pattern in enumerate(patterns)}
+        self._by_length = None
+        self._by_pattern = None
+        self._by_signature = None
+
+    @classmethod
+    def from_words(cls, words):
+        """Build the index from a list of words, ordered by row."""
+        pattern_to_code = {}
+        lengths = np.empty(len(words), dtype=np.int32)
+        pattern_codes = np.empty(len(words), dtype=np.int32)
+        signatures = np.empty(len(words), dtype=np.int64)
+        for i, word in enumerate(words):
+            word = word.lower()
+            lengths[i] = len(word)
+            pattern_codes[i] = pattern_to_code.setdefault(token_pattern(word), len(pattern_to_code))
+            signatures[i] = anagram_signature(word)
+        return cls(lengths, pattern_codes, list(pattern_to_code), signatures)
+
+    @classmethod
+    def from_model(cls, w2v_model):
+        """Build the index for a model, or read the one saved with a compiled store. Kept on the model"""
+        cached = getattr(w2v_model, '_vocab_index', None)
+        if cached is not None and len(cached.lengths) == len(vocab_keys(w2v_model)):
+            return cached
+        store_dir = getattr(w2v_model, 'store_dir', None)
+        if store_dir is not None and os.path.isfile(os.path.join(store_dir, 'patterns.json')):
+            cached = cls.load(store_dir, size=len(w2v_model))
+        else:
+            cached = cls.from_words(vocab_keys(w2v_model))
+        w2v_model._vocab_index = cached
+        return cached
+
+    def save(self, store_dir):
+        np.save(os.path.join(store_dir, 'lengths.npy'), self.lengths)
+        np.save(os.path.join(store_dir, 'pattern_codes.npy'), self.pattern_codes)
+        np.save(os.path.join(store_dir, 'signatures.npy'), self.signatures)
+        with open(os.path.join(store_dir, 'patterns.json'), 'w') as file:
+            json.dump(self.patterns, file)
+
+    @classmethod
+    def load(cls, store_dir, size=None):
+        lengths = np.load(os.path.join(store_dir, 'lengths.npy'), mmap_mode='r')[:size]
+        pattern_codes = np.load(os.path.join(store_dir, 'pattern_codes.npy'), mmap_mode='r')[:size]
+        signatures = np.load(os.path.join(store_dir, 'signatures.npy'), mmap_mode='r')[:size]
+        with open(os.path.join(store_dir, 'patterns.json'), 'r') as file:
+            patterns = [tuple(pattern) for pattern in json.load(file)]
+        return cls(np.asarray(lengths), np.asarray(pattern_codes), patterns, np.asarray(signatures))
+
+    def rows_with_length(self, length):
+        """Sorted array of the rows whose length is 'length'"""
+        if self._by_length is None:
+            self._by_length = _group(self.lengths)
+        return self._by_length.get(length, np.empty(0, dtype=np.int64))
+
+    def rows_with_pattern(self, token_lengths):
+        """Sorted array of the rows whose token lengths are exactly 'token_lengths'"""
+        if self._by_pattern is None:
+            self._by_pattern = _group(self.pattern_codes)
+        code = self.pattern_to_code.get(tuple(token_lengths))
+        return self._by_pattern.get(code, np.empty(0, dtype=np.int64))
+
+    def rows_with_anagram(self, letters):
+        """Sorted array of the rows that are anagrams of 'letters' (ignoring underscores)"""
+        if self._by_signature is None:
+            self._by_signature = _group(self.signatures)
+        return self._by_signature.get(anagram_signature(letters.lower()), np.empty(0, dtype=np.int64))
+
+    def candidate_rows(self, entry, length=True, multiword=False, anagrams=False):
+        """Rows that can survive the length and anagram filters of 'nbow.master_base' for a dataset entry
+
+        Args:
+          entry     : dict for one clue in the dataset
+          length    : whether the 'length' enhancement is active
+          multiword : whether the 'multiword' enhancement is active
+          anagrams  : whether the 'anagrams' enhancement is active
+
+        Returns:
+          Sorted array of row ids, or None if every row can survive
+
+        """
+        rows = None
+        if anagrams and entry['anagram'] is not None:
+            rows = self.rows_with_anagram(entry['anagram'])
+
+        if length:
+            if rows is None and multiword:
+                return self.rows_with_pattern(entry['token_lengths'])
+            elif rows is None:
+                return self.rows_with_length(len(entry['pretty_solution']))
+            elif multiword:
+                rows = rows[self.pattern_codes[rows] == self.pattern_to_code.get(tuple(entry['token_lengths']), -1)]
+            else:
+                rows = rows[self.lengths[rows] == len(entry['pretty_solution'])]
+
+        return rows
@@ -0,0 +1,178 @@
+import gzip
+import queue
+import threading
+
+import numpy as np
+
+
+# Bytes decompressed per read
+DEFAULT_BLOCK_SIZE = 64 * 2**20
+
+def _open(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def _read_blocks(file, block_size, blocks, stop):
+    """Put the blocks of 'file' on the queue 'blocks', ending with an empty block, until 'stop' is
+    set. Runs in a background thread: zlib releases the GIL, so decompression overlaps with parsing"""
+    try:
+        while not stop.is_set():
+            block = file.read(block_size)
+            while not stop.is_set():
+                try:
+                    blocks.put(block, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if len(block) == 0:
+                return
+    except Exception as error:
+        blocks.put(error)
+
+
+def _word_ends(buffer, row_bytes, max_records):
+    """Offsets of the spaces that end the words of the first complete records in 'buffer', at most
+    'max_records'. Only the words are scanned: each record's vector is skipped by its size"""
+    ends = []
+    append, find = ends.append, buffer.find
+    pos = 0
+    last = len(buffer) - row_bytes - 1
+    for _ in range(max_records):
+        end = find(b' ', pos)
+        if end < 0 or end > last:
+            break
+        append(end)
+        pos = end + 1 + row_bytes
+    return np.asarray(ends, dtype=np.int64)
+
+
+def _words(buf, starts, ends, encoding):
+    """Decode the words buf[starts[i]:ends[i]] at once, as gensim does one at a time"""
+    # The space after every word separates it from the next
+    lengths = ends - starts + 1
+    offsets = np.cumsum(lengths) - lengths
+    text = buf[np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)].tobytes().decode(encoding)
+    words = text.split(' ')[:-1]
+    if '\n' in text:
+        # Records may be separated by newlines
+        words = [word.lstrip('\n') for word in words]
+    return words
+
+
+def _rows(buf, starts, dim, out):
+    """Copy the float32 vectors at byte offsets 'starts' of 'buf' into the rows of 'out'"""
+    for offset in range(4):
+        selected = np.flatnonzero(starts % 4 == offset)
+        if len(selected) > 0:
+            floats = buf[offset:offset + (len(buf) - offset) // 4 * 4].view('<f4')
+            out[selected] = np.lib.stride_tricks.sliding_window_view(floats, dim)[(starts[selected] - offset) // 4]
+
+
+def read_word2vec(path, limit=None, keep=None, block_size=DEFAULT_BLOCK_SIZE, encoding='utf-8'):
+    """Read a binary word2vec file (e.g. GoogleNews-vectors-negative300.bin.gz) into memory
+
+    The file is decompressed in large blocks by a background thread. The records of a block are found
+    by scanning for the space that ends each word and skipping the vector after it. The words of the
+    block are then decoded together, and its vectors copied out of it with one strided gather per
+    byte alignment rather than one record at a time. Gives the same keys and vectors as gensim's
+    'KeyedVectors.load_word2vec_format(path, binary=True, limit=limit)'.
+
+    Args:
+      path       : path to the binary file, gzipped if it ends in '.gz'
+      limit      : only read the first 'limit' records
+      keep       : optional function of a word that returns False for records to skip
+      block_size : bytes decompressed per read
+      encoding   : encoding of the words
+
+    Returns:
+      Tuple of (list of words, float32 array with one vector per word)
+
+    """
+    with _open(path) as file:
+        n_records, dim = (int(value) for value in file.readline().split())
+        if limit is not None:
+            n_records = min(n_records, limit)
+        row_bytes = 4 * dim
+        # Words are short, so a small limit needs no more than a small first block
+        block_size = min(block_size, n_records * (row_bytes + 256) + 1)
+
+        blocks = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        reader = threading.Thread(target=_read_blocks, args=(file, block_size, blocks, stop), daemon=True)
+        reader.start()
+
+        try:
+            keys = []
+            vectors = np.empty((n_records, dim), dtype=np.float32)
+            buffer = bytearray()
+            n_read = 0
+            while n_read < n_records:
+                block = blocks.get()
+                if isinstance(block, Exception):
+                    raise block
+                buffer += block
+
+                # Words, then vectors, of the records complete in the buffer
+                ends = _word_ends(buffer, row_bytes, n_records - n_read)
+                starts = np.concatenate([[0], ends + 1 + row_bytes]).astype(np.int64)
+                consumed, starts = int(starts[-1]), starts[:-1]
+                buf = np.frombuffer(buffer, dtype=np.uint8)
+                words = _words(buf, starts, ends, encoding)
+                n_read += len(ends)
+                if keep is not None:
+                    kept = np.flatnonzero([keep(word) for word in words])
+                    words, ends = [words[i] for i in kept], ends[kept]
+                _rows(buf, ends + 1, dim, vectors[len(keys):len(keys) + len(words)])
+                keys.extend(words)
+
+                # Keep the incomplete record at the end for the next block
+                del buf
+                del buffer[:consumed]
+
+                if len(block) == 0 and n_read < n_records:
+                    raise EOFError(f'"{path}" ends after {n_read} of {n_records} records')
+        finally:
+            stop.set()
+            reader.join()
+
+    if len(keys) < n_records:
+        vectors = vectors[:len(keys)].copy()
+    return keys, vectors
+
+
+def read_vocab(path, limit=None, encoding='utf-8'):
+    """Read only the words of a binary word2vec file, in row order. Each record's vector is skipped
+    with a seek, so a plain file is never read in full (a gzipped one still has to be decompressed)
+
+    Args:
+      path     : path to the binary file, gzipped if it ends in '.gz'
+      limit    : only read the first 'limit' words
+      encoding : encoding of the words
+
+    Returns:
+      List of words
+
+    """
+    with _open(path) as file:
+        n_records, dim = (int(value) for value in file.readline().split())
+        if limit is not None:
+            n_records = min(n_records, limit)
+        row_bytes = 4 * dim
+        # Enough for most words, and less than a vector so that every seek goes forward
+        peek = min(64, row_bytes)
+
+        keys = []
+        for i in range(n_records):
+            head = file.read(peek)
+            start = 1 if head[:1] == b'\n' else 0
+            end = head.find(b' ', start)
+            while end < 0:
+                more = file.read(peek)
+                if len(more) == 0:
+                    raise EOFError(f'"{path}" ends after {i} of {n_records} records')
+                head += more
+                end = head.find(b' ', start)
+            keys.append(head[start:end].decode(encoding))
+            file.seek(row_bytes - (len(head) - end - 1), 1)
+
+    return keys
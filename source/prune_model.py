@@ -0,0 +1,66 @@
+import argparse
+import glob
+import json
+import os
+import time
+
+from models.nbow import master_base
+from models.prune import DEFAULT_MAX_LENGTH, prune_store
+from models.solver import DEFAULT_ENHANCEMENTS
+from models.spelling import read_wordpairs
+from models.store import EmbeddingStore
+
+
+def store_bytes(store_dir):
+    """Size of the matrix and norms of a store"""
+    return sum(os.path.getsize(os.path.join(store_dir, name)) for name in ('vectors.npy', 'norms.npy'))
+
+
+def accuracy(store_dir, data, keys, spelling):
+    metrics, _, runs = master_base(EmbeddingStore(store_dir, spelling=spelling), data, keys, pooling='mean',
+                                   version=2, topn=100000, verbose=0, enhancements=DEFAULT_ENHANCEMENTS,
+                                   rank_only=True)
+    return [metrics[4] / runs, metrics[0] / runs, metrics[1] / runs, metrics[5] / runs]
+
+
+if __name__ == '__main__':
+    script_desc = 'Write a compact store with only the vocabulary entries that can be crossword answers'
+    parser = argparse.ArgumentParser(description=script_desc)
+    parser.add_argument('--store', dest='store', type=str, default='./data/GoogleNews-store',
+                        help='Compiled model store to prune (see build_store.py)')
+    parser.add_argument('--output', dest='output', type=str, default='./data/GoogleNews-pruned',
+                        help='Directory to write the compact store to. Defaults to \'./data/GoogleNews-pruned\'')
+    parser.add_argument('--max-length', dest='max_length', type=int, default=DEFAULT_MAX_LENGTH,
+                        help=f'Longest answer to keep, in letters. Defaults to {DEFAULT_MAX_LENGTH}')
+    parser.add_argument('--spelling', dest='spelling', action='store_true',
+                        help='Include British spellings when comparing accuracy')
+    parser.add_argument('--datasets', dest='datasets', nargs='*', default=None,
+                        help='Datasets to compare accuracy on, e.g. gquick-100. Defaults to every gquick set in \'./data\'')
+    args = parser.parse_args()
+    wordpairs = read_wordpairs()
+
+    start_time = time.time()
+    meta = prune_store(args.store, args.output, wordpairs, args.max_length)
+    print(f'Wrote {meta["size"]} entries ({meta["size"] - meta["base_size"]} British spellings) to '
+          f'"{args.output}" in {(time.time()-start_time)/60:.1f} mins.')
+
+    original, pruned = store_bytes(args.store), store_bytes(args.output)
+    print(f'Vocabulary: {meta["pruned"]["source_size"]} -> {meta["base_size"]} entries')
+    print(f'Matrix: {original / 2**30:.2f} GB -> {pruned / 2**30:.2f} GB ({1 - pruned / original:.1%} saved)')
+
+    datasets = args.datasets
+    if datasets is None:
+        paths = glob.glob('./data/gquick-*-entries.json')
+        datasets = sorted((os.path.basename(path)[:-len('-entries.json')] for path in paths),
+                          key=lambda name: int(name.split('-')[1]))
+
+    names = ['Accuracy @ Rank 1', 'Accuracy @ Rank 10', 'Accuracy @ Rank 100', 'Accuracy @ Rank 1000']
+    for dataset in datasets:
+        with open(f'./data/{dataset}-entries.json', 'r') as file:
+            data = json.load(file)
+        keys = list(data.keys())
+        before = accuracy(args.store, data, keys, args.spelling)
+        after = accuracy(args.output, data, keys, args.spelling)
+        print(dataset)
+        for name, old, new in zip(names, before, after):
+            print(f'  {name}: {old:.2%} -> {new:.2%} ({new - old:+.2%})')
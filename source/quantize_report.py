@@ -0,0 +1,89 @@
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from models.nbow import master_base
+from models.quantize import search_function
+from models.retrieval import batch_topk
+from models.solver import DEFAULT_ENHANCEMENTS
+from models.store import EmbeddingStore
+from models.vectorize import ClueVectorizer
+from run_nbow import print_metrics
+
+
+def neighbour_recall(exact_model, model, data, keys, k, pooling='mean'):
+    """Mean fraction of the exact top 'k' rows of each clue that the search of 'model' also returns"""
+    vectorizer = ClueVectorizer(exact_model)
+    clue_vecs, _ = vectorizer.vectorize_batch([data[key]['all_synonyms'] for key in keys], pooling=pooling)
+    exact_ids, _ = batch_topk(exact_model.vectors, clue_vecs, k)
+    ids, _ = search_function(model)(model.vectors, clue_vecs, k)
+    return float(np.mean([len(np.intersect1d(a, b)) / max(len(a), 1) for a, b in zip(exact_ids, ids)]))
+
+
+if __name__ == '__main__':
+    script_desc = 'Compare the answer ranks of quantised, PCA-reduced and exact searches of the compiled store on the gquick test sets'
+    parser = argparse.ArgumentParser(description=script_desc)
+    parser.add_argument('--store', dest='store', type=str, default='./data/GoogleNews-store',
+                        help='Compiled model store with quantised or reduced matrices (see build_store.py --quantize, --pca)')
+    parser.add_argument('--precisions', dest='precisions', nargs='+', default=['float16', 'int8'],
+                        choices=['float16', 'int8'], help='Quantised matrices to compare with float32')
+    parser.add_argument('--pca', dest='pca', nargs='+', type=int, default=[],
+                        help='Numbers of dimensions of PCA-reduced matrices to compare with float32, e.g. 64 128')
+    parser.add_argument('--datasets', dest='datasets', nargs='+', default=None,
+                        help='Datasets to evaluate, e.g. gquick-100. Defaults to every gquick set in \'./data\'')
+    parser.add_argument('--topn', dest='topn', type=int, default=100000,
+                        help='Number of answer candidates retrieved per clue. Defaults to 100000')
+    parser.add_argument('--output', dest='output', type=str, default=None,
+                        help='Also write the report to this JSON file')
+    args = parser.parse_args()
+
+    datasets = args.datasets
+    if datasets is None:
+        paths = glob.glob('./data/gquick-*-entries.json')
+        datasets = sorted((os.path.basename(path)[:-len('-entries.json')] for path in paths),
+                          key=lambda name: int(name.split('-')[1]))
+
+    models = {'float32': EmbeddingStore(args.store, spelling=False)}
+    for precision in args.precisions:
+        models[precision] = EmbeddingStore(args.store, spelling=False, precision=precision)
+    for dims in args.pca:
+        models[f'pca{dims}'] = EmbeddingStore(args.store, spelling=False, pca=dims)
+
+    report = {}
+    for dataset in datasets:
+        with open(f'./data/{dataset}-entries.json', 'r') as file:
+            data = json.load(file)
+        keys = [key for key in data if data[key]['all_synonyms'] is not None]
+
+        results = {}
+        for precision, model in models.items():
+            start_time = time.time()
+            metrics, _, runs = master_base(model, data, keys, pooling='mean', version=2, topn=args.topn,
+                                           verbose=0, enhancements=DEFAULT_ENHANCEMENTS, batch=True)
+            print(f'--- {dataset}, {precision} ---')
+            print_metrics(metrics, runs)
+            results[precision] = {'seconds': time.time() - start_time,
+                                  'accuracy@1': metrics[4] / runs,
+                                  'accuracy@10': metrics[0] / runs,
+                                  'accuracy@100': metrics[1] / runs,
+                                  'accuracy@1000': metrics[5] / runs}
+            if precision != 'float32':
+                results[precision]['neighbour_recall@100'] = neighbour_recall(models['float32'], model, data, keys, 100)
+
+        report[dataset] = results
+        print(f'{dataset} ({len(keys)} clues), change from float32')
+        for precision, result in results.items():
+            line = f'  {precision:>7}:'
+            for name in ('accuracy@1', 'accuracy@10', 'accuracy@100', 'accuracy@1000'):
+                line += f' {name} {result[name]:.2%} ({result[name] - results["float32"][name]:+.2%}),'
+            if 'neighbour_recall@100' in result:
+                line += f' neighbour recall@100 {result["neighbour_recall@100"]:.2%},'
+            print(line + f' {result["seconds"]:.1f}s')
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
@@ -1,15 +1,16 @@
 import argparse
-import json
 import os
 import time
 import urllib
 
 import numpy as np
-import pandas as pd
-import gensim
 
-from models.nbow import master_base, key_adder
-from models.amer_brit import wordpairs
+from models.nbow import master_base
+from models.parallel import parallel_base
+from models.profiling import Profiler
+from models.solver import DEFAULT_ENHANCEMENTS, VARIANTS
+from models.spelling import read_wordpairs
+from models.startup import start
 
 
 def print_metrics(metrics, runs):
@@ -33,19 +34,44 @@ def print_metrics(metrics, runs):
     print(f"Median answer rank, top 1000: {median_at_1000}")
 
 
+def print_depths(depths):
+    if len(depths) == 0:
+        return
+    depths = np.asarray(depths)
+    print(f"Answer candidates retrieved per clue: median {np.median(depths):.0f}, "
+          f"95th percentile {np.percentile(depths, 95):.0f}, max {depths.max()}")
+    print(f"Clues answered from the first {depths.min()} candidates: {np.mean(depths == depths.min()):.2%}")
+
+
 if __name__ == '__main__':
     script_desc = 'Run the neural bag-of-words model (NBOW) on the \'gquick\' dataset'
     parser = argparse.ArgumentParser(description=script_desc)
     parser.add_argument('filename', type=str,
                         help='File where data is located, excluding \'*-entries.json\' suffix. Must be in \'./data\'')
-    parser.add_argument('--variant', dest='variant', type=int, nargs=1, default=0,
-                        help='Choose variant to run. Defaults to 0')
+    parser.add_argument('--variant', dest='variant', type=int, default=None,
+                        help='Choose variant to run (0 to 8). Defaults to the length, clue word, anagram and multi-word '
+                             'filters without British spellings')
+    parser.add_argument('--store', dest='store', type=str, default='./data/GoogleNews-store',
+                        help='Compiled model store (see build_store.py). Used instead of the W2V binary when up to date')
+    parser.add_argument('--precision', dest='precision', type=str, default='float32', choices=['float32', 'float16', 'int8'],
+                        help='Matrix of the compiled store to search. float16 and int8 rescore the best candidates in float32')
+    parser.add_argument('--pca', dest='pca', type=int, default=None,
+                        help='Retrieve candidates from the store\'s PCA-reduced matrix with this many dimensions, rescoring the best in full')
+    parser.add_argument('--nprobe', dest='nprobe', type=int, default=None,
+                        help='Search the approximate IVF-PQ index of the compiled store, scanning this many lists per clue')
+    parser.add_argument('--batch', dest='batch', action='store_true',
+                        help='Retrieve answer candidates for many clues at once')
+    parser.add_argument('--rank-only', dest='rank_only', action='store_true',
+                        help='Only compute the rank of the correct answer for each clue (same metrics, faster)')
+    parser.add_argument('--workers', dest='workers', type=int, default=1,
+                        help='Number of worker processes to evaluate clues with. Defaults to 1')
+    parser.add_argument('--profile', dest='profile', nargs='?', const='', default=None,
+                        help='Report per-stage latency percentiles, candidate counts and RSS, and write them to this '
+                             'JSON file. Defaults to \'./{filename}-variant{variant}-profile.json\'')
     args = parser.parse_args()
-    
-    # Load the dataset
-    filepath = f'./data/{args.filename}-entries.json'
-    with open(filepath, 'r') as file:
-        data = json.load(file)
+    if args.profile is not None and (args.workers > 1 or args.rank_only):
+        parser.error('--profile needs a single worker and cannot be combined with --rank-only')
+    wordpairs = read_wordpairs()
     
     # Download Google's pretrained W2V model
     w2v_path = './data/GoogleNews-vectors-negative300.bin.gz'
@@ -54,95 +80,48 @@ if __name__ == '__main__':
         url = 'https://nlpcrossworddata.blob.core.windows.net/test/GoogleNews-vectors-negative300.bin.gz'
         urllib.request.urlretrieve(url, w2v_path)
     
-    # Load W2V model into memory
-    model = gensim.models.KeyedVectors.load_word2vec_format(w2v_path, binary=True)
-    
     # Choose which BOW variant to run
-    if args.variant == 0:
-        enhancements = {'length': False,
-                        'clue_word': False,
-                        'anagrams': False,
-                        'multi_synonym': False,
-                        'spelling': False,
-                        'multiword': False}
-    elif args.variant == 1:
-        enhancements = {'length': True,
-                        'clue_word': False,
-                        'anagrams': False,
-                        'multi_synonym': False,
-                        'spelling': False,
-                        'multiword': False}
-    elif args.variant == 2:
-        enhancements = {'length': True,
-                        'clue_word': True,
-                        'anagrams': False,
-                        'multi_synonym': False,
-                        'spelling': False,
-                        'multiword': False}
-    elif args.variant == 3:
-        enhancements = {'length': True,
-                        'clue_word': True,
-                        'anagrams': True,
-                        'multi_synonym': False,
-                        'spelling': False,
-                        'multiword': False}
-    elif args.variant == 4:
-        enhancements = {'length': True,
-                        'clue_word': True,
-                        'anagrams': True,
-                        'multi_synonym': True,
-                        'spelling': False,
-                        'multiword': False}
-    elif args.variant == 5:
-        enhancements = {'length': True,
-                        'clue_word': True,
-                        'anagrams': True,
-                        'multi_synonym': True,
-                        'spelling': True,
-                        'multiword': False}
-    elif args.variant == 6:
-        enhancements = {'length': True,
-                        'clue_word': True,
-                        'anagrams': True,
-                        'multi_synonym': False,
-                        'spelling': True,
-                        'multiword': False}
-    elif args.variant == 7:
-        enhancements = {'length': True,
-                        'clue_word': True,
-                        'anagrams': True,
-                        'multi_synonym': True,
-                        'spelling': True,
-                        'multiword': True}
-    elif args.variant == 8:
-        enhancements = {'length': True,
-                        'clue_word': True,
-                        'anagrams': True,
-                        'multi_synonym': False,
-                        'spelling': True,
-                        'multiword': True}
+    if args.variant is None:
+        enhancements = DEFAULT_ENHANCEMENTS
+    elif 0 <= args.variant < len(VARIANTS):
+        enhancements = VARIANTS[args.variant]
     else:
-        msg = f'Unknown variant "{args.variant}" (must be between 0 and 8)'
+        msg = f'Unknown variant "{args.variant}" (must be between 0 and {len(VARIANTS) - 1})'
         raise ValueError(msg)
     
+    # Load the W2V model (from the compiled store if possible) while the dataset is loaded and its
+    # clues are mapped to vocabulary ids in the background. British spellings are added as aliases,
+    # if requested
+    filepath = f'./data/{args.filename}-entries.json'
+    model, data, vectorizer, timer = start(filepath, w2v_path, args.store, wordpairs, spelling=enhancements['spelling'],
+                                           precision=args.precision, pca=args.pca)
+    print('Startup stages:')
+    timer.report()
+    
     # Save current time. Used for metrics
     start_time = time.time()
     
-    # Add embeddings for British spellings of words, if requested
-    if enhancements['spelling']:
-        model = key_adder(model, wordpairs)
-        dur = time.time() - start_time
-        print(f'British spellings added to model in {dur/60} mins.')
-    
     # Run model
     keys = list(data.keys())
-    metrics, errs, runs = master_base(model, data, keys, pooling='mean', version=2, topn=100000, verbose=2,
-                                      enhancements={'length': True,
-                                                    'clue_word': True,
-                                                    'anagrams': True,
-                                                    'multi_synonym': False,
-                                                    'multiword': True})
+    run_args = dict(pooling='mean', version=2, topn=100000, verbose=2, enhancements=enhancements,
+                    batch=args.batch, rank_only=args.rank_only, nprobe=args.nprobe)
+    profiler = Profiler() if args.profile is not None else None
+    if args.workers > 1:
+        metrics, errs, runs = parallel_base(model, data, keys, args.workers, **run_args)
+    else:
+        metrics, errs, runs = master_base(model, data, keys, vectorizer=vectorizer, profiler=profiler, **run_args)
     
     print_metrics(metrics, runs)
+    print_depths(errs[6])
+    
+    # Per-stage profile, next to the metrics
+    if profiler is not None:
+        profiler.print_report()
+        variant = 'default' if args.variant is None else args.variant
+        profile_path = args.profile or f'./{args.filename}-variant{variant}-profile.json'
+        profiler.write(profile_path, dataset=args.filename, variant=variant, clues=runs,
+                       startup=timer.times, metrics={'accuracy_at_1': metrics[4]/runs, 'accuracy_at_10': metrics[0]/runs,
+                                                     'accuracy_at_100': metrics[1]/runs})
+        print(f'Profile written to "{profile_path}"')
     end_time = time.time()
     print(f"Process finished --- {(end_time-start_time)/60:.1f} minutes ---")
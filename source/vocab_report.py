@@ -0,0 +1,104 @@
+import argparse
+import collections
+import glob
+import json
+import os
+import time
+
+from models.metrics import answer_word
+from models.spelling import read_wordpairs
+from models.store import read_store_vocab, spelling_aliases
+from models.w2v_reader import read_vocab
+
+
+def dataset_report(data, vocab, lower_vocab):
+    """Out-of-vocabulary counts for the clues and solutions of a dataset, as tracked by 'master_base'
+    in its errors, and the number of answers that no candidate can match"""
+    clue_tokens = clue_oov = sol_tokens = sol_oov = unreachable = clues = 0
+    oov_words = collections.Counter()
+    for entry in data.values():
+        clue, solution = entry['all_synonyms'], entry['tokenized_solution']
+        if clue is None:
+            continue
+        clues += 1
+        missing = [word for word in clue if word not in vocab]
+        clue_tokens += len(clue)
+        clue_oov += len(missing)
+        oov_words.update(missing)
+        sol_tokens += len(solution)
+        sol_oov += sum(word not in vocab for word in solution)
+        unreachable += answer_word(solution, True) not in lower_vocab
+
+    return {'clues': clues,
+            'clue_tokens': clue_tokens, 'clue_oov': clue_oov,
+            'solution_tokens': sol_tokens, 'solution_oov': sol_oov,
+            'unreachable_answers': unreachable,
+            'top_oov': oov_words.most_common(10)}
+
+
+if __name__ == '__main__':
+    script_desc = 'Report out-of-vocabulary clue and solution words and British spelling coverage, reading only the W2V vocabulary'
+    parser = argparse.ArgumentParser(description=script_desc)
+    parser.add_argument('--model', dest='model', type=str, default='./data/GoogleNews-vectors-negative300.bin.gz',
+                        help='Path to the word2vec binary, used if there is no compiled store')
+    parser.add_argument('--store', dest='store', type=str, default='./data/GoogleNews-store',
+                        help='Compiled model store to read the vocabulary from (see build_store.py)')
+    parser.add_argument('--spelling', dest='spelling', action='store_true',
+                        help='Include British spellings in the vocabulary, as in variants 5 to 8')
+    parser.add_argument('--datasets', dest='datasets', nargs='+', default=None,
+                        help='Datasets to check, e.g. gquick-100. Defaults to every gquick set in \'./data\'')
+    parser.add_argument('--output', dest='output', type=str, default=None,
+                        help='Also write the report to this JSON file')
+    args = parser.parse_args()
+    wordpairs = read_wordpairs()
+
+    start_time = time.time()
+    if os.path.isfile(os.path.join(args.store, 'meta.json')):
+        base_words = read_store_vocab(args.store, spelling=False)
+        brit_words = read_store_vocab(args.store)[len(base_words):]
+    else:
+        base_words = read_vocab(args.model)
+        brit_words = spelling_aliases(base_words, dict(zip(base_words, range(len(base_words)))), wordpairs)[0]
+    words = base_words + brit_words if args.spelling else base_words
+    vocab = set(words)
+    lower_vocab = set(word.lower() for word in words)
+    print(f'Read {len(words)} words in {time.time()-start_time:.1f} s')
+
+    # British spelling coverage
+    base = set(base_words)
+    brits = set(brit for brit, _ in wordpairs)
+    amers = set(amer for _, amer in wordpairs)
+    spelling = {'pairs': len(wordpairs),
+                'american_in_vocab': len(amers & base), 'american_missing': len(amers - base),
+                'british_in_vocab': len(brits & base), 'british_aliases': len(brit_words)}
+    print('Spelling pairs:')
+    for name, value in spelling.items():
+        print(f'  {name}: {value}')
+
+    datasets = args.datasets
+    if datasets is None:
+        paths = glob.glob('./data/gquick-*-entries.json')
+        datasets = sorted((os.path.basename(path)[:-len('-entries.json')] for path in paths),
+                          key=lambda name: int(name.split('-')[1]))
+
+    report = {'vocabulary': len(words), 'spelling': spelling, 'datasets': {}}
+    for dataset in datasets:
+        with open(f'./data/{dataset}-entries.json', 'r') as file:
+            data = json.load(file)
+        result = dataset_report(data, vocab, lower_vocab)
+        report['datasets'][dataset] = result
+
+        print(dataset)
+        print(f'  Clue words not in vocabulary: {result["clue_oov"]} of {result["clue_tokens"]} '
+              f'({result["clue_oov"] / max(result["clue_tokens"], 1):.2%})')
+        print(f'  Solution words not in vocabulary: {result["solution_oov"]} of {result["solution_tokens"]} '
+              f'({result["solution_oov"] / max(result["solution_tokens"], 1):.2%})')
+        print(f'  Answers no candidate can match: {result["unreachable_answers"]} of {result["clues"]} '
+              f'({result["unreachable_answers"] / max(result["clues"], 1):.2%})')
+        common = ', '.join(f'{word!r} ({n})' for word, n in result['top_oov'])
+        print(f'  Most common missing clue words: {common}')
+
+    print(f'Finished in {time.time()-start_time:.1f} s')
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,82 @@
+import json
+import os
+import string
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'source'))
+
+# British spellings added as aliases of the American words of the tiny model
+WORDPAIRS = [('colour', 'color'), ('centre', 'center'), ('organise', 'organize'), ('analyse', 'analyze'),
+             ('favourite', 'favorite')]
+
+
+def write_word2vec(path, words, vectors, newline=False):
+    """Write a binary word2vec file, with a newline after every vector if 'newline'"""
+    with open(path, 'wb') as file:
+        file.write(f'{len(words)} {vectors.shape[1]}\n'.encode())
+        for word, vector in zip(words, vectors):
+            file.write(word.encode('utf-8') + b' ' + vector.astype('<f4').tobytes() + (b'\n' if newline else b''))
+
+
+@pytest.fixture(scope='session')
+def entries():
+    """Clues of 'gquick-100' with a few hundred of its entries, including every anagram clue"""
+    with open(os.path.join(ROOT, 'data', 'gquick-100-entries.json'), 'r') as file:
+        data = json.load(file)
+    keys = list(data)[:200] + [key for key in data if data[key]['anagram'] is not None]
+    return {key: data[key] for key in dict.fromkeys(keys)}
+
+
+@pytest.fixture(scope='session')
+def tiny_vocab(entries):
+    """Words and vectors of a tiny model covering the clues of 'entries'
+
+    Every clue word is in the vocabulary, with a capitalised variant, among random filler words. The
+    solution of every clue is placed near the mean of its clue words, with more noise for some clues
+    than others, so that the correct answers are spread over many ranks.
+    """
+    rng = np.random.default_rng(0)
+    words = []
+    for entry in entries.values():
+        for word in (entry['all_synonyms'] or []) + entry['tokenized_solution'] + [entry['underscored_solution']]:
+            words += [word, word.capitalize()]
+        for synonym in entry['synonyms'] or []:
+            words += synonym
+    words += [american for _, american in WORDPAIRS]
+    words += [''.join(rng.choice(list(string.ascii_lowercase), rng.integers(3, 12))) for _ in range(2000)]
+    words = list(dict.fromkeys(word for word in words if word and ' ' not in word))
+
+    dim = 32
+    vectors = rng.standard_normal((len(words), dim)).astype(np.float32)
+    index = {word: i for i, word in enumerate(words)}
+    for entry in entries.values():
+        clue = [index[word] for word in entry['all_synonyms'] or [] if word in index]
+        if clue and entry['underscored_solution'] in index:
+            noise = rng.choice([0.1, 0.5, 1.0, 2.0])
+            vectors[index[entry['underscored_solution']]] = (vectors[clue].mean(axis=0)
+                                                             + noise * rng.standard_normal(dim))
+    return words, vectors
+
+
+@pytest.fixture(scope='session')
+def wordpairs():
+    return WORDPAIRS
+
+
+@pytest.fixture(scope='session')
+def tiny_model_path(tiny_vocab, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('model') / 'tiny.bin')
+    write_word2vec(path, *tiny_vocab)
+    return path
+
+
+@pytest.fixture
+def tiny_model(tiny_model_path):
+    """The tiny model as an in-memory 'EmbeddingStore', read afresh for every test"""
+    from models.store import EmbeddingStore
+
+    return EmbeddingStore.from_word2vec(tiny_model_path)
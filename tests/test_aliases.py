@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from models.nbow import key_adder, master_base
+from models.retrieval import alias_topk, batch_topk
+from models.solver import VARIANTS
+from models.store import EmbeddingStore
+
+
+@pytest.fixture(scope='module')
+def matrix():
+    """Rows, aliases and queries whose scores are exact in float32, so that an alias and a copy of its
+    row always tie, and whose rows never tie with each other"""
+    rng = np.random.default_rng(0)
+    vectors = rng.integers(-2**15, 2**15, (400, 16)).astype(np.float32)
+    aliases = rng.choice(len(vectors), 60)
+    # Entries of +-1 have a norm of 4, so the normalised queries are exact too
+    queries = rng.choice([-1.0, 1.0], (5, 16)).astype(np.float32)
+    scores = queries @ vectors.T
+    assert all(len(np.unique(row)) == len(vectors) for row in scores)
+    return vectors, aliases, queries
+
+
+@pytest.mark.parametrize('k', [1, 10, 100, 460])
+@pytest.mark.parametrize('memory_budget', [2**30, 2**14])
+def test_alias_topk_matches_copied_rows(matrix, k, memory_budget):
+    vectors, aliases, queries = matrix
+    copied = np.concatenate([vectors, vectors[aliases]])
+
+    ids, scores = alias_topk(vectors, queries, k, memory_budget, aliases=aliases)
+    expected_ids, expected_scores = batch_topk(copied, queries, k, memory_budget)
+
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_array_equal(scores, expected_scores)
+
+
+@pytest.mark.parametrize('k', [1, 10, 100])
+def test_alias_topk_matches_copied_rows_with_restricted_rows(matrix, k):
+    vectors, aliases, queries = matrix
+    copied = np.concatenate([vectors, vectors[aliases]])
+    # Some aliases are searched without their row, and some rows without their aliases
+    rows = np.sort(np.random.default_rng(1).choice(len(copied), 150, replace=False))
+
+    ids, scores = alias_topk(vectors, queries, k, rows=rows, aliases=aliases)
+    expected_ids, expected_scores = batch_topk(copied, queries, k, rows=rows)
+
+    for q_ids, q_scores, e_ids, e_scores in zip(ids, scores, expected_ids, expected_scores):
+        np.testing.assert_array_equal(q_ids, e_ids)
+        np.testing.assert_array_equal(q_scores, e_scores)
+
+
+def copied_model(w2v_model, wordpairs):
+    """The model with the British spellings of 'wordpairs' added as copies of their American rows"""
+    keys = list(w2v_model.index_to_key)
+    index = w2v_model.key_to_index
+    pairs = [(british, index[american]) for british, american in wordpairs
+             if american in index and british not in index]
+    rows = [row for _, row in pairs]
+    return EmbeddingStore.from_arrays(np.concatenate([w2v_model.vectors, w2v_model.vectors[rows]]),
+                                      np.concatenate([w2v_model.norms, w2v_model.norms[rows]]),
+                                      keys + [british for british, _ in pairs])
+
+
+def test_spelling_aliases_match_copied_vectors(tiny_model, entries, wordpairs):
+    copied = copied_model(tiny_model, wordpairs)
+    aliased = key_adder(tiny_model, wordpairs)
+    assert aliased.index_to_key == copied.index_to_key
+    assert len(aliased.vectors) < len(copied.vectors)
+
+    for word in ['color', 'centre', 'analyse']:
+        expected = copied.similar_by_vector(copied[word], topn=20)
+        result = aliased.similar_by_vector(aliased[word], topn=20)
+        assert result.words() == expected.words()
+        np.testing.assert_allclose(result.scores, expected.scores, rtol=1e-6)
+
+    for variant in (5, 8):
+        args = dict(pooling='mean', version=2, topn=100000, verbose=0, enhancements=VARIANTS[variant])
+        assert (master_base(aliased, entries, list(entries), **args)
+                == master_base(copied, entries, list(entries), **args))
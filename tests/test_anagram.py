@@ -0,0 +1,42 @@
+import itertools
+
+import numpy as np
+
+from models.anagram import AnagramSolver
+
+
+def permutations(letters):
+    return [''.join(p) for p in itertools.permutations(letters)]
+
+
+def test_top_phrases_keeps_the_best_of_more_than_limit():
+    # 2 * 24 * 24 phrases of two four-letter words, far more than are kept
+    words = permutations('abcd') + permutations('efgh') + ['Abcd', 'xyzw']
+    solver = AnagramSolver(words)
+    phrases = solver.solve('hgfe dcba', [4, 4])
+    assert len(phrases) == 2 * 24 * 24
+
+    # The best phrase is the last one found, so truncating before scoring would drop it
+    target = phrases[-1]
+    rng = np.random.default_rng(0)
+    noise = {phrase: value for phrase, value in zip(phrases, rng.random(len(phrases)).astype(np.float32))}
+    score = lambda found: np.array([2.0 if tuple(p) == target else noise[tuple(p)] for p in found.tolist()],
+                                   dtype=np.float32)
+
+    found, scores, n_found = solver.top_phrases('hgfe dcba', [4, 4], score, limit=10)
+    assert n_found == len(phrases)
+    assert tuple(found[0].tolist()) == target and scores[0] == 2.0
+    assert target not in solver.solve('hgfe dcba', [4, 4], limit=10)
+
+    # The same as scoring every phrase and sorting
+    all_scores = score(np.array(phrases))
+    order = np.argsort(-all_scores, kind='stable')[:10]
+    np.testing.assert_array_equal(found, np.array(phrases)[order])
+    np.testing.assert_array_equal(scores, all_scores[order])
+
+
+def test_top_phrases_of_fodder_without_phrases():
+    solver = AnagramSolver(['abcd', 'efgh'])
+    found, scores, n_found = solver.top_phrases('abcdefgx', [4, 4], lambda found: np.zeros(len(found)))
+
+    assert found.shape == (0, 2) and len(scores) == 0 and n_found == 0
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from models.ann import IVFPQIndex, ivfpq_topk
+from models.retrieval import batch_topk
+
+N_LISTS = 32
+
+
+@pytest.fixture(scope='module')
+def matrix():
+    """Normalised rows around 50 random centres, an index over them, and queries near some of the rows"""
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((50, 32))
+    vectors = (centres[rng.integers(0, 50, 3000)] + 0.5 * rng.standard_normal((3000, 32))).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[rng.choice(len(vectors), 50)] + 0.3 * rng.standard_normal((50, 32)).astype(np.float32)
+    return vectors, IVFPQIndex.build(vectors, n_lists=N_LISTS, n_iter=10), queries
+
+
+def recall(ids, expected_ids):
+    return np.mean([len(np.intersect1d(q_ids, e_ids)) / len(e_ids) for q_ids, e_ids in zip(ids, expected_ids)])
+
+
+def test_ivfpq_recall(matrix):
+    vectors, index, queries = matrix
+    expected_ids, _ = batch_topk(vectors, queries, 10)
+
+    recalls = [recall(ivfpq_topk(vectors, queries, 10, index=index, nprobe=nprobe, rerank=100)[0], expected_ids)
+               for nprobe in (1, 2, 4, 8, N_LISTS)]
+    assert recalls == sorted(recalls)
+    assert recalls[3] >= 0.9
+
+
+def test_ivfpq_scanning_every_list_is_exact(matrix):
+    vectors, index, queries = matrix
+    ids, scores = ivfpq_topk(vectors, queries, 10, index=index, nprobe=N_LISTS, rerank=len(vectors))
+    expected_ids, expected_scores = batch_topk(vectors, queries, 10)
+
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+def test_ivfpq_with_restricted_rows(matrix):
+    vectors, index, queries = matrix
+    rows = np.sort(np.random.default_rng(1).choice(len(vectors), 1000, replace=False))
+    expected_ids, expected_scores = batch_topk(vectors, queries, 10, rows=rows)
+
+    # More rows than 8 lists hold are searched through the index, masked to 'rows'
+    assert len(rows) > index.probe_size(8)
+    ids, _ = ivfpq_topk(vectors, queries, 10, rows=rows, index=index, nprobe=8, rerank=100)
+    assert all(np.isin(q_ids, rows).all() for q_ids in ids)
+    assert recall(ids, expected_ids) >= 0.9
+
+    # Fewer rows than every list holds are searched exactly
+    ids, scores = ivfpq_topk(vectors, queries, 10, rows=rows, index=index, nprobe=N_LISTS)
+    for q_ids, q_scores, e_ids, e_scores in zip(ids, scores, expected_ids, expected_scores):
+        np.testing.assert_array_equal(q_ids, e_ids)
+        np.testing.assert_allclose(q_scores, e_scores, rtol=1e-5)
+
+
+def test_ivfpq_save_and_load(matrix, tmp_path):
+    vectors, index, queries = matrix
+    index.save(str(tmp_path))
+    loaded = IVFPQIndex.load(str(tmp_path))
+
+    for nprobe in (1, 8):
+        ids, scores = ivfpq_topk(vectors, queries, 10, index=index, nprobe=nprobe, rerank=100)
+        loaded_ids, loaded_scores = ivfpq_topk(vectors, queries, 10, index=loaded, nprobe=nprobe, rerank=100)
+        np.testing.assert_array_equal(loaded_ids, ids)
+        np.testing.assert_array_equal(loaded_scores, scores)
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from models.filters import FilterPipeline
+from models.solver import VARIANTS
+from models.util import anagram_filterer, len_filterer, len_filterer_multi, pretty_len_filterer, word_remover
+from models.vocab_index import CanonicalVocab, VocabIndex
+
+
+def util_filters(words, entry, clue, enhancements):
+    """Words kept by the filters of the original 'nbow.master_base', in the same order"""
+    top_list = words
+    top_l = word_remover(words, clue) if enhancements['clue_word'] == True else words
+    if enhancements['length'] == True:
+        if enhancements['multiword'] != True:
+            top_list = len_filterer(top_l, len(entry['pretty_solution']))
+        else:
+            top_l = pretty_len_filterer(top_l, len(entry['pretty_solution']))
+            top_list = len_filterer_multi(top_l, entry['token_lengths'])
+    if enhancements['anagrams'] == True and entry['anagram'] != None:
+        top_list = anagram_filterer(top_list, entry['anagram'].lower())
+    return [str(word) for word in top_list]
+
+
+@pytest.fixture(scope='module')
+def pipeline(tiny_vocab):
+    words, _ = tiny_vocab
+    canonical = CanonicalVocab(words)
+    vocab_index = VocabIndex.from_words(words)
+    return canonical, vocab_index, FilterPipeline(canonical, vocab_index)
+
+
+def restrictions(enhancements):
+    return dict(length=enhancements['length'], multiword=enhancements['multiword'],
+                anagrams=enhancements['anagrams'])
+
+
+@pytest.mark.parametrize('variant', range(len(VARIANTS)))
+def test_filter_masks_match_util_filters(pipeline, entries, variant):
+    canonical, vocab_index, filters = pipeline
+    enhancements = dict(VARIANTS[variant], anagrams=False)
+    forms = list(canonical.forms)
+
+    kept = 0
+    for entry in entries.values():
+        clue = entry['all_synonyms'] or []
+        # Words outside the vocabulary stand for negative ids: a clue word, a phrase of the solution's
+        # shape and one that never passes the length filter
+        extra = clue[:1] + ['_'.join('x' * n for n in entry['token_lengths']), 'not_a_word_of_any_clue']
+        ids = np.concatenate([np.arange(len(forms)), -np.arange(1, len(extra) + 1)])
+
+        mask = filters.mask(ids, filters.stages(entry, clue, enhancements, extra))
+        words = [forms[i] if i >= 0 else extra[-i - 1] for i in ids[mask]]
+        assert words == util_filters(forms + extra, entry, clue, enhancements)
+        kept += len(words)
+
+        # Searching only the candidate rows drops no word that the filters keep
+        rows = vocab_index.candidate_rows(entry, **restrictions(enhancements))
+        if rows is not None:
+            assert np.isin(ids[mask & (ids >= 0)], canonical.ids[rows]).all()
+    assert kept > 0
+
+
+@pytest.mark.parametrize('variant', [variant for variant, enhancements in enumerate(VARIANTS)
+                                     if enhancements['anagrams']])
+def test_anagram_rows_match_anagram_filterer(pipeline, entries, variant):
+    canonical, vocab_index, filters = pipeline
+    enhancements = VARIANTS[variant]
+    forms = list(canonical.forms)
+
+    anagram_entries = [entry for entry in entries.values() if entry['anagram'] is not None]
+    kept = 0
+    for entry in anagram_entries:
+        clue = entry['all_synonyms'] or []
+        ids = np.unique(canonical.ids[vocab_index.candidate_rows(entry, **restrictions(enhancements))])
+        ids = ids[filters.mask(ids, filters.stages(entry, clue, enhancements))]
+
+        # 'anagram_filterer' keeps words without their underscores
+        assert [forms[i].replace('_', '') for i in ids] == util_filters(forms, entry, clue, enhancements)
+        kept += len(ids)
+    assert kept > 0
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from models.fusion import depth_thresholds, fuse, ranking_members
+
+
+def brute_force_fuse(scores, k, depth, method='sum', rrf_k=60):
+    """'fuse' by sorting every ranking in full, as the original string intersection did"""
+    n_lists, n_rows = scores.shape
+    depth = min(depth, n_rows)
+    orders = [np.argsort(-row, kind='stable') for row in scores]
+    kept = set(orders[0][:depth].tolist())
+    for order in orders[1:]:
+        kept &= set(order[:depth].tolist())
+    ids = np.array(sorted(kept), dtype=np.int64)
+
+    if method == 'rrf':
+        ranks = np.empty(scores.shape, dtype=np.int64)
+        for j, order in enumerate(orders):
+            ranks[j, order] = np.arange(1, n_rows + 1)
+        fused = (1.0 / (rrf_k + ranks[:, ids])).sum(axis=0).astype(np.float32)
+    elif method == 'sum':
+        fused = scores[:, ids].sum(axis=0)
+    else:
+        fused = scores[:, ids].min(axis=0)
+
+    order = np.lexsort((ids, -fused))[:k]
+    return ids[order], fused[order]
+
+
+@pytest.mark.parametrize('method', ['sum', 'min', 'rrf'])
+@pytest.mark.parametrize('n_lists', [2, 3, 5])
+@pytest.mark.parametrize('k, depth', [(1, 50), (10, 500), (100, 2000), (1000, 5000), (20000, 20000)])
+def test_fuse_matches_brute_force(method, n_lists, k, depth):
+    rng = np.random.default_rng(n_lists * 1000 + k)
+    # Rankings of synonyms of one clue are correlated, so the intersection is not empty
+    common = rng.standard_normal(20000).astype(np.float32)
+    scores = common + 0.5 * rng.standard_normal((n_lists, 20000)).astype(np.float32)
+
+    ids, fused = fuse(scores, k, depth, method=method)
+    expected_ids, expected_fused = brute_force_fuse(scores, k, depth, method=method)
+
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(fused, expected_fused, rtol=1e-6)
+
+
+@pytest.mark.parametrize('method', ['sum', 'min', 'rrf'])
+def test_fuse_to_growing_depths_gives_prefixes(method):
+    rng = np.random.default_rng(1)
+    common = rng.standard_normal(50000).astype(np.float32)
+    scores = common + 0.7 * rng.standard_normal((2, 50000)).astype(np.float32)
+    thresholds = depth_thresholds(scores, 20000)
+    members = ranking_members(scores, thresholds)
+
+    ids, fused = fuse(scores, 20000, 20000, method=method)
+    for k in [1, 500, 2000, 8000]:
+        prefix_ids, prefix_fused = fuse(scores, k, 20000, method=method, thresholds=thresholds, members=members)
+        np.testing.assert_array_equal(prefix_ids, ids[:k])
+        np.testing.assert_array_equal(prefix_fused, fused[:k])
+
+
+def test_fuse_without_intersection_is_empty():
+    scores = np.array([[1.0, 0.9, 0.1, 0.0], [0.0, 0.1, 0.9, 1.0]], dtype=np.float32)
+    ids, fused = fuse(scores, 10, 2)
+
+    assert len(ids) == 0 and len(fused) == 0
+
+
+def string_intersection(keyed_vectors, syn_vecs, n):
+    """Words of the original 'nbow.multi_synonym': each synonym's top 'n' words, lowercased, intersected
+    and ranked by the sum of the scores of their best-ranked variants"""
+    words, scores = [], []
+    for syn_vec in syn_vecs:
+        top_n = keyed_vectors.similar_by_vector(syn_vec, topn=n, restrict_vocab=None)
+        words.append([word.lower() for word, _ in top_n])
+        scores.append([score for _, score in top_n])
+    common = words[0]
+    for word_list in words[1:]:
+        common = np.intersect1d(common, word_list)
+    fused = np.zeros(len(common))
+    for word_list, score_list in zip(words, scores):
+        fused += np.take(score_list, np.intersect1d(word_list, common, return_indices=True)[1])
+    return dict(zip(common.tolist(), fused.tolist()))
+
+
+def test_multi_synonym_matches_string_intersection(tiny_model, tiny_model_path, entries):
+    from gensim.models import KeyedVectors
+
+    from models.nbow import multi_synonym_ids
+    from models.vectorize import ClueVectorizer
+    from models.vocab_index import CanonicalVocab
+
+    keyed_vectors = KeyedVectors.load_word2vec_format(tiny_model_path, binary=True)
+    vectorizer = ClueVectorizer(tiny_model)
+    forms = CanonicalVocab.from_model(tiny_model).forms
+    clues = [entry['synonyms'] for entry in entries.values() if entry['synonyms'] and len(entry['synonyms']) > 1]
+    assert len(clues) > 10
+
+    merged = 0
+    for synonyms in clues:
+        syn_vecs, _ = vectorizer.vectorize_batch(synonyms, pooling='mean')
+        expected = string_intersection(keyed_vectors, syn_vecs, 300)
+        ids, fused = multi_synonym_ids(tiny_model, synonyms, 300, 'mean', k=len(forms), vectorizer=vectorizer)
+
+        words = [forms[i] for i in ids]
+        assert sorted(words) == sorted(expected)
+        np.testing.assert_allclose(fused, [expected[word] for word in words], rtol=1e-5)
+        assert np.all(np.diff(fused) <= 0)
+        # Words whose case variants were ranked apart by some synonym
+        merged += sum(word.capitalize() in keyed_vectors.key_to_index for word in words)
+    assert merged > 0
@@ -0,0 +1,22 @@
+from models.nbow import master_base
+from models.profiling import Profiler
+from models.solver import VARIANTS
+
+
+def test_profiler_times_the_multi_synonym_stage(tiny_model, entries):
+    key = next(key for key, entry in entries.items()
+               if entry['synonyms'] and len(entry['synonyms']) > 1 and entry['anagram'] is None)
+    profiler = Profiler()
+    master_base(tiny_model, entries, [key], pooling='mean', version=2, topn=100000, verbose=0,
+                enhancements=VARIANTS[7], profiler=profiler)
+
+    # The fusion is timed as the clue's multi_synonym stage, and replaces retrieval
+    assert len(profiler.latencies['multi_synonym']) == 1
+    assert profiler.latencies['multi_synonym'][0] > 0
+    [(n_in, n_out)] = profiler.counts['multi_synonym']
+    assert n_in == 0 and n_out > 0
+    assert 'retrieve' not in profiler.latencies and 'dedupe' not in profiler.latencies
+    assert profiler.counts['clue_word'][0][0] == n_out
+
+    report = profiler.report()['multi_synonym']
+    assert report['clues'] == 1 and report['candidates_out'] == n_out
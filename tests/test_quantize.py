@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from models.nbow import multi_synonym_ids
+from models.quantize import quantize_rows, two_stage_topk, write_quantized
+from models.retrieval import batch_topk
+from models.store import EmbeddingStore, build_store
+from models.vectorize import ClueVectorizer
+
+
+@pytest.fixture(scope='module')
+def store_dir(tiny_model_path, wordpairs, tmp_path_factory):
+    """Compiled store of the tiny model, with float16 and int8 matrices"""
+    store_dir = str(tmp_path_factory.mktemp('store') / 'tiny')
+    build_store(tiny_model_path, store_dir, wordpairs)
+    for precision in ('float16', 'int8'):
+        write_quantized(store_dir, precision)
+    return store_dir
+
+
+@pytest.mark.parametrize('precision', ['float16', 'int8'])
+def test_quantized_round_trip(store_dir, precision):
+    exact = EmbeddingStore(store_dir)
+    coarse = EmbeddingStore(store_dir, precision=precision)
+    vectors = np.asarray(exact.vectors)
+
+    rows = np.asarray(coarse.coarse, dtype=np.float32)
+    if precision == 'int8':
+        # Every component is within half a step of the row's scale
+        rows *= coarse.scales[:, None]
+        assert np.all(np.abs(rows - vectors) <= coarse.scales[:, None] / 2 * (1 + 1e-5))
+    else:
+        np.testing.assert_allclose(rows, vectors, rtol=2**-11, atol=2**-24)
+    assert np.all(np.abs(np.linalg.norm(rows, axis=1) - 1) < 0.02)
+
+
+def test_quantize_rows_of_zero_row():
+    codes, scales = quantize_rows(np.zeros((2, 8), dtype=np.float32), 'int8')
+    assert not codes.any() and not scales.any()
+
+
+@pytest.mark.parametrize('precision', ['float16', 'int8'])
+@pytest.mark.parametrize('rerank', [50, 4096])
+def test_two_stage_topk_matches_exact_search(store_dir, precision, rerank):
+    store = EmbeddingStore(store_dir, precision=precision)
+    queries = np.random.default_rng(0).standard_normal((20, store.vector_size)).astype(np.float32)
+
+    ids, scores = two_stage_topk(store.vectors, queries, 10, coarse=store.coarse, scales=store.scales,
+                                 rerank=rerank)
+    expected_ids, expected_scores = batch_topk(store.vectors, queries, 10)
+
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+@pytest.mark.parametrize('precision', ['float16', 'int8'])
+@pytest.mark.parametrize('method', ['sum', 'min'])
+def test_rescored_fusion_matches_exact_fusion(store_dir, entries, precision, method):
+    exact = EmbeddingStore(store_dir)
+    coarse = EmbeddingStore(store_dir, precision=precision)
+    vectorizer = ClueVectorizer(exact)
+    clues = [entry['synonyms'] for entry in entries.values() if entry['synonyms'] and len(entry['synonyms']) > 1]
+
+    found = total = 0
+    for synonyms in clues:
+        expected_ids, expected_fused = multi_synonym_ids(exact, synonyms, 300, 'mean', k=10, method=method,
+                                                         vectorizer=vectorizer)
+        ids, fused = multi_synonym_ids(coarse, synonyms, 300, 'mean', k=10, method=method,
+                                       vectorizer=vectorizer)
+        # The head is rescored exactly, so words found by both have the same fused scores and order
+        common, at, expected_at = np.intersect1d(ids, expected_ids, return_indices=True)
+        np.testing.assert_allclose(fused[at], expected_fused[expected_at], rtol=1e-5)
+        assert np.all(np.diff(fused) <= 0)
+        found += len(common)
+        total += len(expected_ids)
+    # Only a word near the depth of some synonym's ranking can be kept or dropped by the coarse scores
+    assert found >= 0.98 * total
@@ -0,0 +1,26 @@
+import pytest
+
+from models.nbow import key_adder, master_base
+from models.solver import VARIANTS
+
+
+def run(model, entries, variant, **kwargs):
+    metrics, errors, pairs = master_base(model, entries, list(entries), pooling='mean', version=2, topn=100000,
+                                         verbose=0, enhancements=VARIANTS[variant], **kwargs)
+    # The last list of errors holds the retrieval depths, which rank-only evaluation does not have
+    return metrics, errors[:6], pairs
+
+
+@pytest.mark.parametrize('variant', range(len(VARIANTS)))
+def test_rank_only_matches_full_search(tiny_model, entries, wordpairs, variant):
+    model = key_adder(tiny_model, wordpairs) if VARIANTS[variant]['spelling'] else tiny_model
+    expected = run(model, entries, variant)
+
+    assert run(model, entries, variant, rank_only=True) == expected
+    # The correct answers are spread over many ranks, so the comparison covers every metric
+    assert 0 < expected[0][4] < expected[0][0] < expected[0][1] < expected[2]
+
+
+@pytest.mark.parametrize('fusion', ['min', 'rrf'])
+def test_rank_only_matches_full_search_with_fusion(tiny_model, entries, fusion):
+    assert run(tiny_model, entries, 7, fusion=fusion, rank_only=True) == run(tiny_model, entries, 7, fusion=fusion)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from models.fusion import fuse
+from models.rankonly import _top_rows
+from models.retrieval import batch_topk
+
+
+@pytest.fixture(scope='module')
+def tied():
+    """Rows and queries with few distinct scores, so that many rows tie at every k-th score. Entries of
+    +-1 give the queries a norm of 4, so the normalised scores are exact and ties are exact too"""
+    rng = np.random.default_rng(0)
+    vectors = rng.integers(-1, 2, (3000, 16)).astype(np.float32)
+    queries = rng.choice([-1.0, 1.0], (6, 16)).astype(np.float32)
+    return vectors, queries
+
+
+@pytest.mark.parametrize('k', [1, 7, 100, 1000])
+@pytest.mark.parametrize('memory_budget', [2**30, 2**16])
+def test_batch_topk_breaks_ties_by_row_id(tied, k, memory_budget):
+    vectors, queries = tied
+    ids, scores = batch_topk(vectors, queries, k, memory_budget)
+
+    for query, query_ids, query_scores in zip(queries, ids, scores):
+        exact = vectors @ (query / np.linalg.norm(query))
+        expected = np.lexsort((np.arange(len(vectors)), -exact))[:k]
+        np.testing.assert_array_equal(query_ids, expected)
+        np.testing.assert_allclose(query_scores, exact[expected], rtol=1e-6)
+
+
+@pytest.mark.parametrize('topn', [1, 50, 999])
+def test_top_rows_breaks_ties_by_row_id(tied, topn):
+    vectors, queries = tied
+    scores = vectors @ queries[0]
+    mask = np.arange(len(scores)) % 3 != 0
+
+    rows = np.flatnonzero(mask)
+    expected = rows[np.lexsort((rows, -scores[rows]))[:topn]]
+    np.testing.assert_array_equal(np.sort(_top_rows(mask, scores, topn)), np.sort(expected))
+
+
+@pytest.mark.parametrize('method', ['sum', 'min', 'rrf'])
+@pytest.mark.parametrize('k', [1, 10, 300])
+def test_fuse_breaks_ties_by_row_id(tied, method, k):
+    vectors, queries = tied
+    scores = queries[:3] @ vectors.T
+    ids, fused = fuse(scores, k, 2000, method=method)
+
+    thresholds = np.sort(scores, axis=1)[:, -2000]
+    kept = np.flatnonzero((scores >= thresholds[:, None]).all(axis=0))
+    assert len(kept) > k
+    if method == 'rrf':
+        # Ranks within each list, ties broken by row id
+        ranks = np.empty(scores.shape, dtype=np.int64)
+        for j, row in enumerate(scores):
+            ranks[j, np.lexsort((np.arange(len(row)), -row))] = np.arange(1, len(row) + 1)
+        expected = (1.0 / (60 + ranks[:, kept])).sum(axis=0).astype(np.float32)
+    elif method == 'sum':
+        expected = scores[:, kept].sum(axis=0)
+    else:
+        expected = scores[:, kept].min(axis=0)
+    order = np.lexsort((kept, -expected))[:k]
+
+    np.testing.assert_array_equal(ids, kept[order])
+    np.testing.assert_allclose(fused, expected[order], rtol=1e-6)
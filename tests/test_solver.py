@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from models.metrics import answer_word
+from models.nbow import key_adder
+from models.solver import VARIANTS, Solver
+
+# Shallow enough that most clues are retrieved at several depths
+START_DEPTH = 16
+MIN_CANDIDATES = 20
+# No filters, single-word anagrams, fused synonym rankings, and multiword answers with and without them
+SOLVER_VARIANTS = [0, 3, 4, 7, 8]
+
+
+def variant_model(tiny_model, wordpairs, variant):
+    return key_adder(tiny_model, wordpairs) if VARIANTS[variant]['spelling'] else tiny_model
+
+
+def assert_same_candidates(solution, expected):
+    np.testing.assert_array_equal(solution.candidates.ids, expected.candidates.ids)
+    # Clues scored together in one matrix product can differ in the last bits
+    np.testing.assert_allclose(solution.candidates.scores, expected.candidates.scores, rtol=1e-5, atol=1e-7)
+    assert solution.candidates.extra == expected.candidates.extra
+
+
+@pytest.mark.parametrize('variant', SOLVER_VARIANTS)
+def test_iter_batch_matches_solve(tiny_model, entries, wordpairs, variant):
+    model = variant_model(tiny_model, wordpairs, variant)
+    solver = Solver(model, VARIANTS[variant], start_depth=START_DEPTH, min_candidates=MIN_CANDIDATES)
+    batch = list(solver.iter_batch(list(entries.values())))
+
+    assert len(batch) == len(entries)
+    for solution, entry in zip(batch, entries.values()):
+        expected = solver.solve(entry)
+        assert_same_candidates(solution, expected)
+        assert (solution.depth, solution.exhausted, solution.no_intersection) == \
+               (expected.depth, expected.exhausted, expected.no_intersection)
+        assert solution.clue_errors == expected.clue_errors
+
+
+@pytest.mark.parametrize('variant', SOLVER_VARIANTS)
+def test_deepening_stops_at_min_candidates(tiny_model, entries, wordpairs, variant):
+    model = variant_model(tiny_model, wordpairs, variant)
+    enhancements = VARIANTS[variant]
+    solver = Solver(model, enhancements, start_depth=START_DEPTH, min_candidates=MIN_CANDIDATES)
+    full = Solver(model, enhancements, start_depth=None, min_candidates=MIN_CANDIDATES)
+
+    deepened = ranked = 0
+    for entry in entries.values():
+        solution, expected = solver.solve(entry), full.solve(entry)
+        n = len(solution)
+
+        # Stops at the first depth with enough candidates, unless there is nothing more to retrieve
+        assert (n >= MIN_CANDIDATES and not solution.partial) or solution.exhausted
+        if solution.depth is not None and solution.depth > START_DEPTH:
+            deepened += 1
+            shallower = Solver(model, enhancements, topn=solution.depth // 4, start_depth=None,
+                               min_candidates=MIN_CANDIDATES).solve(entry)
+            assert len(shallower) < MIN_CANDIDATES or shallower.partial
+
+        # The candidates are the first of those of a search to full depth, so the answer has the same rank
+        if solution.exhausted:
+            assert n == len(expected)
+        np.testing.assert_array_equal(solution.candidates.ids, expected.candidates.ids[:n])
+        np.testing.assert_array_equal(solution.candidates.scores, expected.candidates.scores[:n])
+        answer = answer_word(entry['tokenized_solution'], enhancements['multiword'])
+        rank = full.answer_rank(expected, answer)
+        assert solver.answer_rank(solution, answer) == (rank if rank <= n else 0)
+        ranked += 0 < rank <= n
+    assert deepened > 0 and ranked > 0
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from models.nbow import key_adder
+from models.spelling import generate_wordpairs, read_wordpairs, write_wordpairs
+from models.store import EmbeddingStore, build_store
+from conftest import write_word2vec
+
+# Words each rule should pair up, words it should leave alone, and words outside its patterns
+WORDS = ['realize', 'realizing', 'organization', 'size', 'seize', 'prize', 'analyze', 'color', 'colour',
+         'doctor', 'center', 'centre', 'water', 'catalog', 'catalogue', 'dog', 'traveled', 'travelled',
+         'labeled', 'Color', 'new_york']
+SEED = [('aeroplane', 'airplane'), ('realise', 'realize')]
+
+
+@pytest.fixture(scope='module')
+def pairs():
+    return generate_wordpairs(WORDS, SEED)
+
+
+def test_generate_wordpairs(pairs):
+    wordpairs, counts = pairs
+
+    # 'ize' and 'yze' invent missing British forms, the other rules only pair up words already there
+    assert wordpairs == [('aeroplane', 'airplane'), ('analyse', 'analyze'), ('catalogue', 'catalog'),
+                         ('centre', 'center'), ('colour', 'color'), ('organisation', 'organization'),
+                         ('realise', 'realize'), ('realising', 'realizing'), ('travelled', 'traveled')]
+    assert counts == {'ize': 3, 'yze': 1, 'our': 1, 're': 1, 'ogue': 1, 'lled': 1}
+
+
+def test_seed_pairs_take_precedence():
+    wordpairs, _ = generate_wordpairs(['colour', 'color', 'tumor'], [('colour', 'colorr')])
+    assert wordpairs == [('colour', 'colorr')]
+
+
+def test_wordpairs_round_trip(pairs, tmp_path):
+    path = str(tmp_path / 'wordpairs.txt')
+    write_wordpairs(pairs[0], path)
+    assert read_wordpairs(path) == pairs[0]
+
+
+@pytest.fixture(scope='module')
+def vocab():
+    rng = np.random.default_rng(0)
+    return WORDS, rng.standard_normal((len(WORDS), 8)).astype(np.float32)
+
+
+def check_aliases(store, words, vectors):
+    """Only British forms missing from the vocabulary are aliases, sharing the row of their American form"""
+    index = {word: i for i, word in enumerate(words)}
+    # 'airplane' is not in the vocabulary, so neither is 'aeroplane'
+    assert store.index_to_key == words + ['analyse', 'organisation', 'realise', 'realising']
+    assert list(store.aliases) == [index[word] for word in ['analyze', 'organization', 'realize', 'realizing']]
+    for brit, amer in [('analyse', 'analyze'), ('organisation', 'organization'), ('realise', 'realize')]:
+        np.testing.assert_allclose(store[brit], vectors[index[amer]], rtol=1e-6)
+    # Pairs of the rules that need both forms leave the British word with its own vector
+    for brit in ['colour', 'centre', 'catalogue', 'travelled']:
+        np.testing.assert_allclose(store[brit], vectors[index[brit]], rtol=1e-6)
+
+
+def test_key_adder_aliases(vocab, pairs):
+    words, vectors = vocab
+    store = key_adder(EmbeddingStore.from_arrays(vectors / np.linalg.norm(vectors, axis=1, keepdims=True),
+                                                 np.linalg.norm(vectors, axis=1), words), pairs[0])
+    check_aliases(store, words, vectors)
+
+
+def test_build_store_aliases(vocab, pairs, tmp_path):
+    words, vectors = vocab
+    path = str(tmp_path / 'model.bin')
+    write_word2vec(path, words, vectors)
+    build_store(path, str(tmp_path / 'store'), pairs[0])
+    check_aliases(EmbeddingStore(str(tmp_path / 'store')), words, vectors)
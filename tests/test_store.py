@@ -0,0 +1,24 @@
+import pytest
+
+from models.store import load_model
+
+
+@pytest.mark.parametrize('precision', ['float16', 'int8'])
+def test_load_model_without_store_rejects_quantised_matrix(tiny_model_path, tmp_path, precision):
+    with pytest.raises(FileNotFoundError, match=f'build_store.py --quantize {precision}'):
+        load_model(tiny_model_path, str(tmp_path / 'store'), precision=precision)
+    with pytest.raises(FileNotFoundError, match='No compiled store'):
+        load_model(tiny_model_path, None, precision=precision)
+
+
+def test_load_model_without_store_rejects_pca(tiny_model_path, tmp_path):
+    with pytest.raises(FileNotFoundError, match='build_store.py --pca 16'):
+        load_model(tiny_model_path, str(tmp_path / 'store'), pca=16)
+    with pytest.raises(FileNotFoundError, match='No compiled store'):
+        load_model(tiny_model_path, None, pca=16)
+
+
+def test_load_model_without_store_reads_binary(tiny_model_path, tmp_path):
+    model, from_store = load_model(tiny_model_path, str(tmp_path / 'store'))
+
+    assert not from_store and model.coarse is None
@@ -0,0 +1,47 @@
+import gzip
+import shutil
+
+import numpy as np
+import pytest
+
+from conftest import write_word2vec
+from models.w2v_reader import read_vocab, read_word2vec
+
+gensim_models = pytest.importorskip('gensim.models')
+
+
+@pytest.fixture(params=['plain', 'newline', 'gzip'])
+def model_path(request, tiny_vocab, tmp_path):
+    words, vectors = tiny_vocab
+    # Multi-byte words shift the vectors that follow them off 4-byte alignment
+    words = words + ['café', 'naïve_résumé', 'x']
+    vectors = np.concatenate([vectors, np.random.default_rng(1).standard_normal((3, vectors.shape[1]))])
+    path = str(tmp_path / 'model.bin')
+    write_word2vec(path, words, vectors, newline=request.param == 'newline')
+    if request.param == 'gzip':
+        with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        path += '.gz'
+    return path
+
+
+@pytest.mark.parametrize('limit', [None, 1, 1000])
+@pytest.mark.parametrize('block_size', [64 * 2**20, 1000])
+def test_read_word2vec_matches_gensim(model_path, limit, block_size):
+    expected = gensim_models.KeyedVectors.load_word2vec_format(model_path, binary=True, limit=limit)
+    words, vectors = read_word2vec(model_path, limit=limit, block_size=block_size)
+
+    assert words == expected.index_to_key
+    assert vectors.dtype == np.float32
+    np.testing.assert_array_equal(vectors, expected.vectors)
+    assert read_vocab(model_path, limit=limit) == expected.index_to_key
+
+
+def test_read_word2vec_keep(model_path):
+    expected = gensim_models.KeyedVectors.load_word2vec_format(model_path, binary=True)
+    keep = lambda word: word.islower()
+    words, vectors = read_word2vec(model_path, keep=keep, block_size=1000)
+
+    rows = [i for i, word in enumerate(expected.index_to_key) if keep(word)]
+    assert words == [expected.index_to_key[i] for i in rows]
+    np.testing.assert_array_equal(vectors, expected.vectors[rows])